@@ -1,7 +1,10 @@
 from fastapi import APIRouter
-from .endpoints import sprite, animation
+from .endpoints import sprite, animation, image, job, profile
 
 router = APIRouter()
 
 router.include_router(sprite.router, prefix="/sprites", tags=["sprites"])
-router.include_router(animation.router, prefix="/animations", tags=["animations"]) 
\ No newline at end of file
+router.include_router(animation.router, prefix="/animations", tags=["animations"])
+router.include_router(image.router, prefix="/images", tags=["images"])
+router.include_router(job.router, prefix="/jobs", tags=["jobs"])
+router.include_router(profile.router, prefix="/profiles", tags=["profiles"])
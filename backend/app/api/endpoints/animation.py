@@ -1,17 +1,36 @@
-from fastapi import APIRouter, HTTPException, Depends, Body, Query
-from typing import List, Dict, Any, Optional
+from fastapi import APIRouter, HTTPException, Depends, Body, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from typing import List, Dict, Any, Optional, AsyncIterator
+import json
+import logging
 from ...services.animation_service import AnimationService
+from ...services.job_service import JobService, JobCancelled
+from ...services.idempotency_service import IdempotencyService, IdempotencyError
+from ...services.upstream_service import upstream_lane, upstream_deadline, UpstreamUnavailable, BATCH
+from ...services.admission_service import admit_generation, generation_slot, AdmissionTicket
+from ...constants import MAX_ANIMATION_FRAMES, INTERACTIVE_REQUEST_DEADLINE, BATCH_REQUEST_DEADLINE
 from ...models.animation import Animation
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 # Create Pydantic model for animation generation request
 class AnimationGenerateRequest(BaseModel):
     base_sprite_id: str
     animation_type: str
-    num_frames: int = 4  # Default to 4 frames
+    num_frames: int = Field(4, ge=1, le=MAX_ANIMATION_FRAMES)  # Default to 4 frames
+    num_keyframes: Optional[int] = Field(None, ge=1, description="Frames to generate with the image API; the rest are interpolated locally")
+    interpolation: str = "motion"  # In-between method: motion or crossfade
+    draft: bool = False  # Render at the cheaper, faster draft quality
 
 router = APIRouter()
 animation_service = AnimationService()
+job_service = JobService()
+idempotency_service = IdempotencyService()
+logger = logging.getLogger(__name__)
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 @router.post("/create", response_model=Dict[str, Any])
 async def create_animation(
@@ -33,89 +52,259 @@ async def create_animation(
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/generate", response_model=Dict[str, Any])
-async def generate_animation(request: AnimationGenerateRequest):
+async def generate_animation(request: AnimationGenerateRequest, http_request: Request, response: Response):
     """Generate a complete animation for a sprite"""
+    async def generate():
+        # The slot is only taken when the request runs, not for replayed Idempotency-Key retries
+        async with generation_slot(http_request):
+            # First create an animation
+            animation = await animation_service.create_animation(
+                name=f"{request.animation_type.capitalize()} Animation",
+                base_sprite_id=request.base_sprite_id,
+                animation_type=request.animation_type,
+                fps=12  # Default value
+            )
+        
+            # Then generate the preset frames as batch work, stopping early if the job is cancelled
+            with upstream_lane(BATCH), upstream_deadline(BATCH_REQUEST_DEADLINE):
+                async with job_service.track(http_request, kind="animation") as job:
+                    frames = await animation_service.generate_animation_preset(
+                        animation_id=animation.id,
+                        preset_type=request.animation_type,
+                        num_frames=request.num_frames,
+                        num_keyframes=request.num_keyframes,
+                        interpolation=request.interpolation,
+                        draft=request.draft,
+                        job=job
+                    )
+        
+            # Get the URL of the first frame for preview
+            if frames and len(frames) > 0:
+                url = frames[0].url
+            else:
+                url = None
+        
+            return {
+                "id": animation.id, 
+                "url": url,
+                "frames_count": len(frames),
+                "message": f"Generated {request.animation_type} animation with {len(frames)} frames"
+            }
+    
+    try:
+        # Retries with the same Idempotency-Key get the stored animation instead of a new one
+        return await idempotency_service.run(
+            http_request, response, "animations.generate", request.model_dump(), generate
+        )
+    except HTTPException:
+        raise
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except JobCancelled as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/generate/stream")
+async def generate_animation_stream(
+    request: AnimationGenerateRequest,
+    http_request: Request,
+    ticket: AdmissionTicket = Depends(admit_generation)
+):
+    """
+    Generate a complete animation for a sprite, streaming frames as server-sent events.
+    
+    Events, in order:
+    - animation: {id, job_id, frames_total} once the animation record exists
+    - frame: the stored frame plus {completed, total}, as each frame is persisted
+    - progress: {completed, total} after each frame
+    - error: {detail} if generation fails; frames stored before the failure are kept
+    - cancelled: {detail} if the job is cancelled; frames stored before that are kept
+    - done: {id, frames_count} when every frame has been generated
+    
+    In hybrid mode keyframes arrive before the in-betweens, so clients should
+    place frames by their order.
+    """
     try:
-        # First create an animation
         animation = await animation_service.create_animation(
             name=f"{request.animation_type.capitalize()} Animation",
             base_sprite_id=request.base_sprite_id,
             animation_type=request.animation_type,
             fps=12  # Default value
         )
-        
-        # Then generate the preset frames
-        frames = await animation_service.generate_animation_preset(
-            animation_id=animation.id,
-            preset_type=request.animation_type,
-            num_frames=request.num_frames
-        )
-        
-        # Get the completed animation
-        result = await animation_service.get_animation(animation.id)
-        
-        # Get the URL of the first frame for preview
-        if frames and len(frames) > 0:
-            url = frames[0].url
-        else:
-            url = None
-        
-        return {
-            "id": animation.id, 
-            "url": url,
-            "frames_count": len(frames),
-            "message": f"Generated {request.animation_type} animation with {len(frames)} frames"
-        }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+        
+    async def events() -> AsyncIterator[str]:
+        total = request.num_frames
+        completed = 0
+        try:
+            # Batch work; the stream itself stops when the client disconnects, so only explicit cancels need the job
+            with upstream_lane(BATCH), upstream_deadline(BATCH_REQUEST_DEADLINE):
+                async with job_service.track(http_request, kind="animation", watch_disconnect=False) as job:
+                    yield _sse("animation", {"id": animation.id, "job_id": job.id, "frames_total": total})
+                    async for frame in animation_service.stream_animation_preset(
+                        animation_id=animation.id,
+                        preset_type=request.animation_type,
+                        num_frames=request.num_frames,
+                        num_keyframes=request.num_keyframes,
+                        interpolation=request.interpolation,
+                        draft=request.draft,
+                        job=job
+                    ):
+                        completed += 1
+                        yield _sse("frame", {**animation_service.frame_to_dict(frame), "completed": completed, "total": total})
+                        yield _sse("progress", {"completed": completed, "total": total})
+        except JobCancelled as e:
+            yield _sse("cancelled", {"detail": str(e), "completed": completed})
+            return
+        except Exception as e:
+            logger.error(f"Error streaming animation {animation.id}: {str(e)}")
+            yield _sse("error", {"detail": f"Failed to generate preset animation: {str(e)}", "completed": completed})
+            return
+            
+        yield _sse("done", {"id": animation.id, "frames_count": completed})
+        
+    # The generation slot is held until the stream ends, not just until this function returns
+    ticket.detach()
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Disable proxy buffering so each event reaches the client as soon as it is sent
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(ticket.release)
+    )
 
 @router.post("/frames/generate", response_model=Dict[str, Any])
 async def generate_frame(
+    http_request: Request,
+    response: Response,
     animation_id: str = Body(..., description="ID of the animation"),
     prompt: str = Body(..., description="Description for generating this frame"),
-    order: Optional[int] = Body(None, description="Position in sequence (if None, appends to end)")
+    order: Optional[int] = Body(None, description="Position in sequence (if None, appends to end)"),
+    draft: bool = Body(False, description="Render at the cheaper, faster draft quality")
 ):
     """Generate a new frame for an animation"""
-    try:
-        frame = await animation_service.generate_frame(
-            animation_id=animation_id,
-            prompt=prompt,
-            order=order
-        )
+    async def generate():
+        async with generation_slot(http_request):
+            with upstream_deadline(INTERACTIVE_REQUEST_DEADLINE):
+                frame = await animation_service.generate_frame(
+                    animation_id=animation_id,
+                    prompt=prompt,
+                    order=order,
+                    draft=draft
+                )
         return {
             "id": frame.id,
             "url": frame.url,
             "order": frame.order,
+            "is_draft": frame.is_draft,
             "message": "Frame generated successfully"
         }
+    
+    try:
+        payload = {"animation_id": animation_id, "prompt": prompt, "order": order, "draft": draft}
+        return await idempotency_service.run(http_request, response, "animations.frames.generate", payload, generate)
+    except HTTPException:
+        raise
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/frames/{frame_id}/promote", response_model=Dict[str, Any], dependencies=[Depends(admit_generation)])
+async def promote_frame(frame_id: str):
+    """Re-render a draft frame at final quality"""
+    try:
+        with upstream_deadline(INTERACTIVE_REQUEST_DEADLINE):
+            frame = await animation_service.promote_frame(frame_id)
+        return frame
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-@router.post("/presets/generate", response_model=Dict[str, Any])
+@router.post("/presets/generate", response_model=Dict[str, Any], dependencies=[Depends(admit_generation)])
 async def generate_preset_animation(
+    http_request: Request,
     animation_id: str = Body(..., description="ID of the animation"),
     preset_type: str = Body(..., description="Type of animation (walk, run, idle, jump, etc.)"),
-    num_frames: int = Body(4, description="Number of frames to generate (default 4, max 24)")
+    num_frames: int = Body(4, ge=1, le=MAX_ANIMATION_FRAMES, description="Number of frames to generate (default 4, max 24)"),
+    num_keyframes: Optional[int] = Body(None, ge=1, description="Frames to generate with the image API; the rest are interpolated locally"),
+    interpolation: str = Body("motion", description="In-between method (motion or crossfade)"),
+    draft: bool = Body(False, description="Render at the cheaper, faster draft quality")
 ):
     """Generate a preset animation with multiple frames"""
     try:
-        # Validate frame count
-        if num_frames < 1 or num_frames > 24:
-            raise HTTPException(status_code=400, detail="Number of frames must be between 1 and 24")
-            
-        frames = await animation_service.generate_animation_preset(
-            animation_id=animation_id,
-            preset_type=preset_type,
-            num_frames=num_frames
-        )
+        with upstream_lane(BATCH), upstream_deadline(BATCH_REQUEST_DEADLINE):
+            async with job_service.track(http_request, kind="animation") as job:
+                frames = await animation_service.generate_animation_preset(
+                    animation_id=animation_id,
+                    preset_type=preset_type,
+                    num_frames=num_frames,
+                    num_keyframes=num_keyframes,
+                    interpolation=interpolation,
+                    draft=draft,
+                    job=job
+                )
         return {
             "frames_count": len(frames),
             "animation_id": animation_id,
             "message": f"Generated {len(frames)} frames for {preset_type} animation"
         }
+    except JobCancelled as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/presets/runs/{run_id}", response_model=Dict[str, Any])
+async def get_preset_run(run_id: str):
+    """Get a preset run with the state of each planned frame"""
+    try:
+        run = await animation_service.get_preset_run(run_id)
+        if not run:
+            raise HTTPException(status_code=404, detail="Preset run not found")
+        return run
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/presets/runs/{run_id}/resume", response_model=Dict[str, Any], dependencies=[Depends(admit_generation)])
+async def resume_preset_run(run_id: str, http_request: Request):
+    """Resume a failed or cancelled preset run, generating only its missing frames"""
+    try:
+        with upstream_lane(BATCH), upstream_deadline(BATCH_REQUEST_DEADLINE):
+            async with job_service.track(http_request, kind="animation") as job:
+                frames = await animation_service.resume_preset_run(run_id, job=job)
+        run = await animation_service.get_preset_run(run_id)
+        return {
+            "frames_count": len(frames),
+            "animation_id": run["animation_id"],
+            "run_id": run_id,
+            "message": f"Generated {len(frames)} missing frames for {run['preset_type']} animation"
+        }
+    except JobCancelled as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.get("/{animation_id}/preset-runs", response_model=List[Dict[str, Any]])
+async def get_animation_preset_runs(animation_id: str):
+    """Get the preset runs of an animation, newest first"""
+    try:
+        return await animation_service.get_animation_preset_runs(animation_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{animation_id}", response_model=Dict[str, Any])
 async def get_animation(animation_id: str):
     """Get an animation by ID with all its frames"""
@@ -197,4 +386,17 @@ async def generate_spritesheet(animation_id: str):
         spritesheet = await animation_service.generate_spritesheet(animation_id)
         return spritesheet
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/{animation_id}/preview")
+async def get_animation_preview(
+    animation_id: str,
+    format: str = Query("gif", description="Preview format (gif, webp or apng)"),
+    size: Optional[int] = Query(None, ge=16, le=1024, description="Maximum edge length of the preview in pixels")
+):
+    """Get the animation as a single animated image played at its fps"""
+    try:
+        preview = await animation_service.generate_preview(animation_id, image_format=format, size=size)
+        return FileResponse(preview["path"], media_type=preview["media_type"])
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
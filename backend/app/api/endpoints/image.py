@@ -0,0 +1,31 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse
+from typing import Optional
+import logging
+from ...services.thumbnail_service import ThumbnailService
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+thumbnail_service = ThumbnailService()
+
+# Image names are random and never reused, so clients may cache them forever
+CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+@router.get("/{filename}")
+def get_image(
+    filename: str,
+    size: Optional[int] = Query(None, description="Edge length of a downscaled derivative (e.g. 64, 128, 256)")
+):
+    """Serve a stored image, or a cached downscaled derivative of it"""
+    try:
+        path = thumbnail_service.get_image_path(filename, size)
+        return FileResponse(path, media_type="image/png", headers=CACHE_HEADERS)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error serving image {filename}: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,27 @@
+from fastapi import APIRouter, HTTPException
+from typing import List, Dict, Any
+import logging
+from ...services.job_service import JobService
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+job_service = JobService()
+
+@router.get("", response_model=List[Dict[str, Any]])
+async def list_jobs():
+    """List the generation jobs currently running in this worker"""
+    return [job.to_dict() for job in job_service.list_jobs()]
+
+@router.post("/{job_id}/cancel", response_model=Dict[str, Any])
+async def cancel_job(job_id: str):
+    """
+    Cancel a running generation job.
+    
+    No further image requests are made for the job; frames and sprite
+    variations stored before the cancel are kept.
+    """
+    if not job_service.cancel(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"id": job_id, "message": "Job cancelled"}
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from typing import List, Dict, Any
+import logging
+from ...utils.profiling import require_admin, list_profiles, get_profile_path
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("", response_model=List[Dict[str, Any]])
+async def get_profiles():
+    """List the stored request profiles, newest first"""
+    return list_profiles()
+
+@router.get("/{profile_id}")
+async def get_profile(profile_id: str):
+    """
+    Download a stored request profile.
+
+    `.folded` profiles are collapsed stacks for flamegraph.pl, inferno or
+    speedscope; `.prof` profiles load with pstats or snakeviz.
+    """
+    try:
+        path = get_profile_path(profile_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=profile_id)
@@ -1,32 +1,54 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response, Depends
 from pydantic import BaseModel, Field
 import logging
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from ...services.sprite_service import SpriteService
+from ...services.job_service import JobService, JobCancelled
+from ...services.idempotency_service import IdempotencyService, IdempotencyError
+from ...services.upstream_service import upstream_lane, upstream_deadline, UpstreamUnavailable, INTERACTIVE, BATCH
+from ...services.admission_service import admit_generation, generation_slot
+from ...constants import MAX_SPRITE_VARIATIONS, INTERACTIVE_REQUEST_DEADLINE, BATCH_REQUEST_DEADLINE
 from ...models.sprite import Sprite as SpriteModel
+from ...utils.logs import log_event
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 sprite_service = SpriteService()
+job_service = JobService()
+idempotency_service = IdempotencyService()
 
 class SpriteRequest(BaseModel):
     description: str
+    draft: bool = False  # Render at the cheaper, faster draft quality
 
 class SpriteEditRequest(BaseModel):
     spriteId: str
     prompt: str
-    num_variations: Optional[int] = 5
+    num_variations: int = Field(5, ge=1, le=MAX_SPRITE_VARIATIONS)
+    draft: bool = False  # Render at the cheaper, faster draft quality
+
+class ColorMapping(BaseModel):
+    source: str  # Color to replace, as #rrggbb
+    target: str  # Replacement color, as #rrggbb
+
+class SpriteRecolorRequest(BaseModel):
+    spriteId: str
+    mappings: List[ColorMapping] = []
+    hue_shift: float = Field(0.0, ge=-360, le=360)
+    tolerance: float = Field(48.0, ge=0, le=442)
+    apply_to_animations: bool = False
 
 class SpriteResponse(BaseModel):
     id: str
     url: str
+    thumbnails: Optional[Dict[str, str]] = None
     description: str
     parent_id: Optional[str] = None
     edit_description: Optional[str] = None
+    is_draft: Optional[bool] = None
     created_at: Optional[str] = None
     
     class Config:
@@ -38,37 +60,115 @@ class SpriteResponse(BaseModel):
         }
 
 @router.post("/generate", response_model=SpriteResponse)
-async def generate_sprite(request: SpriteRequest):
+async def generate_sprite(request: SpriteRequest, http_request: Request, response: Response):
+    async def generate():
+        log_event(logger, logging.DEBUG, "api.sprite.generate.received", description=request.description, draft=request.draft)
+        # The slot is only taken when the request runs, not for replayed Idempotency-Key retries
+        async with generation_slot(http_request):
+            with upstream_deadline(INTERACTIVE_REQUEST_DEADLINE):
+                sprite = await sprite_service.generate_sprite(request.description, draft=request.draft)
+        log_event(logger, logging.INFO, "api.sprite.generate.completed", sprite_id=sprite.id)
+        return SpriteResponse.model_validate(sprite).model_dump()
+    
     try:
-        logger.info(f"Received request to generate sprite with description: {request.description}")
-        sprite = await sprite_service.generate_sprite(request.description)
-        logger.info(f"Successfully generated sprite with ID: {sprite.id}")
-        return sprite
+        # Retries with the same Idempotency-Key get the stored sprite instead of a new one
+        return await idempotency_service.run(
+            http_request, response, "sprites.generate", request.model_dump(), generate
+        )
+    except HTTPException:
+        raise
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except Exception as e:
         logger.error(f"Error generating sprite: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/edit", response_model=List[SpriteResponse])
-async def edit_sprite(request: SpriteEditRequest):
+async def edit_sprite(request: SpriteEditRequest, http_request: Request, response: Response):
+    async def edit():
+        log_event(logger, logging.DEBUG, "api.sprite.edit.received", sprite_id=request.spriteId, prompt=request.prompt,
+                  num_variations=request.num_variations)
+        # Several variations are bulk work and must not hold up interactive requests
+        lane = BATCH if request.num_variations > 1 else INTERACTIVE
+        deadline = BATCH_REQUEST_DEADLINE if lane == BATCH else INTERACTIVE_REQUEST_DEADLINE
+        
+        # Cancelled through /api/jobs/{job_id}/cancel or when the client disconnects
+        async with generation_slot(http_request):
+            with upstream_lane(lane), upstream_deadline(deadline):
+                async with job_service.track(http_request, kind="sprite_edit") as job:
+                    sprites = await sprite_service.edit_sprite_image(
+                        request.spriteId, 
+                        request.prompt, 
+                        num_variations=request.num_variations,
+                        draft=request.draft,
+                        job=job
+                    )
+        log_event(logger, logging.INFO, "api.sprite.edit.completed", sprite_id=request.spriteId, variations=len(sprites))
+        return [SpriteResponse.model_validate(sprite).model_dump() for sprite in sprites]
+    
     try:
-        logger.info(f"Received request to edit sprite {request.spriteId} with prompt: {request.prompt}")
-        sprites = await sprite_service.edit_sprite_image(
-            request.spriteId, 
-            request.prompt, 
-            num_variations=request.num_variations
+        return await idempotency_service.run(
+            http_request, response, "sprites.edit", request.model_dump(), edit
         )
-        logger.info(f"Successfully edited sprite with {len(sprites)} variations")
-        return sprites
+    except HTTPException:
+        raise
+    except IdempotencyError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except JobCancelled as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
     except Exception as e:
         logger.error(f"Error editing sprite: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/{sprite_id}/promote", response_model=SpriteResponse, dependencies=[Depends(admit_generation)])
+async def promote_sprite(sprite_id: str):
+    try:
+        log_event(logger, logging.DEBUG, "api.sprite.promote.received", sprite_id=sprite_id)
+        with upstream_deadline(INTERACTIVE_REQUEST_DEADLINE):
+            sprite = await sprite_service.promote_sprite(sprite_id)
+        log_event(logger, logging.INFO, "api.sprite.promote.completed", sprite_id=sprite_id)
+        return sprite
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=e.headers)
+    except Exception as e:
+        logger.error(f"Error promoting sprite: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/recolor", response_model=Dict[str, Any])
+async def recolor_sprite(request: SpriteRecolorRequest):
+    try:
+        log_event(logger, logging.DEBUG, "api.sprite.recolor.received", sprite_id=request.spriteId)
+        sprite = await sprite_service.recolor_sprite(
+            request.spriteId,
+            [mapping.model_dump() for mapping in request.mappings],
+            hue_shift=request.hue_shift,
+            tolerance=request.tolerance,
+            apply_to_animations=request.apply_to_animations
+        )
+        log_event(logger, logging.INFO, "api.sprite.recolor.completed", sprite_id=request.spriteId, recolored_sprite_id=sprite["id"])
+        return sprite
+    except Exception as e:
+        logger.error(f"Error recoloring sprite: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/{sprite_id}/palette", response_model=Dict[str, Any])
+async def get_sprite_palette(sprite_id: str, max_colors: int = Query(16, ge=1, le=256)):
+    try:
+        palette = await sprite_service.get_sprite_palette(sprite_id, max_colors=max_colors)
+        return {"sprite_id": sprite_id, "palette": palette}
+    except Exception as e:
+        logger.error(f"Error getting sprite palette: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/history/{sprite_id}", response_model=Dict[str, Any])
 async def get_sprite_history(sprite_id: str):
     try:
-        logger.info(f"Received request to get edit history for sprite: {sprite_id}")
+        log_event(logger, logging.DEBUG, "api.sprite.history.received", sprite_id=sprite_id)
         history = await sprite_service.get_sprite_history(sprite_id)
-        logger.info(f"Successfully retrieved history for sprite: {sprite_id}")
         return history
     except Exception as e:
         logger.error(f"Error getting sprite history: {str(e)}", exc_info=True)
@@ -88,9 +188,8 @@ async def get_sprite(sprite_id: str):
 @router.get("", response_model=List[SpriteResponse])
 async def get_all_sprites():
     try:
-        logger.info("Received request to get all sprites")
         sprites = await sprite_service.get_all_sprites()
-        logger.info(f"Successfully retrieved {len(sprites)} sprites")
+        log_event(logger, logging.DEBUG, "api.sprite.list.completed", count=len(sprites))
         return sprites
     except Exception as e:
         logger.error(f"Error getting all sprites: {str(e)}", exc_info=True)
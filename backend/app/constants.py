@@ -1,5 +1,156 @@
 import os
+import tempfile
+from typing import Dict
 
 # Backend URL for generating full URLs to resources
 # Default to localhost:8000 but allow override through environment variable
-BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000") 
\ No newline at end of file
+BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
+
+# Directory where generated images are stored and served from under /static
+STATIC_DIR = os.path.join(os.path.dirname(__file__), "static")
+
+# Square edge lengths (in pixels) of the downscaled image derivatives served for galleries
+THUMBNAIL_SIZES = [int(size) for size in os.getenv("THUMBNAIL_SIZES", "64,128,256").split(",")]
+
+# Image model used for sprites, edits and frames
+IMAGE_MODEL = "gpt-image-1"
+
+# Image API quality and size tiers. Drafts use the cheapest and fastest settings for
+# previews and can later be re-rendered at final quality.
+FINAL_IMAGE_QUALITY = os.getenv("FINAL_IMAGE_QUALITY", "high")
+FINAL_IMAGE_SIZE = os.getenv("FINAL_IMAGE_SIZE", "1024x1024")
+DRAFT_IMAGE_QUALITY = os.getenv("DRAFT_IMAGE_QUALITY", "low")
+DRAFT_IMAGE_SIZE = os.getenv("DRAFT_IMAGE_SIZE", "1024x1024")
+
+# Attempts per preset frame before a preset run fails, and the delay before the first retry
+# in seconds (doubled after every further failure)
+PRESET_FRAME_MAX_ATTEMPTS = int(os.getenv("PRESET_FRAME_MAX_ATTEMPTS", "3"))
+PRESET_FRAME_RETRY_DELAY = float(os.getenv("PRESET_FRAME_RETRY_DELAY", "2"))
+
+# Budgets of the upstream scheduler that every OpenAI call goes through. Image and chat
+# requests have separate account limits, so each gets its own requests-per-minute and
+# concurrency budget.
+UPSTREAM_IMAGE_RPM = int(os.getenv("UPSTREAM_IMAGE_RPM", "50"))
+UPSTREAM_IMAGE_CONCURRENCY = int(os.getenv("UPSTREAM_IMAGE_CONCURRENCY", "4"))
+UPSTREAM_CHAT_RPM = int(os.getenv("UPSTREAM_CHAT_RPM", "500"))
+UPSTREAM_CHAT_CONCURRENCY = int(os.getenv("UPSTREAM_CHAT_CONCURRENCY", "8"))
+
+# Retries of rate-limited (429), server error (5xx) and connection failures, with jittered
+# exponential backoff between the base and max delay in seconds
+UPSTREAM_MAX_RETRIES = int(os.getenv("UPSTREAM_MAX_RETRIES", "5"))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", "1"))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", "60"))
+
+# Seconds a single upstream attempt may take before it is abandoned and retried
+UPSTREAM_IMAGE_TIMEOUT = float(os.getenv("UPSTREAM_IMAGE_TIMEOUT", "120"))
+UPSTREAM_CHAT_TIMEOUT = float(os.getenv("UPSTREAM_CHAT_TIMEOUT", "60"))
+
+# Overall deadlines (seconds) of the upstream work of one request, including queueing and
+# retries, for interactive requests and for batch work such as presets and variations
+INTERACTIVE_REQUEST_DEADLINE = float(os.getenv("INTERACTIVE_REQUEST_DEADLINE", "300"))
+BATCH_REQUEST_DEADLINE = float(os.getenv("BATCH_REQUEST_DEADLINE", "1800"))
+
+# After this many consecutive failed attempts (server errors, connection errors, timeouts)
+# an upstream's circuit breaker opens and calls fail fast for the cooldown (seconds), after
+# which a single probe call decides whether it closes again
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+UPSTREAM_BREAKER_COOLDOWN = float(os.getenv("UPSTREAM_BREAKER_COOLDOWN", "30"))
+
+# Relative shares of the upstream budgets for interactive requests (single frames and
+# sprites) and batch work (presets and multi-variation edits) when both are waiting.
+# Either lane gets the whole budget while the other one is idle.
+DEFAULT_UPSTREAM_LANE_WEIGHTS = {"interactive": 4.0, "batch": 1.0}
+
+
+def parse_lane_weights(value: str) -> Dict[str, float]:
+    """Parse "lane=weight,..." over the default weights, so lanes left out keep their default"""
+    weights = dict(DEFAULT_UPSTREAM_LANE_WEIGHTS)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        lane, _, weight = (part.strip() for part in item.partition("="))
+        try:
+            weights[lane] = float(weight)
+        except ValueError:
+            raise ValueError(f"Invalid lane weight {item!r}, expected lane=weight such as interactive=4")
+        if not lane or weights[lane] <= 0:
+            raise ValueError(f"Invalid lane weight {item!r}, the lane needs a name and a weight above 0")
+    return weights
+
+
+UPSTREAM_LANE_WEIGHTS = parse_lane_weights(os.getenv("UPSTREAM_LANE_WEIGHTS", ""))
+
+# Identical concurrent image requests are coalesced into one upstream call. Worker processes
+# on the same host coordinate through lease files in this directory; a lease older than the
+# TTL (seconds) is considered abandoned, and results are kept briefly for waiting workers.
+COALESCE_DIR = os.getenv("COALESCE_DIR", os.path.join(tempfile.gettempdir(), "2d-animation-generator-flights"))
+COALESCE_LEASE_TTL = float(os.getenv("COALESCE_LEASE_TTL", "600"))
+COALESCE_RESULT_TTL = float(os.getenv("COALESCE_RESULT_TTL", "60"))
+
+# How long the response of a request sent with an Idempotency-Key is kept for replay (hours),
+# after how long (seconds) a request still marked in progress counts as abandoned, and how
+# long (seconds) a retry waits for the original request if it is still running
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+IDEMPOTENCY_IN_PROGRESS_TTL = float(os.getenv("IDEMPOTENCY_IN_PROGRESS_TTL", "3600"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "600"))
+
+# Admission control for generation requests: how many run at once in this process, how many
+# one client may have running or waiting, how many may wait for a free slot and for how long
+# (seconds) before they are turned away with 503
+GENERATION_MAX_ACTIVE = int(os.getenv("GENERATION_MAX_ACTIVE", "8"))
+GENERATION_MAX_PER_CLIENT = int(os.getenv("GENERATION_MAX_PER_CLIENT", "2"))
+GENERATION_MAX_QUEUE = int(os.getenv("GENERATION_MAX_QUEUE", "32"))
+GENERATION_QUEUE_TIMEOUT = float(os.getenv("GENERATION_QUEUE_TIMEOUT", "30"))
+
+# Upper bounds of the cost-bearing request parameters
+MAX_SPRITE_VARIATIONS = int(os.getenv("MAX_SPRITE_VARIATIONS", "10"))
+MAX_ANIMATION_FRAMES = int(os.getenv("MAX_ANIMATION_FRAMES", "24"))
+
+# Backend of the image API: "openai", or "local" for the deterministic offline stand-in used by
+# benchmarks, load tests and CI. The local provider sleeps LOCAL_IMAGE_LATENCY seconds (plus up
+# to LOCAL_IMAGE_LATENCY_JITTER more) per image and fails with the given rate, reproducibly for
+# a given LOCAL_IMAGE_SEED.
+IMAGE_PROVIDER = os.getenv("IMAGE_PROVIDER", "openai")
+LOCAL_IMAGE_LATENCY = float(os.getenv("LOCAL_IMAGE_LATENCY", "0"))
+LOCAL_IMAGE_LATENCY_JITTER = float(os.getenv("LOCAL_IMAGE_LATENCY_JITTER", "0"))
+LOCAL_IMAGE_ERROR_RATE = float(os.getenv("LOCAL_IMAGE_ERROR_RATE", "0"))
+LOCAL_IMAGE_SEED = int(os.getenv("LOCAL_IMAGE_SEED", "0"))
+
+# Request tracing: spans of the sampled share of requests (0 to 1), with their service calls,
+# upstream calls and SQL statements, are appended as JSON lines to TRACE_FILE. Off when unset.
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1"))
+TRACE_MAX_STATEMENT_LENGTH = int(os.getenv("TRACE_MAX_STATEMENT_LENGTH", "500"))
+
+# On-demand request profiling, off unless PROFILE_ADMIN_TOKEN is set. Requests carrying the token
+# in X-Admin-Token and an X-Profile header are profiled (sampling every PROFILE_SAMPLE_INTERVAL
+# seconds, or with cProfile) and the profile is stored in PROFILE_DIR.
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "2d-animation-generator-profiles"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# Event loop stall detection: a heartbeat every LOOP_MONITOR_INTERVAL seconds measures the loop
+# lag (0 turns the monitor off), and the stack of any callback blocking the loop for longer than
+# LOOP_STALL_THRESHOLD seconds is logged
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+LOOP_STALL_THRESHOLD = float(os.getenv("LOOP_STALL_THRESHOLD", "0.25"))
+
+# Logging: level, "text" or "json" lines, share of requests (0 to 1) whose INFO and DEBUG records
+# are kept (warnings and errors always are), and how many records may wait for the background
+# writer before new ones are dropped
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+# SQLite connection tuning: WAL journaling so readers do not block behind a commit, the fsync
+# level (NORMAL is safe with WAL), how long a connection waits for a lock before failing with
+# "database is locked", and the memory-mapped I/O and page cache sizes per connection
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", str(64 * 1024)))
+
+# Frame inserts on SQLite go through a single writer, which waits up to WRITE_BATCH_WINDOW seconds
+# for concurrent inserts and commits up to WRITE_BATCH_MAX of them in one transaction
+WRITE_BATCH_WINDOW = float(os.getenv("WRITE_BATCH_WINDOW", "0.005"))
+WRITE_BATCH_MAX = int(os.getenv("WRITE_BATCH_MAX", "100"))
@@ -1,15 +1,21 @@
 import logging
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from .api import router as api_router
+from .api.endpoints import metrics
+from .services.upstream_service import set_upstream_client
+from .utils.stages import set_metrics_endpoint
+from .utils.tracing import TracingMiddleware, setup_tracing
+from .utils.database import async_engine
+from .utils.profiling import ProfilingMiddleware, profiling_enabled
+from .utils.loop_monitor import loop_monitor
+from .utils.logs import RequestIdMiddleware, setup_logging
+from .constants import LOOP_MONITOR_INTERVAL
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging: records carry the request ID and are written by a background thread
+setup_logging()
 logger = logging.getLogger(__name__)
 
 app = FastAPI(title="2D Animation Generator API")
@@ -23,14 +29,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Trace requests through the services, upstream calls and queries when TRACE_FILE is set
+setup_tracing(async_engine.sync_engine)
+app.add_middleware(TracingMiddleware)
+
+# Admins can profile single requests when PROFILE_ADMIN_TOKEN is set; otherwise the
+# middleware is not installed at all
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+
+# Tag the log records of each request with its ID (X-Request-Id)
+app.add_middleware(RequestIdMiddleware)
+
 # Include API router
-app.include_router(api_router, prefix="/api")
+# Upstream calls are queued fairly per client, so attribute them to the requesting client,
+# and label the pipeline metrics of each request with its route
+app.include_router(
+    api_router, prefix="/api", dependencies=[Depends(set_upstream_client), Depends(set_metrics_endpoint)]
+)
+
+# Prometheus scrapes /metrics at the root by convention
+app.include_router(metrics.router)
 
 # Set up static file serving
 static_dir = os.path.join(os.path.dirname(__file__), "static")
 os.makedirs(static_dir, exist_ok=True)
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
+@app.on_event("startup")
+async def start_loop_monitor():
+    # Report event loop lag and log the stack of any blocking call
+    if LOOP_MONITOR_INTERVAL > 0:
+        loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    await loop_monitor.stop()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the 2D Animation Generator API"} 
\ No newline at end of file
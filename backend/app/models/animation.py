@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Float, DateTime, func
+from sqlalchemy import Column, String, Integer, ForeignKey, Float, DateTime, Boolean, Text, func
 from sqlalchemy.orm import relationship
 from ..utils.database import Base
 import uuid
@@ -17,6 +17,7 @@ class Animation(Base):
     
     # Relationships
     frames = relationship("Frame", back_populates="animation", cascade="all, delete-orphan", order_by="Frame.order")
+    preset_runs = relationship("PresetRun", back_populates="animation", cascade="all, delete-orphan")
     base_sprite = relationship("Sprite", back_populates="animations")
     
     def __repr__(self):
@@ -30,10 +31,51 @@ class Frame(Base):
     url = Column(String, nullable=False)  # URL to the image
     prompt = Column(String, nullable=True)  # Original prompt used to generate
     order = Column(Integer, nullable=False)  # Position in the animation sequence
+    is_interpolated = Column(Boolean, default=False)  # Synthesized locally between generated keyframes
+    is_draft = Column(Boolean, default=False)  # Rendered at draft quality, can be promoted to final
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
     animation = relationship("Animation", back_populates="frames")
     
     def __repr__(self):
-        return f"<Frame(id='{self.id}', animation_id='{self.animation_id}', order={self.order})>" 
\ No newline at end of file
+        return f"<Frame(id='{self.id}', animation_id='{self.animation_id}', order={self.order})>" 
+
+class PresetRun(Base):
+    """A checkpointed preset generation: the planned frames and how far it got"""
+    __tablename__ = "preset_runs"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()), index=True)
+    animation_id = Column(String, ForeignKey("animations.id"), nullable=False, index=True)
+    preset_type = Column(String, nullable=False)
+    num_keyframes = Column(Integer, nullable=True)  # Set for hybrid runs that interpolate the other frames
+    interpolation = Column(String, nullable=True)
+    is_draft = Column(Boolean, default=False)
+    status = Column(String, nullable=False, default="pending")  # pending, running, completed, failed, cancelled
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relationships
+    animation = relationship("Animation", back_populates="preset_runs")
+    frames = relationship("PresetRunFrame", back_populates="run", cascade="all, delete-orphan", order_by="PresetRunFrame.order")
+    
+    def __repr__(self):
+        return f"<PresetRun(id='{self.id}', animation_id='{self.animation_id}', status='{self.status}')>"
+
+class PresetRunFrame(Base):
+    __tablename__ = "preset_run_frames"
+    
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()), index=True)
+    run_id = Column(String, ForeignKey("preset_runs.id"), nullable=False, index=True)
+    order = Column(Integer, nullable=False)  # Planned position in the animation sequence
+    description = Column(Text, nullable=False)  # Planned frame prompt
+    status = Column(String, nullable=False, default="pending")  # pending, completed, failed
+    frame_id = Column(String, nullable=True)  # Not a foreign key, frames can be deleted independently
+    error = Column(Text, nullable=True)
+    
+    # Relationships
+    run = relationship("PresetRun", back_populates="frames")
+    
+    def __repr__(self):
+        return f"<PresetRunFrame(run_id='{self.run_id}', order={self.order}, status='{self.status}')>"
\ No newline at end of file
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, String, Integer, Text, DateTime
+from ..utils.database import Base
+from datetime import datetime
+
+class IdempotencyKey(Base):
+    """The stored outcome of a generation request sent with an Idempotency-Key header"""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)  # Idempotency-Key header value
+    scope = Column(String, primary_key=True)  # Endpoint the key was used with
+    request_hash = Column(String, nullable=False)  # Hash of the request body, to detect key reuse
+    status = Column(String, nullable=False, default="in_progress")  # in_progress, completed
+    status_code = Column(Integer, nullable=True)
+    response_body = Column(Text, nullable=True)  # JSON of the stored response
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f"<IdempotencyKey(key='{self.key}', scope='{self.scope}', status='{self.status}')>"
\ No newline at end of file
@@ -9,6 +9,7 @@ class Sprite(Base):
     url = Column(String, nullable=False)
     description = Column(Text, nullable=False)
     is_base_image = Column(Boolean, default=True)  # Indicates if this is a base image for animations
+    is_draft = Column(Boolean, default=False)  # Rendered at draft quality, can be promoted to final
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     
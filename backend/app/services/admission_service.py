@@ -0,0 +1,239 @@
+import math
+import time
+import asyncio
+import logging
+import threading
+import contextlib
+from collections import deque
+from typing import Deque, Dict, AsyncIterator
+from fastapi import Request, HTTPException
+
+from ..constants import GENERATION_MAX_ACTIVE, GENERATION_MAX_PER_CLIENT, GENERATION_MAX_QUEUE, GENERATION_QUEUE_TIMEOUT
+from ..utils.clients import get_client_id
+from ..utils.metrics import REGISTRY
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Bounds of the Retry-After hint sent with rejected requests, in seconds
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 300
+
+ACTIVE = REGISTRY.gauge(
+    "admission_active",
+    "Generation requests currently admitted",
+    ["admission"]
+)
+QUEUED = REGISTRY.gauge(
+    "admission_queued",
+    "Generation requests waiting to be admitted",
+    ["admission"]
+)
+REJECTED = REGISTRY.counter(
+    "admission_rejected_total",
+    "Generation requests turned away, by reason (client_limit, queue_full, queue_timeout)",
+    ["admission", "reason"]
+)
+
+
+class AdmissionRejected(Exception):
+    """A request that cannot be admitted now, with the HTTP status and Retry-After to answer"""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, loop: asyncio.AbstractEventLoop, client_id: str):
+        self.loop = loop
+        self.client_id = client_id
+        self.future = loop.create_future()
+        self.granted = False
+
+
+class AdmissionTicket:
+    """A slot held by an admitted request; released once, when the request is done"""
+
+    def __init__(self, controller: "AdmissionController", client_id: str):
+        self.controller = controller
+        self.client_id = client_id
+        self.started = time.monotonic()
+        self.detached = False
+        self._released = False
+
+    def detach(self) -> None:
+        """Keep the slot past the endpoint, e.g. for a streaming response that releases it itself"""
+        self.detached = True
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Bounds how much generation work a worker process accepts.
+
+    At most `max_active` requests run at once and each client may have at most
+    `max_per_client` running or waiting. Requests beyond the global limit wait
+    in a bounded FIFO queue for up to `queue_timeout` seconds. Anything over
+    these limits is rejected straight away with a Retry-After hint based on how
+    long requests have recently taken, so clients back off instead of piling up.
+    """
+
+    def __init__(self, name: str, max_active: int = GENERATION_MAX_ACTIVE,
+                 max_per_client: int = GENERATION_MAX_PER_CLIENT, max_queue: int = GENERATION_MAX_QUEUE,
+                 queue_timeout: float = GENERATION_QUEUE_TIMEOUT):
+        self.name = name
+        self.max_active = max_active
+        self.max_per_client = max_per_client
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._clients: Dict[str, int] = {}
+        self._waiters: Deque[_Waiter] = deque()
+        # Moving average of how long admitted requests hold their slot, in seconds
+        self._avg_duration = 10.0
+        # A thread lock, as requests may be served from different event loops
+        self._lock = threading.Lock()
+
+    async def admit(self, client_id: str) -> AdmissionTicket:
+        """
+        Wait for a slot for a request of the given client.
+
+        Raises:
+            AdmissionRejected: with 429 when the client is over its own limit, or
+                503 when the queue is full or the wait timed out
+        """
+        with self._lock:
+            if self._clients.get(client_id, 0) >= self.max_per_client:
+                REJECTED.inc(admission=self.name, reason="client_limit")
+                raise AdmissionRejected(
+                    f"Too many generation requests in progress for this client (limit {self.max_per_client})",
+                    429, self._retry_after(1)
+                )
+
+            if self._active < self.max_active and not self._waiters:
+                self._admit(client_id)
+                return AdmissionTicket(self, client_id)
+
+            if len(self._waiters) >= self.max_queue:
+                REJECTED.inc(admission=self.name, reason="queue_full")
+                raise AdmissionRejected(
+                    "The server is busy with other generation requests, please retry later",
+                    503, self._retry_after(len(self._waiters) + 1)
+                )
+
+            waiter = _Waiter(asyncio.get_running_loop(), client_id)
+            self._waiters.append(waiter)
+            self._clients[client_id] = self._clients.get(client_id, 0) + 1
+            QUEUED.set(len(self._waiters), admission=self.name)
+
+        try:
+            await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except BaseException as e:
+            with self._lock:
+                granted = waiter.granted
+                if not granted:
+                    self._waiters.remove(waiter)
+                    self._leave(client_id)
+                    QUEUED.set(len(self._waiters), admission=self.name)
+                    position = len(self._waiters) + 1
+            if granted:
+                if isinstance(e, asyncio.TimeoutError):
+                    # The slot came in just as the wait timed out
+                    return AdmissionTicket(self, client_id)
+                AdmissionTicket(self, client_id).release()
+                raise
+            if isinstance(e, asyncio.TimeoutError):
+                REJECTED.inc(admission=self.name, reason="queue_timeout")
+                raise AdmissionRejected(
+                    f"Timed out after {self.queue_timeout:g}s waiting for a free generation slot, please retry later",
+                    503, self._retry_after(position)
+                )
+            raise
+
+        return AdmissionTicket(self, client_id)
+
+    def _admit(self, client_id: str) -> None:
+        # Called with the lock held
+        self._active += 1
+        self._clients[client_id] = self._clients.get(client_id, 0) + 1
+        ACTIVE.set(self._active, admission=self.name)
+
+    def _leave(self, client_id: str) -> None:
+        # Called with the lock held
+        remaining = self._clients.get(client_id, 0) - 1
+        if remaining > 0:
+            self._clients[client_id] = remaining
+        else:
+            self._clients.pop(client_id, None)
+
+    def _release(self, ticket: AdmissionTicket) -> None:
+        duration = time.monotonic() - ticket.started
+        with self._lock:
+            self._active -= 1
+            self._leave(ticket.client_id)
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+            # Hand free slots to the longest waiting requests
+            while self._waiters and self._active < self.max_active:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                self._active += 1
+                waiter.loop.call_soon_threadsafe(self._wake, waiter.future)
+
+            ACTIVE.set(self._active, admission=self.name)
+            QUEUED.set(len(self._waiters), admission=self.name)
+
+    @staticmethod
+    def _wake(future: asyncio.Future) -> None:
+        if not future.done():
+            future.set_result(None)
+
+    def _retry_after(self, position: int) -> int:
+        """Estimate in whole seconds when a request at this queue position would get a slot"""
+        estimate = self._avg_duration * position / max(self.max_active, 1)
+        return int(min(max(math.ceil(estimate), MIN_RETRY_AFTER), MAX_RETRY_AFTER))
+
+
+# Shared by every generation endpoint of this process
+generation_admission = AdmissionController("generation")
+
+
+@contextlib.asynccontextmanager
+async def generation_slot(request: Request) -> AsyncIterator[AdmissionTicket]:
+    """
+    Hold a generation slot for the duration of the block.
+
+    Rejected requests raise an HTTPException with a 429 or 503 status and a
+    Retry-After header. Endpoints that replay Idempotency-Key responses take
+    the slot inside the handler they pass to IdempotencyService.run, so a
+    replayed or attached retry does not hold one.
+    """
+    try:
+        ticket = await generation_admission.admit(get_client_id(request))
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected {request.method} {request.url.path}: {str(e)}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    try:
+        yield ticket
+    finally:
+        if not ticket.detached:
+            ticket.release()
+
+
+async def admit_generation(request: Request) -> AsyncIterator[AdmissionTicket]:
+    """
+    Dependency that holds a generation slot for the duration of a request.
+
+    Rejected requests get a 429 or 503 response with a Retry-After header.
+    Endpoints returning a streaming response should detach the ticket and
+    release it once the stream ends.
+    """
+    async with generation_slot(request) as ticket:
+        yield ticket
@@ -1,22 +1,36 @@
 import os
 import uuid
+import asyncio
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import openai
 import base64
 from PIL import Image
 import io
 import tempfile
-from sqlalchemy import desc
+from sqlalchemy import desc, func, select, update
 import requests
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import selectinload
 
-from ..models.animation import Animation, Frame
+from ..models.animation import Animation, Frame, PresetRun, PresetRunFrame
 from ..models.sprite import Sprite
-from ..utils.database import get_db
+from ..utils.database import AsyncSessionLocal
 from .sprite_service import SpriteService
+from .thumbnail_service import ThumbnailService
+from .job_service import Job, JobCancelled
+from .upstream_service import request_image, deadline_remaining, UpstreamUnavailable, UpstreamDeadlineExceeded
+from .interpolation_service import InterpolationService, INTERPOLATION_METHODS
+from .write_queue_service import frame_writes
 from ..schemas.animation import AnimationCreate, AnimationUpdate, FrameCreate
-from ..constants import BACKEND_URL
+from ..constants import BACKEND_URL, STATIC_DIR, IMAGE_MODEL, FINAL_IMAGE_QUALITY, FINAL_IMAGE_SIZE, DRAFT_IMAGE_QUALITY, DRAFT_IMAGE_SIZE
+from ..constants import PRESET_FRAME_MAX_ATTEMPTS, PRESET_FRAME_RETRY_DELAY
+from ..utils.storage import read_image_bytes, save_image
+from ..utils.tracing import traced
+from ..utils.logs import log_event
+from ..utils.stages import (
+    FRAME, DOWNLOAD, DECODE, ENCODE, STORAGE_WRITE, DB_COMMIT, stage_timer, count_retry, count_cache_hit
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -24,10 +38,64 @@ logger = logging.getLogger(__name__)
 # Initialize OpenAI with API key
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Cache directory for rendered animated previews
+PREVIEW_DIR = os.path.join(STATIC_DIR, "previews")
+
+# Supported animated preview formats: file extension and media type
+PREVIEW_FORMATS = {
+    "gif": ("gif", "image/gif"),
+    "webp": ("webp", "image/webp"),
+    "apng": ("png", "image/apng"),
+}
+
+# Presets whose last frame leads back into the first, so in-betweens wrap around
+LOOPING_PRESETS = ("idle", "walk", "run")
+
+def compose_spritesheet(frame_images: List[Image.Image]):
+    """
+    Paste frames into a single transparent spritesheet.
+    
+    Frames sit in one row, or in a balanced grid when there are more than 10.
+    All frames are assumed to have the size of the first one.
+    
+    Returns:
+        The spritesheet image, its number of rows and its number of columns
+    """
+    num_frames = len(frame_images)
+    rows = 1
+    cols = num_frames
+    
+    # If there are more than 10 frames, organize in a grid
+    if num_frames > 10:
+        rows = int(num_frames ** 0.5)  # Square root for balanced grid
+        cols = (num_frames + rows - 1) // rows  # Ceiling division
+        
+    frame_width, frame_height = frame_images[0].size
+    spritesheet = Image.new('RGBA', (frame_width * cols, frame_height * rows), (0, 0, 0, 0))
+    
+    # Place each frame in the spritesheet
+    for i, frame_img in enumerate(frame_images):
+        row = i // cols
+        col = i % cols
+        spritesheet.paste(frame_img, (col * frame_width, row * frame_height))
+        
+    return spritesheet, rows, cols
+
+
+class FrameGenerationError(Exception):
+    """A preset frame that still failed after all its attempts"""
+    
+    def __init__(self, order: int, message: str):
+        super().__init__(message)
+        self.order = order
+
 class AnimationService:
     def __init__(self):
         self.sprite_service = SpriteService()
+        self.thumbnail_service = ThumbnailService()
+        self.interpolation_service = InterpolationService()
     
+    @traced()
     async def create_animation(self, name: str, base_sprite_id: str, animation_type: Optional[str] = None, fps: int = 12) -> Animation:
         """
         Create a new animation for a sprite.
@@ -45,26 +113,25 @@ class AnimationService:
             logger.info(f"Creating new animation named '{name}' for sprite {base_sprite_id}")
             
             # Get the database session
-            db = next(get_db())
-            
-            # Get base sprite to verify it exists
-            base_sprite = db.query(Sprite).filter(Sprite.id == base_sprite_id).first()
-            if not base_sprite:
-                raise Exception(f"Base sprite with ID {base_sprite_id} not found")
+            async with AsyncSessionLocal() as db:
+                # Get base sprite to verify it exists
+                base_sprite = await db.scalar(select(Sprite).where(Sprite.id == base_sprite_id))
+                if not base_sprite:
+                    raise Exception(f"Base sprite with ID {base_sprite_id} not found")
+                    
+                # Create the animation
+                animation = Animation(
+                    id=str(uuid.uuid4()),
+                    name=name,
+                    base_sprite_id=base_sprite_id,
+                    animation_type=animation_type,
+                    fps=fps
+                )
                 
-            # Create the animation
-            animation = Animation(
-                id=str(uuid.uuid4()),
-                name=name,
-                base_sprite_id=base_sprite_id,
-                animation_type=animation_type,
-                fps=fps
-            )
-            
-            # Save to database
-            db.add(animation)
-            db.commit()
-            db.refresh(animation)
+                # Save to database
+                db.add(animation)
+                await db.commit()
+                await db.refresh(animation)
             
             logger.info(f"Created animation with ID {animation.id}")
             return animation
@@ -73,7 +140,9 @@ class AnimationService:
             logger.error(f"Error creating animation: {str(e)}")
             raise Exception(f"Failed to create animation: {str(e)}")
     
-    async def generate_frame(self, animation_id: str, prompt: str, order: Optional[int] = None) -> Frame:
+    @traced()
+    async def generate_frame(self, animation_id: str, prompt: str, order: Optional[int] = None, draft: bool = False,
+                             job: Optional[Job] = None) -> Frame:
         """
         Generate a new frame for an animation using AI, based on editing the original sprite.
         
@@ -81,33 +150,40 @@ class AnimationService:
             animation_id: The ID of the animation
             prompt: The description for generating this frame
             order: Optional position in the sequence (if None, appends to the end)
+            draft: Whether to render at the cheaper, faster draft quality
+            job: Optional job; no image is requested once it has been cancelled
             
         Returns:
             The created Frame object
         """
         try:
-            logger.info(f"Generating new frame for animation {animation_id}")
-            logger.info(f"Frame generation prompt: {prompt}")
-            
-            # Get the database session
-            db = next(get_db())
+            log_event(logger, logging.INFO, "frame.generate.started", animation_id=animation_id, order=order, draft=draft)
+            log_event(logger, logging.DEBUG, "frame.generate.prompt", prompt=prompt)
             
-            # Get the animation to verify it exists
-            animation = db.query(Animation).filter(Animation.id == animation_id).first()
-            if not animation:
-                raise Exception(f"Animation with ID {animation_id} not found")
+            # Get the database session; it is closed before the image is generated, so no
+            # connection is held while waiting on the image API
+            async with AsyncSessionLocal() as db:
+                # Get the animation to verify it exists
+                animation = await db.scalar(select(Animation).where(Animation.id == animation_id))
+                if not animation:
+                    raise Exception(f"Animation with ID {animation_id} not found")
+                    
+                # Get the base sprite
+                base_sprite = await db.scalar(select(Sprite).where(Sprite.id == animation.base_sprite_id))
+                if not base_sprite:
+                    raise Exception(f"Base sprite with ID {animation.base_sprite_id} not found")
                 
-            # Get the base sprite
-            base_sprite = db.query(Sprite).filter(Sprite.id == animation.base_sprite_id).first()
-            if not base_sprite:
-                raise Exception(f"Base sprite with ID {animation.base_sprite_id} not found")
-            
-            # If order is not specified, put it at the end
-            if order is None:
-                # Count existing frames
-                frame_count = db.query(Frame).filter(Frame.animation_id == animation_id).count()
-                order = frame_count
+                # If order is not specified, put it at the end
+                if order is None:
+                    # Count existing frames
+                    frame_count = await db.scalar(
+                        select(func.count()).select_from(Frame).where(Frame.animation_id == animation_id)
+                    )
+                    order = frame_count
             
+            if job:
+                job.raise_if_cancelled()
+                
             # Generate the frame image using OpenAI
             try:
                 # Format edit prompt to maintain character consistency
@@ -117,70 +193,69 @@ class AnimationService:
                 original_image_path = None
                 temp_file = None
                 
-                # Get the sprite image
-                if base_sprite.url.startswith("http"):
-                    logger.info(f"Downloading image from URL: {base_sprite.url}")
+                with stage_timer(DOWNLOAD, IMAGE_MODEL):
+                    # Get the sprite image
+                    if base_sprite.url.startswith("http"):
+                        log_event(logger, logging.DEBUG, "frame.generate.download", url=base_sprite.url)
                     
-                    # If it's a localhost URL, try to resolve it locally first
-                    if BACKEND_URL in base_sprite.url:
-                        # Extract the path from the URL
-                        local_path = base_sprite.url.replace(f"{BACKEND_URL}/static/", "")
-                        static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
-                        file_path = os.path.join(static_dir, local_path)
+                        # If it's a localhost URL, try to resolve it locally first
+                        if BACKEND_URL in base_sprite.url:
+                            # Extract the path from the URL
+                            local_path = base_sprite.url.replace(f"{BACKEND_URL}/static/", "")
+                            static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
+                            file_path = os.path.join(static_dir, local_path)
                         
-                        # Check if the file exists locally
-                        if os.path.exists(file_path):
-                            logger.info(f"Found local file for URL: {file_path}")
-                            original_image_path = file_path
-                        else:
-                            logger.warning(f"Could not find local file for URL: {base_sprite.url}, will try HTTP request")
+                            # Check if the file exists locally
+                            if os.path.exists(file_path):
+                                original_image_path = file_path
+                            else:
+                                log_event(logger, logging.WARNING, "frame.generate.local_file_missing", url=base_sprite.url)
                     
-                    # If not a localhost URL or local file not found, proceed with HTTP request
-                    if not original_image_path:
-                        # Create a temporary file for the original image
-                        temp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
-                        original_image_path = temp_file.name
-                        temp_file.close()  # Close the file but keep the name
+                        # If not a localhost URL or local file not found, proceed with HTTP request
+                        if not original_image_path:
+                            # Create a temporary file for the original image
+                            temp_file = tempfile.NamedTemporaryFile(suffix=".png", delete=False)
+                            original_image_path = temp_file.name
+                            temp_file.close()  # Close the file but keep the name
                         
-                        # Download the image with increased timeout
-                        try:
-                            response = requests.get(base_sprite.url, timeout=60)
+                            # Download the image with increased timeout
+                            try:
+                                response = requests.get(base_sprite.url, timeout=60)
                             
-                            if response.status_code == 200:
-                                with open(original_image_path, 'wb') as f:
-                                    f.write(response.content)
-                                logger.info(f"Downloaded original sprite to: {original_image_path}")
-                            else:
-                                raise Exception(f"Failed to download original sprite: HTTP {response.status_code}")
-                        except requests.exceptions.Timeout:
-                            logger.error(f"Timeout while downloading image from {base_sprite.url}")
-                            raise Exception(f"Image download timed out. Please ensure the server at {BACKEND_URL} is running properly.")
-                        except requests.exceptions.ConnectionError:
-                            logger.error(f"Connection error while downloading image from {base_sprite.url}")
-                            raise Exception(f"Connection error. Please ensure the server at {BACKEND_URL} is running and accessible.")
-                else:
-                    # If it's a local path (starts with /static/), get the absolute path
-                    logger.info(f"Processing local image path: {base_sprite.url}")
+                                if response.status_code == 200:
+                                    with open(original_image_path, 'wb') as f:
+                                        f.write(response.content)
+                                    log_event(logger, logging.DEBUG, "frame.generate.downloaded", path=original_image_path)
+                                else:
+                                    raise Exception(f"Failed to download original sprite: HTTP {response.status_code}")
+                            except requests.exceptions.Timeout:
+                                log_event(logger, logging.ERROR, "frame.generate.download_timeout", url=base_sprite.url)
+                                raise Exception(f"Image download timed out. Please ensure the server at {BACKEND_URL} is running properly.")
+                            except requests.exceptions.ConnectionError:
+                                log_event(logger, logging.ERROR, "frame.generate.download_failed", url=base_sprite.url)
+                                raise Exception(f"Connection error. Please ensure the server at {BACKEND_URL} is running and accessible.")
+                    else:
+                        # If it's a local path (starts with /static/), get the absolute path
+                        log_event(logger, logging.DEBUG, "frame.generate.local_image", url=base_sprite.url)
                     
-                    # Check if URL has the backend URL prefix and strip it if needed
-                    image_path = base_sprite.url
-                    if BACKEND_URL and image_path.startswith(BACKEND_URL):
-                        image_path = image_path.replace(f"{BACKEND_URL}", "")
+                        # Check if URL has the backend URL prefix and strip it if needed
+                        image_path = base_sprite.url
+                        if BACKEND_URL and image_path.startswith(BACKEND_URL):
+                            image_path = image_path.replace(f"{BACKEND_URL}", "")
                     
-                    if image_path.startswith("/static/"):
-                        image_path = image_path.replace("/static/", "")
+                        if image_path.startswith("/static/"):
+                            image_path = image_path.replace("/static/", "")
                     
-                    static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
-                    original_image_path = os.path.join(static_dir, image_path)
+                        static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
+                        original_image_path = os.path.join(static_dir, image_path)
                     
-                    if not os.path.exists(original_image_path):
-                        raise Exception(f"Original sprite file not found: {original_image_path}")
+                        if not os.path.exists(original_image_path):
+                            raise Exception(f"Original sprite file not found: {original_image_path}")
                     
-                    logger.info(f"Using original sprite from: {original_image_path}")
                 
-                # Open and read the image as bytes
-                with open(original_image_path, "rb") as image_file:
-                    image_data = image_file.read()
+                    # Open and read the image as bytes
+                    with open(original_image_path, "rb") as image_file:
+                        image_data = image_file.read()
                 
                 # Create a mask with full transparency (fully editable)
                 from PIL import Image
@@ -197,19 +272,17 @@ class AnimationService:
                     mask_bytes = mask_bytes.getvalue()
                 
                 # Generate the frame using OpenAI image edit
-                logger.info("Calling OpenAI API for frame generation...")
-                
-                # For gpt-image-1, reopen the file using the path
-                with open(original_image_path, "rb") as reopened_file:
-                    response = openai.images.edit(
-                        model="gpt-image-1",
-                        image=reopened_file,  # Pass a freshly opened file object
-                        prompt=edit_instructions,
-                        size="1024x1024"
-                    )
-                
-                # Get the image URL or base64 data
-                image_base64 = response.data[0].b64_json
+                # Pass the image as bytes so the scheduler can resend it on a retry; the
+                # request runs in a worker thread so the event loop can notice cancellation meanwhile.
+                # An identical frame request already in flight is shared instead of sent again.
+                image_base64 = await request_image(
+                    "edit",
+                    image=(os.path.basename(original_image_path), image_data, "image/png"),
+                    model=IMAGE_MODEL,
+                    prompt=edit_instructions,
+                    size=DRAFT_IMAGE_SIZE if draft else FINAL_IMAGE_SIZE,
+                    quality=DRAFT_IMAGE_QUALITY if draft else FINAL_IMAGE_QUALITY
+                )
                 
                 # Save the image to a file in the static directory
                 image_filename = f"{uuid.uuid4()}.png"
@@ -219,23 +292,28 @@ class AnimationService:
                 os.makedirs(static_dir, exist_ok=True)
                 
                 image_path = os.path.join(static_dir, image_filename)
-                with open(image_path, "wb") as f:
-                    f.write(base64.b64decode(image_base64))
+                with stage_timer(DECODE, IMAGE_MODEL):
+                    image_bytes = base64.b64decode(image_base64)
+                with stage_timer(STORAGE_WRITE, IMAGE_MODEL):
+                    with open(image_path, "wb") as f:
+                        f.write(image_bytes)
                 
                 # Create full URL for the image with domain
                 image_url = f"{BACKEND_URL}/static/{image_filename}"
                 
-                logger.info(f"Generated frame image: {image_url}")
+                log_event(logger, logging.DEBUG, "frame.generate.stored", url=image_url)
                 
                 # Clean up the temporary file if we created one
                 if temp_file and os.path.exists(original_image_path):
                     os.unlink(original_image_path)
                     
             except Exception as e:
-                logger.error(f"Error generating frame image: {str(e)}")
+                log_event(logger, logging.ERROR, "frame.generate.image_failed", error=str(e))
                 # Clean up the temporary file if an error occurred
                 if temp_file and original_image_path and os.path.exists(original_image_path):
                     os.unlink(original_image_path)
+                if isinstance(e, UpstreamUnavailable):
+                    raise
                 raise Exception(f"Failed to generate frame image: {str(e)}")
                 
             # Create the frame
@@ -244,34 +322,36 @@ class AnimationService:
                 animation_id=animation_id,
                 url=image_url,
                 order=order,
-                prompt=prompt
+                prompt=prompt,
+                is_draft=draft
             )
             
-            # Save to database
-            db.add(frame)
-            db.commit()
-            db.refresh(frame)
+            # Save to database, batched with concurrent frame inserts
+            with stage_timer(DB_COMMIT, IMAGE_MODEL):
+                await frame_writes.add(frame)
             
-            logger.info(f"Created frame with ID {frame.id} at position {order}")
+            log_event(logger, logging.INFO, "frame.generate.completed", frame_id=frame.id, order=order)
             return frame
             
+        except (JobCancelled, UpstreamUnavailable):
+            raise
         except Exception as e:
-            logger.error(f"Error generating frame: {str(e)}")
+            log_event(logger, logging.ERROR, "frame.generate.failed", error=str(e))
             raise Exception(f"Failed to generate frame: {str(e)}")
     
     async def get_animation(self, animation_id: str) -> Dict[str, Any]:
         """Get animation details with its frames"""
         try:
-            db = next(get_db())
-            animation = db.query(Animation).filter(Animation.id == animation_id).first()
-            
-            if not animation:
-                return None
+            async with AsyncSessionLocal() as db:
+                animation = await db.scalar(select(Animation).where(Animation.id == animation_id))
                 
-            # Get all frames in order
-            frames = db.query(Frame).filter(
-                Frame.animation_id == animation_id
-            ).order_by(Frame.order).all()
+                if not animation:
+                    return None
+                    
+                # Get all frames in order
+                frames = (await db.scalars(
+                    select(Frame).where(Frame.animation_id == animation_id).order_by(Frame.order)
+                )).all()
             
             # Format response
             result = {
@@ -282,16 +362,7 @@ class AnimationService:
                 "fps": animation.fps,
                 "created_at": animation.created_at.isoformat() if animation.created_at else None,
                 "updated_at": animation.updated_at.isoformat() if animation.updated_at else None,
-                "frames": [
-                    {
-                        "id": frame.id,
-                        "url": frame.url,
-                        "order": frame.order,
-                        "prompt": frame.prompt,
-                        "created_at": frame.created_at.isoformat() if frame.created_at else None
-                    }
-                    for frame in frames
-                ]
+                "frames": [self.frame_to_dict(frame) for frame in frames]
             }
             
             return result
@@ -299,21 +370,34 @@ class AnimationService:
             logger.error(f"Error getting animation: {str(e)}")
             raise Exception(f"Failed to get animation: {str(e)}")
 
+    def frame_to_dict(self, frame: Frame) -> Dict[str, Any]:
+        """Format a frame for API responses"""
+        return {
+            "id": frame.id,
+            "url": frame.url,
+            "thumbnails": self.thumbnail_service.thumbnail_urls(frame.url),
+            "order": frame.order,
+            "prompt": frame.prompt,
+            "is_interpolated": bool(frame.is_interpolated),
+            "is_draft": bool(frame.is_draft),
+            "created_at": frame.created_at.isoformat() if frame.created_at else None
+        }
+        
     async def get_sprite_animations(self, sprite_id: str) -> List[Dict[str, Any]]:
         """Get all animations for a sprite"""
         try:
-            db = next(get_db())
-            animations = db.query(Animation).filter(
-                Animation.base_sprite_id == sprite_id
-            ).order_by(desc(Animation.created_at)).all()
+            async with AsyncSessionLocal() as db:
+                # Count the frames in the same query, rather than with a query per animation
+                animations = (await db.execute(
+                    select(Animation, func.count(Frame.id)).outerjoin(
+                        Frame, Frame.animation_id == Animation.id
+                    ).where(
+                        Animation.base_sprite_id == sprite_id
+                    ).group_by(Animation.id).order_by(desc(Animation.created_at))
+                )).all()
             
             results = []
-            for animation in animations:
-                # Get frame count
-                frame_count = db.query(Frame).filter(
-                    Frame.animation_id == animation.id
-                ).count()
-                
+            for animation, frame_count in animations:
                 results.append({
                     "id": animation.id,
                     "name": animation.name,
@@ -334,22 +418,21 @@ class AnimationService:
                             animation_type: Optional[str] = None, fps: Optional[int] = None) -> Dict[str, Any]:
         """Update animation properties"""
         try:
-            db = next(get_db())
-            animation = db.query(Animation).filter(Animation.id == animation_id).first()
-            
-            if not animation:
-                raise Exception(f"Animation with ID {animation_id} not found")
-                
-            # Update fields if provided
-            if name is not None:
-                animation.name = name
-            if animation_type is not None:
-                animation.animation_type = animation_type
-            if fps is not None:
-                animation.fps = fps
+            async with AsyncSessionLocal() as db:
+                animation = await db.scalar(select(Animation).where(Animation.id == animation_id))
                 
-            db.commit()
-            db.refresh(animation)
+                if not animation:
+                    raise Exception(f"Animation with ID {animation_id} not found")
+                    
+                # Update fields if provided
+                if name is not None:
+                    animation.name = name
+                if animation_type is not None:
+                    animation.animation_type = animation_type
+                if fps is not None:
+                    animation.fps = fps
+                    
+                await db.commit()
             
             # Return the updated animation
             return await self.get_animation(animation_id)
@@ -360,15 +443,19 @@ class AnimationService:
     async def delete_animation(self, animation_id: str) -> bool:
         """Delete an animation and its frames"""
         try:
-            db = next(get_db())
-            animation = db.query(Animation).filter(Animation.id == animation_id).first()
-            
-            if not animation:
-                return False
+            async with AsyncSessionLocal() as db:
+                # Load what the delete cascades to up front, instead of one preset run at a time
+                animation = await db.scalar(select(Animation).options(
+                    selectinload(Animation.frames),
+                    selectinload(Animation.preset_runs).selectinload(PresetRun.frames)
+                ).where(Animation.id == animation_id))
                 
-            # Delete the animation (frames will be cascade deleted)
-            db.delete(animation)
-            db.commit()
+                if not animation:
+                    return False
+                    
+                # Delete the animation (frames will be cascade deleted)
+                await db.delete(animation)
+                await db.commit()
             
             return True
         except Exception as e:
@@ -387,31 +474,30 @@ class AnimationService:
             The updated animation with frames
         """
         try:
-            db = next(get_db())
-            
-            # Verify animation exists
-            animation = db.query(Animation).filter(Animation.id == animation_id).first()
-            if not animation:
-                raise Exception(f"Animation with ID {animation_id} not found")
+            async with AsyncSessionLocal() as db:
+                # Verify animation exists
+                animation = await db.scalar(select(Animation).where(Animation.id == animation_id))
+                if not animation:
+                    raise Exception(f"Animation with ID {animation_id} not found")
+                    
+                # Get existing frames
+                existing_frames = (await db.scalars(
+                    select(Frame).where(Frame.animation_id == animation_id)
+                )).all()
                 
-            # Get existing frames
-            existing_frames = db.query(Frame).filter(
-                Frame.animation_id == animation_id
-            ).all()
-            
-            # Create a map of frame ID to frame object
-            frame_map = {frame.id: frame for frame in existing_frames}
-            
-            # Verify all frame IDs are valid
-            for frame_id in frame_order:
-                if frame_id not in frame_map:
-                    raise Exception(f"Frame with ID {frame_id} not found in animation {animation_id}")
-            
-            # Update order based on the provided list
-            for i, frame_id in enumerate(frame_order):
-                frame_map[frame_id].order = i
+                # Create a map of frame ID to frame object
+                frame_map = {frame.id: frame for frame in existing_frames}
                 
-            db.commit()
+                # Verify all frame IDs are valid
+                for frame_id in frame_order:
+                    if frame_id not in frame_map:
+                        raise Exception(f"Frame with ID {frame_id} not found in animation {animation_id}")
+                
+                # Update order based on the provided list
+                for i, frame_id in enumerate(frame_order):
+                    frame_map[frame_id].order = i
+                    
+                await db.commit()
             
             # Return the updated animation
             return await self.get_animation(animation_id)
@@ -422,36 +508,39 @@ class AnimationService:
     async def delete_frame(self, frame_id: str) -> bool:
         """Delete a specific frame"""
         try:
-            db = next(get_db())
-            frame = db.query(Frame).filter(Frame.id == frame_id).first()
-            
-            if not frame:
-                return False
+            async with AsyncSessionLocal() as db:
+                frame = await db.scalar(select(Frame).where(Frame.id == frame_id))
                 
-            # Store animation ID and current order for reordering
-            animation_id = frame.animation_id
-            deleted_order = frame.order
-            
-            # Delete the frame
-            db.delete(frame)
-            
-            # Update order of remaining frames
-            remaining_frames = db.query(Frame).filter(
-                Frame.animation_id == animation_id,
-                Frame.order > deleted_order
-            ).all()
-            
-            for frame in remaining_frames:
-                frame.order -= 1
+                if not frame:
+                    return False
+                    
+                # Store animation ID and current order for reordering
+                animation_id = frame.animation_id
+                deleted_order = frame.order
+                
+                # Delete the frame
+                await db.delete(frame)
+                
+                # Update order of remaining frames
+                remaining_frames = (await db.scalars(select(Frame).where(
+                    Frame.animation_id == animation_id,
+                    Frame.order > deleted_order
+                ))).all()
                 
-            db.commit()
+                for frame in remaining_frames:
+                    frame.order -= 1
+                    
+                await db.commit()
             
             return True
         except Exception as e:
             logger.error(f"Error deleting frame: {str(e)}")
             raise Exception(f"Failed to delete frame: {str(e)}")
             
-    async def generate_animation_preset(self, animation_id: str, preset_type: str, num_frames: int = 4) -> List[Frame]:
+    @traced()
+    async def generate_animation_preset(self, animation_id: str, preset_type: str, num_frames: int = 4,
+                                        num_keyframes: Optional[int] = None, interpolation: str = "motion",
+                                        draft: bool = False, job: Optional[Job] = None) -> List[Frame]:
         """
         Generate multiple frames based on a preset animation type
         
@@ -459,140 +548,544 @@ class AnimationService:
             animation_id: The animation ID
             preset_type: Type of animation (walk, run, idle, jump, etc.)
             num_frames: Number of frames to generate (default 4)
+            num_keyframes: Optional number of frames to generate with the image API; the
+                in-betweens are interpolated locally (if None, every frame uses the API)
+            interpolation: In-between method, "motion" or "crossfade"
+            draft: Whether to render the frames at the cheaper, faster draft quality
+            job: Optional job; once it is cancelled no further frames are generated and
+                the frames created so far are kept
             
         Returns:
             List of created frames
         """
         try:
-            db = next(get_db())
+            created_frames = [
+                frame async for frame in self.stream_animation_preset(
+                    animation_id=animation_id,
+                    preset_type=preset_type,
+                    num_frames=num_frames,
+                    num_keyframes=num_keyframes,
+                    interpolation=interpolation,
+                    draft=draft,
+                    job=job
+                )
+            ]
+            
+            # Keyframes of a hybrid run are created before their in-betweens
+            return sorted(created_frames, key=lambda frame: frame.order)
+        except (JobCancelled, UpstreamUnavailable):
+            raise
+        except Exception as e:
+            logger.error(f"Error generating preset animation: {str(e)}")
+            raise Exception(f"Failed to generate preset animation: {str(e)}")
             
+    async def stream_animation_preset(self, animation_id: str, preset_type: str, num_frames: int = 4,
+                                      num_keyframes: Optional[int] = None, interpolation: str = "motion",
+                                      draft: bool = False, job: Optional[Job] = None) -> AsyncIterator[Frame]:
+        """
+        Generate the frames of a preset animation, yielding each frame as soon as it is stored.
+        
+        Takes the same arguments as generate_animation_preset. In hybrid mode the
+        keyframes are yielded before the in-betweens, so consumers should place
+        frames by their order rather than by arrival.
+        """
+        if interpolation not in INTERPOLATION_METHODS:
+            raise Exception(f"Unsupported interpolation method: {interpolation}")
+            
+        async with AsyncSessionLocal() as db:
             # Verify animation exists
-            animation = db.query(Animation).filter(Animation.id == animation_id).first()
+            animation = await db.scalar(select(Animation).where(Animation.id == animation_id))
             if not animation:
                 raise Exception(f"Animation with ID {animation_id} not found")
                 
             # Get base sprite
-            base_sprite = db.query(Sprite).filter(Sprite.id == animation.base_sprite_id).first()
+            base_sprite = await db.scalar(select(Sprite).where(Sprite.id == animation.base_sprite_id))
             if not base_sprite:
                 raise Exception(f"Base sprite with ID {animation.base_sprite_id} not found")
                 
             # Update animation type
             animation.animation_type = preset_type
-            db.commit()
-            
-            # Define frame descriptions based on preset type
-            frame_descriptions = []
-            character_desc = base_sprite.description
-            
-            if preset_type == "idle":
-                # Base idle animation frames - we'll use as many as requested up to this number
-                base_idle_frames = [
-                    f"{character_desc} standing in neutral pose, completely still, looking exactly like the original sprite",
-                    f"{character_desc} in neutral pose with slight breathing motion, subtle movement but maintaining exact design",
-                    f"{character_desc} in neutral pose with slight head movement, keeping all design details consistent",
-                    f"{character_desc} with subtle blinking or small gesture, maintaining character design",
-                    f"{character_desc} with minimal weight shift, keeping exact style and colors",
-                    f"{character_desc} returning to completely still position, identical to original sprite design"
-                ]
-                
-                # Use the requested number of frames, but don't exceed what we have defined
-                max_frames = min(num_frames, len(base_idle_frames))
-                frame_descriptions = base_idle_frames[:max_frames]
-                
-                # If we need more frames than are defined, repeat the cycle
-                while len(frame_descriptions) < num_frames:
-                    remaining = num_frames - len(frame_descriptions)
-                    frame_descriptions.extend(base_idle_frames[:remaining])
-            elif preset_type == "walk":
-                # Base walk animation frames
-                base_walk_frames = [
-                    f"{character_desc} with left foot forward, right foot back in walking position, same design as original sprite",
-                    f"{character_desc} with feet passing each other in mid-step, maintaining exact design details",
-                    f"{character_desc} with right foot forward, left foot back in walking position, consistent with original sprite",
-                    f"{character_desc} with feet passing each other in mid-step, returning to first position, identical proportions"
-                ]
-                
-                # Use the requested number of frames
-                max_frames = min(num_frames, len(base_walk_frames))
-                frame_descriptions = base_walk_frames[:max_frames]
-                
-                # If we need more frames than are defined, repeat the cycle
-                while len(frame_descriptions) < num_frames:
-                    remaining = num_frames - len(frame_descriptions)
-                    frame_descriptions.extend(base_walk_frames[:remaining])
-                
-            elif preset_type == "run":
-                # Base run animation frames
-                base_run_frames = [
-                    f"{character_desc} in running pose with right leg forward, left leg back, arms in opposite position, same design",
-                    f"{character_desc} in mid-air running pose, legs tucked slightly, maintaining exact character design",
-                    f"{character_desc} in running pose with left leg forward, right leg back, arms in opposite position, consistent colors",
-                    f"{character_desc} in mid-air running pose, legs tucked slightly, returning to first position, identical style"
-                ]
-                
-                # Use the requested number of frames
-                max_frames = min(num_frames, len(base_run_frames))
-                frame_descriptions = base_run_frames[:max_frames]
-                
-                # If we need more frames than are defined, repeat the cycle
-                while len(frame_descriptions) < num_frames:
-                    remaining = num_frames - len(frame_descriptions)
-                    frame_descriptions.extend(base_run_frames[:remaining])
-                
-            elif preset_type == "jump":
-                # Base jump animation frames
-                base_jump_frames = [
-                    f"{character_desc} in pre-jump crouching position, maintaining exact design details",
-                    f"{character_desc} pushing off ground, beginning to rise, same design as original sprite",
-                    f"{character_desc} in mid-air at peak of jump, limbs extended, consistent with original sprite",
-                    f"{character_desc} beginning to fall from jump, maintaining same character design",
-                    f"{character_desc} landing with bent knees to absorb impact, identical proportions and style",
-                    f"{character_desc} returning to neutral standing position, matching original design perfectly"
+            
+            frame_descriptions = self._plan_frame_descriptions(preset_type, base_sprite.description, num_frames)
+            
+            # Record the plan before generating anything so a failed or cancelled run can be resumed
+            run = PresetRun(
+                id=str(uuid.uuid4()),
+                animation_id=animation_id,
+                preset_type=preset_type,
+                # Only a hybrid run generates fewer keyframes than frames
+                num_keyframes=num_keyframes if num_keyframes is not None and num_keyframes < len(frame_descriptions) else None,
+                interpolation=interpolation,
+                is_draft=draft,
+                frames=[
+                    PresetRunFrame(id=str(uuid.uuid4()), order=order, description=description)
+                    for order, description in enumerate(frame_descriptions)
                 ]
+            )
+            db.add(run)
+            await db.commit()
+        logger.info(f"Planned preset run {run.id} with {len(frame_descriptions)} frames")
+        
+        async for frame in self._execute_preset_run(run.id, job):
+            yield frame
+            
+    @traced()
+    async def resume_preset_run(self, run_id: str, job: Optional[Job] = None) -> List[Frame]:
+        """
+        Resume a failed or cancelled preset run, generating only its missing frames.
+        
+        Args:
+            run_id: The preset run ID
+            job: Optional job; once it is cancelled no further frames are generated
+            
+        Returns:
+            List of frames created by this call
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                run = await db.scalar(select(PresetRun).where(PresetRun.id == run_id))
+            if not run:
+                raise Exception(f"Preset run with ID {run_id} not found")
+            if run.status == "completed":
+                raise Exception(f"Preset run with ID {run_id} is already completed")
                 
-                # Use the requested number of frames
-                max_frames = min(num_frames, len(base_jump_frames))
-                frame_descriptions = base_jump_frames[:max_frames]
-                
-                # If we need more frames than are defined, repeat the cycle
-                while len(frame_descriptions) < num_frames:
-                    remaining = num_frames - len(frame_descriptions)
-                    frame_descriptions.extend(base_jump_frames[:remaining])
+            created_frames = [frame async for frame in self._execute_preset_run(run_id, job)]
+            return sorted(created_frames, key=lambda frame: frame.order)
+        except (JobCancelled, UpstreamUnavailable):
+            raise
+        except Exception as e:
+            logger.error(f"Error resuming preset run: {str(e)}")
+            raise Exception(f"Failed to resume preset run: {str(e)}")
+            
+    async def _execute_preset_run(self, run_id: str, job: Optional[Job] = None) -> AsyncIterator[Frame]:
+        """
+        Generate the frames of a preset run that are not stored yet, checkpointing each one.
+        
+        The run status ends up completed, failed or cancelled. Frames stored before
+        a failure are kept, so resuming the run only pays for the missing ones.
+        """
+        # One session checkpoints the whole run; each commit returns its connection to the
+        # pool, so none is held while the frames are generated
+        async with AsyncSessionLocal() as db:
+            run = await db.scalar(select(PresetRun).options(selectinload(PresetRun.frames)).where(PresetRun.id == run_id))
+            run_frames = {run_frame.order: run_frame for run_frame in run.frames}
+            frame_descriptions = [run_frames[order].description for order in sorted(run_frames)]
+        
+            # Keep frames stored by earlier attempts, unless they have been deleted since
+            frame_ids = [run_frame.frame_id for run_frame in run_frames.values() if run_frame.frame_id]
+            stored_frames = {
+                frame.id: frame for frame in await db.scalars(select(Frame).where(Frame.id.in_(frame_ids)))
+            } if frame_ids else {}
+            existing_frames = {}
+            for order, run_frame in run_frames.items():
+                frame = stored_frames.get(run_frame.frame_id)
+                if frame:
+                    existing_frames[order] = frame
+                else:
+                    run_frame.status = "pending"
+                    run_frame.frame_id = None
                 
-            else:
-                # Generic animation for unknown types
-                base_generic_frames = [
-                    f"{character_desc} in {preset_type} animation, frame 1, matching original sprite design exactly", 
-                    f"{character_desc} in {preset_type} animation, frame 2, consistent with original design",
-                    f"{character_desc} in {preset_type} animation, frame 3, maintaining exact character design", 
-                    f"{character_desc} in {preset_type} animation, frame 4, identical style and proportions"
-                ]
+            run.status = "running"
+            run.error = None
+            await db.commit()
+        
+            if existing_frames:
+                logger.info(f"Resuming preset run {run_id}: {len(existing_frames)}/{len(run_frames)} frames already stored")
+            
+            try:
+                if run.num_keyframes is not None:
+                    # Generate only the keyframes through the API and fill the gaps locally
+                    frames = self._generate_hybrid_frames(
+                        animation_id=run.animation_id,
+                        frame_descriptions=frame_descriptions,
+                        num_keyframes=run.num_keyframes,
+                        interpolation=run.interpolation,
+                        looping=run.preset_type in LOOPING_PRESETS,
+                        draft=run.is_draft,
+                        job=job,
+                        existing_frames=existing_frames
+                    )
+                else:
+                    frames = self._generate_missing_frames(
+                        animation_id=run.animation_id,
+                        frame_descriptions=frame_descriptions,
+                        draft=run.is_draft,
+                        job=job,
+                        existing_frames=existing_frames
+                    )
                 
-                # Generate more frames if needed by creating descriptive variations
-                if num_frames > 4:
-                    for i in range(5, num_frames + 1):
-                        base_generic_frames.append(
-                            f"{character_desc} in {preset_type} animation, frame {i}, maintaining consistent style and design"
-                        )
+                async for frame in frames:
+                    run_frame = run_frames[frame.order]
+                    run_frame.status = "completed"
+                    run_frame.frame_id = frame.id
+                    run_frame.error = None
+                    await db.commit()
+                    yield frame
+            except (JobCancelled, asyncio.CancelledError, GeneratorExit):
+                # Shielded, in a session of its own: a second cancellation (or the loop closing
+                # the generator) must not interrupt the write and leave the run "running"
+                await asyncio.shield(self._set_preset_run_status(run_id, "cancelled"))
+                raise
+            except FrameGenerationError as e:
+                run_frames[e.order].status = "failed"
+                run_frames[e.order].error = str(e)
+                run.status = "failed"
+                run.error = str(e)
+                await db.commit()
+                raise Exception(f"{str(e)}. The frames generated so far are kept; resume preset run {run_id} to generate the rest")
+            except UpstreamUnavailable as e:
+                run.status = "failed"
+                run.error = str(e)
+                await db.commit()
+                raise type(e)(
+                    f"{str(e)}. The frames generated so far are kept; resume preset run {run_id} to generate the rest",
+                    e.retry_after
+                )
+            except Exception as e:
+                run.status = "failed"
+                run.error = str(e)
+                await db.commit()
+                raise
+            
+            run.status = "completed"
+            await db.commit()
+        
+    async def _set_preset_run_status(self, run_id: str, status: str) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(PresetRun).where(PresetRun.id == run_id).values(status=status))
+            await db.commit()
+        
+    async def _generate_missing_frames(self, animation_id: str, frame_descriptions: List[str], draft: bool = False,
+                                       job: Optional[Job] = None,
+                                       existing_frames: Optional[Dict[int, Frame]] = None) -> AsyncIterator[Frame]:
+        """Generate every planned frame that is not in `existing_frames`, in order"""
+        existing_frames = existing_frames or {}
+        for order, description in enumerate(frame_descriptions):
+            if order in existing_frames:
+                continue
+            yield await self._generate_frame_with_retries(
+                animation_id=animation_id,
+                prompt=description,
+                order=order,
+                draft=draft,
+                job=job
+            )
+            
+    async def _generate_frame_with_retries(self, animation_id: str, prompt: str, order: int, draft: bool = False,
+                                           job: Optional[Job] = None) -> Frame:
+        """Generate a single preset frame, retrying it with exponential backoff before giving up"""
+        delay = PRESET_FRAME_RETRY_DELAY
+        for attempt in range(1, PRESET_FRAME_MAX_ATTEMPTS + 1):
+            try:
+                return await self.generate_frame(
+                    animation_id=animation_id,
+                    prompt=prompt,
+                    order=order,
+                    draft=draft,
+                    job=job
+                )
+            except (JobCancelled, UpstreamUnavailable):
+                # Retrying cannot help while the upstream is down or the deadline has passed
+                raise
+            except Exception as e:
+                if attempt == PRESET_FRAME_MAX_ATTEMPTS:
+                    raise FrameGenerationError(order, f"Frame {order} failed after {attempt} attempts: {str(e)}")
+                remaining = deadline_remaining()
+                if remaining is not None and remaining <= delay:
+                    raise UpstreamDeadlineExceeded(f"The request deadline leaves no time to retry frame {order}: {str(e)}")
+                logger.warning(f"Frame {order} failed (attempt {attempt}/{PRESET_FRAME_MAX_ATTEMPTS}), retrying in {delay}s: {str(e)}")
+                count_retry(FRAME, IMAGE_MODEL)
+                await asyncio.sleep(delay)
+                delay *= 2
                 
-                # Use the requested number of frames
-                frame_descriptions = base_generic_frames[:num_frames]
+    async def get_preset_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """Get a preset run with the state of each of its planned frames"""
+        try:
+            async with AsyncSessionLocal() as db:
+                run = await db.scalar(
+                    select(PresetRun).options(selectinload(PresetRun.frames)).where(PresetRun.id == run_id)
+                )
+            return self.preset_run_to_dict(run) if run else None
+        except Exception as e:
+            logger.error(f"Error getting preset run: {str(e)}")
+            raise Exception(f"Failed to get preset run: {str(e)}")
+            
+    async def get_animation_preset_runs(self, animation_id: str) -> List[Dict[str, Any]]:
+        """Get the preset runs of an animation, newest first"""
+        try:
+            async with AsyncSessionLocal() as db:
+                runs = (await db.scalars(select(PresetRun).options(selectinload(PresetRun.frames)).where(
+                    PresetRun.animation_id == animation_id
+                ).order_by(desc(PresetRun.created_at)))).all()
+            return [self.preset_run_to_dict(run) for run in runs]
+        except Exception as e:
+            logger.error(f"Error getting preset runs: {str(e)}")
+            raise Exception(f"Failed to get preset runs: {str(e)}")
+            
+    def preset_run_to_dict(self, run: PresetRun) -> Dict[str, Any]:
+        """Format a preset run for API responses"""
+        return {
+            "id": run.id,
+            "animation_id": run.animation_id,
+            "preset_type": run.preset_type,
+            "status": run.status,
+            "error": run.error,
+            "num_keyframes": run.num_keyframes,
+            "interpolation": run.interpolation,
+            "is_draft": bool(run.is_draft),
+            "frames_total": len(run.frames),
+            "frames_completed": sum(1 for run_frame in run.frames if run_frame.status == "completed"),
+            "frames": [
+                {
+                    "order": run_frame.order,
+                    "status": run_frame.status,
+                    "frame_id": run_frame.frame_id,
+                    "error": run_frame.error
+                }
+                for run_frame in run.frames
+            ],
+            "created_at": run.created_at.isoformat() if run.created_at else None,
+            "updated_at": run.updated_at.isoformat() if run.updated_at else None
+        }
+        
+    def _plan_frame_descriptions(self, preset_type: str, character_desc: str, num_frames: int) -> List[str]:
+        """Build the prompt of every frame of a preset animation, in order"""
+        # Define frame descriptions based on preset type
+        frame_descriptions = []
+        
+        if preset_type == "idle":
+            # Base idle animation frames - we'll use as many as requested up to this number
+            base_idle_frames = [
+                f"{character_desc} standing in neutral pose, completely still, looking exactly like the original sprite",
+                f"{character_desc} in neutral pose with slight breathing motion, subtle movement but maintaining exact design",
+                f"{character_desc} in neutral pose with slight head movement, keeping all design details consistent",
+                f"{character_desc} with subtle blinking or small gesture, maintaining character design",
+                f"{character_desc} with minimal weight shift, keeping exact style and colors",
+                f"{character_desc} returning to completely still position, identical to original sprite design"
+            ]
+        
+            # Use the requested number of frames, but don't exceed what we have defined
+            max_frames = min(num_frames, len(base_idle_frames))
+            frame_descriptions = base_idle_frames[:max_frames]
+        
+            # If we need more frames than are defined, repeat the cycle
+            while len(frame_descriptions) < num_frames:
+                remaining = num_frames - len(frame_descriptions)
+                frame_descriptions.extend(base_idle_frames[:remaining])
+        elif preset_type == "walk":
+            # Base walk animation frames
+            base_walk_frames = [
+                f"{character_desc} with left foot forward, right foot back in walking position, same design as original sprite",
+                f"{character_desc} with feet passing each other in mid-step, maintaining exact design details",
+                f"{character_desc} with right foot forward, left foot back in walking position, consistent with original sprite",
+                f"{character_desc} with feet passing each other in mid-step, returning to first position, identical proportions"
+            ]
+        
+            # Use the requested number of frames
+            max_frames = min(num_frames, len(base_walk_frames))
+            frame_descriptions = base_walk_frames[:max_frames]
+        
+            # If we need more frames than are defined, repeat the cycle
+            while len(frame_descriptions) < num_frames:
+                remaining = num_frames - len(frame_descriptions)
+                frame_descriptions.extend(base_walk_frames[:remaining])
+        
+        elif preset_type == "run":
+            # Base run animation frames
+            base_run_frames = [
+                f"{character_desc} in running pose with right leg forward, left leg back, arms in opposite position, same design",
+                f"{character_desc} in mid-air running pose, legs tucked slightly, maintaining exact character design",
+                f"{character_desc} in running pose with left leg forward, right leg back, arms in opposite position, consistent colors",
+                f"{character_desc} in mid-air running pose, legs tucked slightly, returning to first position, identical style"
+            ]
+        
+            # Use the requested number of frames
+            max_frames = min(num_frames, len(base_run_frames))
+            frame_descriptions = base_run_frames[:max_frames]
+        
+            # If we need more frames than are defined, repeat the cycle
+            while len(frame_descriptions) < num_frames:
+                remaining = num_frames - len(frame_descriptions)
+                frame_descriptions.extend(base_run_frames[:remaining])
+        
+        elif preset_type == "jump":
+            # Base jump animation frames
+            base_jump_frames = [
+                f"{character_desc} in pre-jump crouching position, maintaining exact design details",
+                f"{character_desc} pushing off ground, beginning to rise, same design as original sprite",
+                f"{character_desc} in mid-air at peak of jump, limbs extended, consistent with original sprite",
+                f"{character_desc} beginning to fall from jump, maintaining same character design",
+                f"{character_desc} landing with bent knees to absorb impact, identical proportions and style",
+                f"{character_desc} returning to neutral standing position, matching original design perfectly"
+            ]
+        
+            # Use the requested number of frames
+            max_frames = min(num_frames, len(base_jump_frames))
+            frame_descriptions = base_jump_frames[:max_frames]
+        
+            # If we need more frames than are defined, repeat the cycle
+            while len(frame_descriptions) < num_frames:
+                remaining = num_frames - len(frame_descriptions)
+                frame_descriptions.extend(base_jump_frames[:remaining])
+        
+        else:
+            # Generic animation for unknown types
+            base_generic_frames = [
+                f"{character_desc} in {preset_type} animation, frame 1, matching original sprite design exactly", 
+                f"{character_desc} in {preset_type} animation, frame 2, consistent with original design",
+                f"{character_desc} in {preset_type} animation, frame 3, maintaining exact character design", 
+                f"{character_desc} in {preset_type} animation, frame 4, identical style and proportions"
+            ]
+        
+            # Generate more frames if needed by creating descriptive variations
+            if num_frames > 4:
+                for i in range(5, num_frames + 1):
+                    base_generic_frames.append(
+                        f"{character_desc} in {preset_type} animation, frame {i}, maintaining consistent style and design"
+                    )
+        
+            # Use the requested number of frames
+            frame_descriptions = base_generic_frames[:num_frames]
+        
+        return frame_descriptions
+                    
+    @traced()
+    async def _generate_hybrid_frames(self, animation_id: str, frame_descriptions: List[str], num_keyframes: int,
+                                      interpolation: str, looping: bool, draft: bool = False,
+                                      job: Optional[Job] = None,
+                                      existing_frames: Optional[Dict[int, Frame]] = None) -> AsyncIterator[Frame]:
+        """
+        Generate evenly spaced keyframes with the image API and interpolate the frames between them.
+        
+        Args:
+            animation_id: The animation ID
+            frame_descriptions: Planned description of every frame, in order
+            num_keyframes: Number of frames to generate with the image API
+            interpolation: In-between method, "motion" or "crossfade"
+            looping: Whether the last frames lead back into the first one
+            draft: Whether to render the keyframes at draft quality
+            job: Optional job to stop at once it has been cancelled
+            existing_frames: Frames already stored by an earlier attempt, by order; these
+                are reused as keyframes and not generated again
+            
+        Yields:
+            Each created frame as soon as it is stored, all keyframes first
+        """
+        num_frames = len(frame_descriptions)
+        
+        # A one-shot animation needs its first and last frame generated
+        if looping:
+            num_keyframes = max(1, num_keyframes)
+            keyframe_orders = sorted({round(i * num_frames / num_keyframes) for i in range(num_keyframes)})
+        else:
+            num_keyframes = max(2, num_keyframes)
+            keyframe_orders = sorted({round(i * (num_frames - 1) / (num_keyframes - 1)) for i in range(num_keyframes)})
+            
+        logger.info(f"Generating {len(keyframe_orders)} keyframes at orders {keyframe_orders} and interpolating {num_frames - len(keyframe_orders)} frames")
+        
+        created_frames = dict(existing_frames or {})
+        for order in keyframe_orders:
+            if order in created_frames:
+                continue
+            created_frames[order] = await self._generate_frame_with_retries(
+                animation_id=animation_id,
+                prompt=frame_descriptions[order],
+                order=order,
+                draft=draft,
+                job=job
+            )
+            yield created_frames[order]
+            
+        # Pair up neighbouring keyframes; a looping animation also fills the gap back to the start
+        segments = list(zip(keyframe_orders, keyframe_orders[1:]))
+        if looping:
+            segments.append((keyframe_orders[-1], keyframe_orders[0] + num_frames))
+            
+        for start_order, end_order in segments:
+            gap_orders = list(range(start_order + 1, end_order))
+            if all(order in created_frames for order in gap_orders):
+                continue
+            if job:
+                job.raise_if_cancelled()
                 
-            # Generate frames
-            created_frames = []
-            for i, description in enumerate(frame_descriptions):
-                frame = await self.generate_frame(
+            start_frame = created_frames[start_order]
+            end_frame = created_frames[end_order % num_frames]
+            start_data, end_data = await asyncio.gather(
+                asyncio.to_thread(read_image_bytes, start_frame.url),
+                asyncio.to_thread(read_image_bytes, end_frame.url)
+            )
+            start_image = Image.open(io.BytesIO(start_data))
+            end_image = Image.open(io.BytesIO(end_data))
+            
+            in_betweens = await asyncio.to_thread(
+                self.interpolation_service.interpolate_sequence,
+                start_image, end_image, len(gap_orders), interpolation
+            )
+            
+            for order, image in zip(gap_orders, in_betweens):
+                if order in created_frames:
+                    continue
+                created_frames[order] = await self._save_interpolated_frame(
                     animation_id=animation_id,
-                    prompt=description,
-                    order=i
+                    image=image,
+                    order=order,
+                    prompt=frame_descriptions[order],
+                    draft=draft
                 )
-                created_frames.append(frame)
+                yield created_frames[order]
+        
+    async def _save_interpolated_frame(self, animation_id: str, image: Image.Image, order: int, prompt: str, draft: bool = False) -> Frame:
+        """Store a locally synthesized frame image and record it as an interpolated frame"""
+        frame = Frame(
+            id=str(uuid.uuid4()),
+            animation_id=animation_id,
+            url=save_image(image),
+            order=order,
+            prompt=prompt,
+            is_interpolated=True,
+            is_draft=draft
+        )
+        
+        await frame_writes.add(frame)
+        
+        logger.info(f"Created interpolated frame with ID {frame.id} at position {order}")
+        return frame
+            
+    async def promote_frame(self, frame_id: str) -> Dict[str, Any]:
+        """
+        Re-render a draft frame at final quality and mark it as final.
+        
+        Args:
+            frame_id: The frame ID
+            
+        Returns:
+            The updated frame
+        """
+        try:
+            async with AsyncSessionLocal() as db:
+                frame = await db.scalar(select(Frame).where(Frame.id == frame_id))
+            if not frame:
+                raise Exception(f"Frame with ID {frame_id} not found")
+            if not frame.is_draft:
+                raise Exception(f"Frame with ID {frame_id} is not a draft")
                 
-            return created_frames
+            frame.url = await self.sprite_service.render_final(frame.url, frame.prompt or "an animation frame")
+            frame.is_draft = False
+            # The final render comes from the image API, not from local interpolation
+            frame.is_interpolated = False
+            async with AsyncSessionLocal() as db:
+                db.add(frame)
+                await db.commit()
+            
+            logger.info(f"Promoted frame {frame_id} to final quality")
+            return self.frame_to_dict(frame)
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
-            logger.error(f"Error generating preset animation: {str(e)}")
-            raise Exception(f"Failed to generate preset animation: {str(e)}")
+            logger.error(f"Error promoting frame: {str(e)}")
+            raise Exception(f"Failed to promote frame: {str(e)}")
             
+    @traced()
     async def generate_spritesheet(self, animation_id: str) -> Dict[str, Any]:
         """
         Generate a spritesheet from animation frames
@@ -613,15 +1106,7 @@ class AnimationService:
             if not frames:
                 raise Exception(f"Animation has no frames")
                 
-            # Parameters for the spritesheet
             num_frames = len(frames)
-            rows = 1
-            cols = num_frames
-            
-            # If there are more than 10 frames, organize in a grid
-            if num_frames > 10:
-                rows = int(num_frames ** 0.5)  # Square root for balanced grid
-                cols = (num_frames + rows - 1) // rows  # Ceiling division
                 
             # Download all frame images
             frame_images = []
@@ -676,19 +1161,8 @@ class AnimationService:
                 raise Exception("Failed to load any frame images")
                 
             frame_width, frame_height = frame_images[0].size
-            
-            # Create the spritesheet
-            spritesheet_width = frame_width * cols
-            spritesheet_height = frame_height * rows
-            spritesheet = Image.new('RGBA', (spritesheet_width, spritesheet_height), (0, 0, 0, 0))
-            
-            # Place each frame in the spritesheet
-            for i, frame_img in enumerate(frame_images):
-                row = i // cols
-                col = i % cols
-                x = col * frame_width
-                y = row * frame_height
-                spritesheet.paste(frame_img, (x, y))
+            spritesheet, rows, cols = compose_spritesheet(frame_images)
+            spritesheet_width, spritesheet_height = spritesheet.size
                 
             # Save the spritesheet
             sheet_filename = f"spritesheet_{animation_id}.png"
@@ -712,4 +1186,114 @@ class AnimationService:
             }
         except Exception as e:
             logger.error(f"Error generating spritesheet: {str(e)}")
-            raise Exception(f"Failed to generate spritesheet: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Failed to generate spritesheet: {str(e)}")
+
+    @traced()
+    async def generate_preview(self, animation_id: str, image_format: str = "gif", size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Render the animation frames into a single animated image played at the stored fps.
+        
+        Rendered previews are cached on disk, keyed by the digests of the ordered
+        frame images, the fps, the format and the size, so reordering, editing or
+        retiming the animation produces a new preview while repeat requests are free.
+        
+        Args:
+            animation_id: The animation ID
+            image_format: One of "gif", "webp" or "apng"
+            size: Optional maximum edge length of the preview in pixels
+            
+        Returns:
+            Dictionary with the local path and media type of the preview
+        """
+        try:
+            if image_format not in PREVIEW_FORMATS:
+                raise Exception(f"Unsupported preview format: {image_format}")
+            extension, media_type = PREVIEW_FORMATS[image_format]
+            
+            async with AsyncSessionLocal() as db:
+                animation = await db.scalar(select(Animation).where(Animation.id == animation_id))
+                if not animation:
+                    raise Exception(f"Animation with ID {animation_id} not found")
+                    
+                frames = (await db.scalars(
+                    select(Frame).where(Frame.animation_id == animation_id).order_by(Frame.order)
+                )).all()
+            if not frames:
+                raise Exception("Animation has no frames")
+            
+            fps = animation.fps or 12
+            
+            # Read the frame images (off the event loop) and build the cache key from their content
+            frame_data = await asyncio.gather(*(asyncio.to_thread(read_image_bytes, frame.url) for frame in frames))
+            cache_key = hashlib.sha256()
+            cache_key.update(f"{image_format}:{size}:{fps}".encode())
+            for data in frame_data:
+                cache_key.update(hashlib.sha256(data).digest())
+            
+            preview_path = os.path.join(PREVIEW_DIR, f"{cache_key.hexdigest()}.{extension}")
+            
+            if os.path.exists(preview_path):
+                logger.info(f"Serving cached preview for animation {animation_id}")
+                count_cache_hit("preview")
+            else:
+                logger.info(f"Rendering {image_format} preview for animation {animation_id} ({len(frames)} frames at {fps} fps)")
+                with stage_timer(ENCODE):
+                    await asyncio.to_thread(self._encode_preview, frame_data, preview_path, image_format, fps, size)
+                
+            return {"path": preview_path, "media_type": media_type}
+        except Exception as e:
+            logger.error(f"Error generating preview: {str(e)}")
+            raise Exception(f"Failed to generate preview: {str(e)}")
+            
+    def _encode_preview(self, frame_data: List[bytes], preview_path: str, image_format: str, fps: int, size: Optional[int]) -> None:
+        """Decode, optionally downscale and encode the frames into an animated image file"""
+        images = []
+        for data in frame_data:
+            img = Image.open(io.BytesIO(data)).convert("RGBA")
+            if size:
+                img.thumbnail((size, size), Image.LANCZOS)
+            images.append(img)
+            
+        # Frames can differ in size; pad them all onto the largest canvas
+        width = max(img.width for img in images)
+        height = max(img.height for img in images)
+        canvases = []
+        for img in images:
+            if img.size != (width, height):
+                canvas = Image.new("RGBA", (width, height), (0, 0, 0, 0))
+                canvas.paste(img, ((width - img.width) // 2, (height - img.height) // 2))
+                img = canvas
+            canvases.append(img)
+            
+        duration = max(1, round(1000 / fps))
+        os.makedirs(PREVIEW_DIR, exist_ok=True)
+        
+        # Write to a temporary name first so concurrent readers never see a partial file
+        temp_path = f"{preview_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            if image_format == "gif":
+                # GIF has 1-bit transparency: quantize to 255 colors and reserve index 255
+                paletted = []
+                for img in canvases:
+                    frame = img.convert("RGB").quantize(colors=255)
+                    transparent = img.getchannel("A").point(lambda a: 255 if a < 128 else 0)
+                    frame.paste(255, mask=transparent)
+                    paletted.append(frame)
+                paletted[0].save(
+                    temp_path, format="GIF", save_all=True, append_images=paletted[1:],
+                    duration=duration, loop=0, disposal=2, transparency=255
+                )
+            elif image_format == "webp":
+                canvases[0].save(
+                    temp_path, format="WEBP", save_all=True, append_images=canvases[1:],
+                    duration=duration, loop=0, quality=80
+                )
+            else:
+                canvases[0].save(
+                    temp_path, format="PNG", save_all=True, append_images=canvases[1:],
+                    duration=duration, loop=0, disposal=1, blend=0
+                )
+            os.replace(temp_path, preview_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -0,0 +1,158 @@
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from ..models.idempotency import IdempotencyKey
+from ..utils.database import AsyncSessionLocal
+from ..utils.stages import count_cache_hit
+from ..constants import IDEMPOTENCY_KEY_TTL_HOURS, IDEMPOTENCY_IN_PROGRESS_TTL, IDEMPOTENCY_WAIT_TIMEOUT
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+# Set on responses that were replayed from a stored result
+REPLAYED_HEADER = "Idempotent-Replayed"
+
+# Seconds between checks on a request with the same key that is still running
+POLL_INTERVAL = 0.5
+
+
+class IdempotencyError(Exception):
+    """A request whose Idempotency-Key cannot be honored, with the HTTP status to answer"""
+
+    def __init__(self, message: str, status_code: int):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IdempotencyService:
+    """
+    Makes generation endpoints safe to retry with an Idempotency-Key header.
+
+    The first request with a key claims it in the database and runs; its
+    response is stored for IDEMPOTENCY_KEY_TTL_HOURS. A retry with the same key
+    and body gets the stored response instead of a new generation, or waits for
+    it if the first request is still running, in any worker process. A failed
+    request releases its key so it can be retried.
+    """
+
+    async def run(self, request: Request, response: Response, scope: str, payload: Any,
+                  handler: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run an endpoint handler at most once per Idempotency-Key.
+
+        Args:
+            request: The incoming request, for the Idempotency-Key header
+            response: The outgoing response, marked when a stored result is replayed
+            scope: Name of the endpoint; a key only applies within its scope
+            payload: The request parameters; reusing a key with other parameters is an error
+            handler: Produces the JSON-compatible response when the request must run
+
+        Returns:
+            The response of the handler, fresh or replayed
+        """
+        key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if not key:
+            return await handler()
+        if len(key) > 255:
+            raise IdempotencyError(f"{IDEMPOTENCY_KEY_HEADER} must be at most 255 characters", 400)
+
+        request_hash = hashlib.sha256(
+            json.dumps(jsonable_encoder(payload), sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+        found, stored = await self._claim(key, scope, request_hash)
+        if found:
+            logger.info(f"Replaying stored response for {scope} with {IDEMPOTENCY_KEY_HEADER} {key}")
+            response.headers[REPLAYED_HEADER] = "true"
+            count_cache_hit("idempotency")
+            return stored
+
+        try:
+            result = await handler()
+        except BaseException:
+            await self._release(key, scope)
+            raise
+
+        await self._store(key, scope, jsonable_encoder(result))
+        return result
+
+    async def _claim(self, key: str, scope: str, request_hash: str):
+        """
+        Claim a key for a new request, or get the stored response of an earlier one.
+
+        Returns (False, None) once the key is claimed, or (True, response) for a replay.
+        """
+        async with AsyncSessionLocal() as db:
+            deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+            while True:
+                now = datetime.utcnow()
+                try:
+                    # Expired keys are forgotten, including requests that never finished
+                    await db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < now))
+                    db.add(IdempotencyKey(
+                        key=key,
+                        scope=scope,
+                        request_hash=request_hash,
+                        status="in_progress",
+                        expires_at=now + timedelta(seconds=IDEMPOTENCY_IN_PROGRESS_TTL)
+                    ))
+                    await db.commit()
+                    return False, None
+                except IntegrityError:
+                    await db.rollback()
+
+                record = await db.scalar(select(IdempotencyKey).where(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.scope == scope
+                ))
+                if record is None:
+                    # Released by a failed request in the meantime
+                    continue
+                if record.request_hash != request_hash:
+                    raise IdempotencyError(f"{IDEMPOTENCY_KEY_HEADER} {key} was already used for a different request", 422)
+                if record.status == "completed":
+                    return True, json.loads(record.response_body)
+
+                if time.monotonic() >= deadline:
+                    raise IdempotencyError(f"A request with {IDEMPOTENCY_KEY_HEADER} {key} is still in progress", 409)
+
+                # Attach to the request that is running: wait for its response
+                await db.rollback()
+                db.expunge_all()
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _store(self, key: str, scope: str, result: Any) -> None:
+        async with AsyncSessionLocal() as db:
+            record = await db.scalar(select(IdempotencyKey).where(
+                IdempotencyKey.key == key,
+                IdempotencyKey.scope == scope
+            ))
+            if record is None:
+                return
+            record.status = "completed"
+            record.status_code = 200
+            record.response_body = json.dumps(result)
+            record.expires_at = datetime.utcnow() + timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+            await db.commit()
+
+    async def _release(self, key: str, scope: str) -> None:
+        try:
+            async with AsyncSessionLocal() as db:
+                await db.execute(delete(IdempotencyKey).where(
+                    IdempotencyKey.key == key,
+                    IdempotencyKey.scope == scope,
+                    IdempotencyKey.status == "in_progress"
+                ))
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Error releasing {IDEMPOTENCY_KEY_HEADER} {key}: {str(e)}")
@@ -0,0 +1,235 @@
+import io
+import time
+import inspect
+import base64
+import random
+import hashlib
+import logging
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional, Tuple, Type
+import numpy as np
+import openai
+from PIL import Image, ImageDraw
+
+from ..constants import (
+    IMAGE_PROVIDER, LOCAL_IMAGE_LATENCY, LOCAL_IMAGE_LATENCY_JITTER, LOCAL_IMAGE_ERROR_RATE, LOCAL_IMAGE_SEED
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Edge length used when a request leaves the size to the provider ("auto")
+DEFAULT_IMAGE_EDGE = 1024
+
+
+class ImageProviderError(Exception):
+    """A failed image request; transient failures are retried by the upstream scheduler"""
+
+    def __init__(self, message: str, transient: bool = False):
+        super().__init__(message)
+        self.transient = transient
+
+
+class ImageProvider(ABC):
+    """
+    A backend that creates and edits images for the generation services.
+
+    Methods are blocking: the upstream scheduler runs them in worker threads,
+    retries their transient failures and enforces the rate and concurrency
+    budgets around them. Both return the image as base64-encoded PNG data.
+    Parameters follow the OpenAI images API (model, prompt, size, quality,
+    background, ...); providers ignore the ones they do not support.
+    """
+
+    name = ""
+
+    @abstractmethod
+    def generate(self, timeout: Optional[float] = None, **params: Any) -> str:
+        """Create an image from the parameters"""
+
+    @abstractmethod
+    def edit(self, image: Tuple[str, bytes, str], timeout: Optional[float] = None, **params: Any) -> str:
+        """Create an image from a reference image (file name, content, MIME type) and the parameters"""
+
+
+class OpenAIImageProvider(ImageProvider):
+    """The OpenAI images API"""
+
+    name = "openai"
+
+    def generate(self, timeout: Optional[float] = None, **params: Any) -> str:
+        response = openai.images.generate(timeout=timeout, **self._sdk_params(openai.images.generate, params))
+        return response.data[0].b64_json
+
+    def edit(self, image: Tuple[str, bytes, str], timeout: Optional[float] = None, **params: Any) -> str:
+        response = openai.images.edit(image=image, timeout=timeout, **self._sdk_params(openai.images.edit, params))
+        return response.data[0].b64_json
+
+    @staticmethod
+    def _sdk_params(method: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Pass parameters the installed SDK does not know yet (such as background or
+        output_format for gpt-image-1) in the request body instead of as arguments.
+        """
+        accepted = inspect.signature(method).parameters
+        known = {name: value for name, value in params.items() if name in accepted}
+        extra = {name: value for name, value in params.items() if name not in accepted}
+        if extra:
+            known["extra_body"] = extra
+        return known
+
+
+class LocalImageProvider(ImageProvider):
+    """
+    Synthesizes images locally, for benchmarks, load tests and CI without network or cost.
+
+    The image depends only on the request: the same parameters (and reference
+    image) always give the same pixels, and different prompts give different
+    ones. Generated sprites are a simple figure on a transparent background;
+    edits tint and shift the reference image and keep its alpha channel.
+    Artificial latency and failures are drawn from a generator seeded with
+    `seed`, so a sequence of requests behaves the same way on every run.
+    """
+
+    name = "local"
+
+    def __init__(self, latency: float = LOCAL_IMAGE_LATENCY, latency_jitter: float = LOCAL_IMAGE_LATENCY_JITTER,
+                 error_rate: float = LOCAL_IMAGE_ERROR_RATE, seed: int = LOCAL_IMAGE_SEED):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def generate(self, timeout: Optional[float] = None, **params: Any) -> str:
+        self._simulate("generate")
+        rng = np.random.default_rng(self._seed("generate", params))
+        width, height = self._size(params.get("size"))
+        transparent = params.get("background", "transparent") != "opaque"
+        image = self._draw_figure(rng, width, height, transparent)
+        return self._encode(image)
+
+    def edit(self, image: Tuple[str, bytes, str], timeout: Optional[float] = None, **params: Any) -> str:
+        self._simulate("edit")
+        rng = np.random.default_rng(self._seed("edit", params, image[1]))
+        width, height = self._size(params.get("size"))
+
+        reference = Image.open(io.BytesIO(image[1])).convert("RGBA")
+        if reference.size != (width, height):
+            reference = reference.resize((width, height), Image.LANCZOS)
+        pixels = np.array(reference, dtype=np.float32)
+
+        # Tint the colors towards a request-specific color and shift the figure a little,
+        # like a pose change, keeping the alpha channel with the pixels it belongs to
+        tint = rng.integers(0, 256, size=3).astype(np.float32)
+        strength = rng.uniform(0.15, 0.35)
+        pixels[:, :, :3] = pixels[:, :, :3] * (1 - strength) + tint * strength
+        max_shift = max(1, width // 32)
+        shift = (int(rng.integers(-max_shift, max_shift + 1)), int(rng.integers(-max_shift, max_shift + 1)))
+        pixels = np.roll(pixels, shift, axis=(0, 1))
+
+        return self._encode(Image.fromarray(pixels.clip(0, 255).astype(np.uint8), "RGBA"))
+
+    def _simulate(self, operation: str) -> None:
+        """Sleep for the artificial latency and fail at the configured rate"""
+        with self._lock:
+            delay = self.latency + self._random.uniform(0, self.latency_jitter)
+            fail = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fail:
+            raise ImageProviderError(f"Simulated failure of the local image {operation}", transient=True)
+
+    @staticmethod
+    def _seed(operation: str, params: Dict[str, Any], image: Optional[bytes] = None) -> int:
+        digest = hashlib.sha256(operation.encode("utf-8"))
+        for name in sorted(params):
+            digest.update(f"{name}={params[name]}\n".encode("utf-8"))
+        if image is not None:
+            digest.update(image)
+        return int.from_bytes(digest.digest()[:8], "big")
+
+    @staticmethod
+    def _size(size: Optional[str]) -> Tuple[int, int]:
+        if not size or size == "auto":
+            return DEFAULT_IMAGE_EDGE, DEFAULT_IMAGE_EDGE
+        try:
+            width, height = (int(edge) for edge in size.lower().split("x"))
+        except ValueError:
+            raise ImageProviderError(f"Invalid image size: {size}")
+        return width, height
+
+    @staticmethod
+    def _draw_figure(rng: np.random.Generator, width: int, height: int, transparent: bool) -> Image.Image:
+        """Draw a centered figure with request-specific colors and proportions"""
+        background = (0, 0, 0, 0) if transparent else (255, 255, 255, 255)
+        image = Image.new("RGBA", (width, height), background)
+        draw = ImageDraw.Draw(image)
+
+        def color() -> Tuple[int, int, int, int]:
+            return tuple(int(channel) for channel in rng.integers(40, 230, size=3)) + (255,)
+
+        unit = min(width, height) / 10
+        center_x = width / 2 + rng.uniform(-0.3, 0.3) * unit
+        top = height * 0.15
+
+        # Head, body, arms and legs; the limbs swing with the request so frames differ
+        head = unit * rng.uniform(0.8, 1.1)
+        draw.ellipse([center_x - head, top, center_x + head, top + 2 * head], fill=color())
+        body_top = top + 2 * head
+        body_bottom = body_top + unit * rng.uniform(2.6, 3.2)
+        body_half = unit * rng.uniform(0.8, 1.2)
+        draw.rectangle([center_x - body_half, body_top, center_x + body_half, body_bottom], fill=color())
+
+        limb_color = color()
+        limb_width = max(1, int(unit * 0.45))
+        for side in (-1, 1):
+            swing = rng.uniform(-1.2, 1.2) * unit
+            shoulder = (center_x + side * body_half, body_top + unit * 0.3)
+            draw.line([shoulder, (shoulder[0] + side * unit * 0.9, shoulder[1] + unit * 1.8 + swing * 0.3)],
+                      fill=limb_color, width=limb_width)
+            hip = (center_x + side * body_half * 0.5, body_bottom)
+            draw.line([hip, (hip[0] + swing, min(height * 0.9, body_bottom + unit * 2.6))],
+                      fill=limb_color, width=limb_width)
+        return image
+
+    @staticmethod
+    def _encode(image: Image.Image) -> str:
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+        return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+
+# Providers selectable with the IMAGE_PROVIDER setting
+IMAGE_PROVIDERS: Dict[str, Type[ImageProvider]] = {
+    OpenAIImageProvider.name: OpenAIImageProvider,
+    LocalImageProvider.name: LocalImageProvider,
+}
+
+_provider: Optional[ImageProvider] = None
+_provider_lock = threading.Lock()
+
+
+def register_image_provider(provider_class: Type[ImageProvider]) -> None:
+    """Make another image backend selectable by its name"""
+    IMAGE_PROVIDERS[provider_class.name] = provider_class
+
+
+def get_image_provider() -> ImageProvider:
+    """Get the image provider of this process, created from the IMAGE_PROVIDER setting on first use"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            if IMAGE_PROVIDER not in IMAGE_PROVIDERS:
+                raise ValueError(f"Unknown image provider: {IMAGE_PROVIDER}, expected one of {tuple(IMAGE_PROVIDERS)}")
+            _provider = IMAGE_PROVIDERS[IMAGE_PROVIDER]()
+            logger.info(f"Using the {_provider.name} image provider")
+        return _provider
+
+
+def set_image_provider(provider: ImageProvider) -> None:
+    """Replace the image provider of this process, e.g. from a benchmark or load-test script"""
+    global _provider
+    with _provider_lock:
+        _provider = provider
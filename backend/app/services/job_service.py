@@ -0,0 +1,124 @@
+import uuid
+import asyncio
+import logging
+import threading
+import contextlib
+from datetime import datetime
+from typing import Dict, Any, List, Optional, AsyncIterator
+from fastapi import Request
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds between checks for a disconnected client while a job runs
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Request header a client can set to choose the ID of the job started by its request,
+# so it can cancel the job before the response arrives
+JOB_ID_HEADER = "X-Job-Id"
+
+
+class JobCancelled(Exception):
+    """Raised inside a generation job once it has been cancelled"""
+
+
+class Job:
+    """
+    A cancellable unit of generation work, such as a preset animation or a set of sprite edits.
+
+    The services check the job between upstream requests, so cancelling never
+    interrupts a request that is already in flight; its result is still stored
+    and the remaining requests are skipped.
+    """
+
+    def __init__(self, job_id: str, kind: str):
+        self.id = job_id
+        self.kind = kind
+        self.created_at = datetime.utcnow()
+        self.reason: Optional[str] = None
+        # A threading event, as the upstream calls run in worker threads
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self, reason: str = "cancelled by client") -> None:
+        if not self.cancelled:
+            self.reason = reason
+            self._cancelled.set()
+            logger.info(f"Job {self.id} ({self.kind}) {reason}")
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise JobCancelled(f"Job {self.id} was {self.reason}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "cancelled": self.cancelled,
+            "created_at": self.created_at.isoformat()
+        }
+
+
+class JobService:
+    """
+    Registry of the generation jobs running in this process.
+
+    Jobs are kept in memory, so a cancel call must reach the same worker
+    process as the request that started the job.
+    """
+
+    _jobs: Dict[str, Job] = {}
+
+    def start(self, kind: str, job_id: Optional[str] = None) -> Job:
+        job_id = job_id or str(uuid.uuid4())
+        if job_id in self._jobs:
+            raise ValueError(f"Job with ID {job_id} is already running")
+
+        job = Job(job_id, kind)
+        self._jobs[job_id] = job
+        return job
+
+    def finish(self, job: Job) -> None:
+        self._jobs.pop(job.id, None)
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self) -> List[Job]:
+        return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> bool:
+        """Cancel a running job, returning False if there is no such job"""
+        job = self._jobs.get(job_id)
+        if not job:
+            return False
+        job.cancel()
+        return True
+
+    @contextlib.asynccontextmanager
+    async def track(self, request: Request, kind: str, watch_disconnect: bool = True) -> AsyncIterator[Job]:
+        """
+        Run a job for the duration of a request and cancel it if the client disconnects.
+
+        The job ID is taken from the X-Job-Id request header when present.
+        Streaming responses should pass watch_disconnect=False: they already
+        listen for the disconnect themselves and stop the stream when it comes.
+        """
+        job = self.start(kind, request.headers.get(JOB_ID_HEADER))
+        watcher = asyncio.create_task(self._watch_disconnect(request, job)) if watch_disconnect else None
+        try:
+            yield job
+        finally:
+            if watcher:
+                watcher.cancel()
+            self.finish(job)
+
+    async def _watch_disconnect(self, request: Request, job: Job) -> None:
+        while not job.cancelled:
+            if await request.is_disconnected():
+                job.cancel("cancelled because the client disconnected")
+                return
+            await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
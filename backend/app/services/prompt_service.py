@@ -1,6 +1,10 @@
 import openai
 import os
 import logging
+from .upstream_service import chat_scheduler
+from ..utils.tracing import traced
+from ..utils.logs import log_event
+from ..utils.stages import PROMPT, stage_timer
 
 logger = logging.getLogger(__name__)
 
@@ -8,11 +12,10 @@ class PromptService:
     def __init__(self):
         openai.api_key = os.getenv("OPENAI_API_KEY")
 
+    @traced()
     async def format_sprite_prompt(self, user_prompt: str) -> str:
         try:
-            logger.info("="*50)
-            logger.info("PROMPT FORMATTING STARTED")
-            logger.info(f"Original user prompt: {user_prompt}")
+            log_event(logger, logging.DEBUG, "prompt.enhance.started", prompt=user_prompt)
             
             system_prompt = """You are a professional 2D pixel art character designer for video games. 
             Your task is to enhance the user's description into a detailed prompt for generating a 2D pixel art character sprite.
@@ -28,34 +31,29 @@ class PromptService:
             
             Format the response as a single, detailed prompt sentence."""
 
-            logger.info("Sending prompt to GPT for enhancement...")
-            response = openai.ChatCompletion.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Create a detailed prompt for this character: {user_prompt}"}
-                ],
-                temperature=0.7,
-                max_tokens=150
-            )
+            with stage_timer(PROMPT, "gpt-4"):
+                response = await chat_scheduler.call(
+                    openai.chat.completions.create,
+                    model="gpt-4",
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": f"Create a detailed prompt for this character: {user_prompt}"}
+                    ],
+                    temperature=0.7,
+                    max_tokens=150,
+                    timeout=chat_scheduler.call_timeout
+                )
 
             formatted_prompt = response.choices[0].message.content.strip()
             
             # Add additional requirements to ensure the sprite is suitable for animation
             final_prompt = f"Create a single character: {formatted_prompt} The image must have a completely transparent background (alpha channel) with no ground, shadow, grid lines, rulers, or any other background elements. The character should be perfectly centered in the frame with equal padding on all sides (at least 10% of the image size). Clean, clear pixel art style suitable for animation frames. Ensure the entire character is visible with no clipping. No grid lines or rulers should be visible."
             
-            logger.info("="*50)
-            logger.info("PROMPT FORMATTING COMPLETE")
-            logger.info(f"Formatted prompt: {final_prompt}")
-            logger.info("="*50)
+            log_event(logger, logging.DEBUG, "prompt.enhance.completed", prompt=final_prompt)
             return final_prompt
 
         except Exception as e:
-            logger.error("="*50)
-            logger.error("PROMPT FORMATTING FAILED")
-            logger.error(f"Error formatting prompt: {str(e)}", exc_info=True)
-            logger.error("Using fallback prompt")
-            logger.error("="*50)
+            log_event(logger, logging.WARNING, "prompt.enhance.fallback", error=str(e))
             # Fallback to a basic formatted prompt if the API call fails
             return f"Create a single character: a clean 2D pixel art character sprite for animation based on: {user_prompt}. The sprite should be in a clear pixel art style with a completely transparent background (alpha channel). The character should be centered in the frame with equal padding on all sides (at least 10% of the image size), in a neutral pose suitable as a base for animations, and isolated from any background elements. No ground, shadow, grid lines, rulers, or extra space around the character. Ensure the entire character is visible with no clipping."
 
@@ -71,16 +69,10 @@ class PromptService:
         Returns:
             str: The formatted edit prompt
         """
-        logger.info("="*50)
-        logger.info("EDIT PROMPT FORMATTING")
-        logger.info(f"Original edit instructions: {edit_instructions}")
         
         # For edit prompts, we just return the instructions exactly as given
         # without adding any sprite creation boilerplate
         
-        logger.info("="*50)
-        logger.info("EDIT PROMPT FORMATTING COMPLETE")
-        logger.info(f"Formatted edit prompt: {edit_instructions}")
-        logger.info("="*50)
+        log_event(logger, logging.DEBUG, "prompt.edit.formatted", prompt=edit_instructions)
         
         return edit_instructions 
\ No newline at end of file
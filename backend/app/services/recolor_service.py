@@ -0,0 +1,124 @@
+import re
+import logging
+from typing import List, Dict, Any, Tuple
+import numpy as np
+from PIL import Image
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Pixels with less alpha than this are treated as background when extracting a palette
+PALETTE_ALPHA_THRESHOLD = 128
+
+Color = Tuple[int, int, int]
+
+
+def parse_color(value: str) -> Color:
+    """Parse a "#rrggbb" (or "rrggbb") hex color into an RGB tuple"""
+    match = re.fullmatch(r"#?([0-9a-fA-F]{6})", value.strip())
+    if not match:
+        raise ValueError(f"Invalid color: {value}, expected #rrggbb")
+    hex_value = match.group(1)
+    return tuple(int(hex_value[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def format_color(color: Color) -> str:
+    return "#{:02x}{:02x}{:02x}".format(*color)
+
+
+class RecolorService:
+    """
+    Local palette extraction and palette-swap recoloring of sprite images.
+
+    Recoloring never calls the image API. It works on the distinct colors of an
+    image rather than on every pixel: each distinct color is mapped once, and
+    the resulting lookup table is applied to the whole image in one vectorized
+    gather. Alpha is always preserved exactly.
+    """
+
+    def extract_palette(self, image: Image.Image, max_colors: int = 16) -> List[Dict[str, Any]]:
+        """
+        Get the dominant colors of the visible pixels of an image.
+
+        Args:
+            image: The sprite image
+            max_colors: Maximum number of palette entries to return
+
+        Returns:
+            List of {"color": "#rrggbb", "ratio": share of visible pixels}, most common first
+        """
+        rgba = np.asarray(image.convert("RGBA"))
+        visible = rgba[rgba[..., 3] >= PALETTE_ALPHA_THRESHOLD][:, :3]
+        if len(visible) == 0:
+            return []
+
+        strip = Image.fromarray(np.ascontiguousarray(visible.reshape(1, -1, 3)), "RGB")
+        quantized = strip.quantize(colors=max_colors, method=Image.Quantize.MEDIANCUT)
+        palette = quantized.getpalette()
+        counts = quantized.getcolors(max_colors) or []
+
+        total = len(visible)
+        return [
+            {
+                "color": format_color(tuple(palette[index * 3:index * 3 + 3])),
+                "ratio": round(count / total, 4)
+            }
+            for count, index in sorted(counts, reverse=True)
+        ]
+
+    def recolor(self, image: Image.Image, mappings: List[Tuple[Color, Color]], hue_shift: float = 0.0,
+                tolerance: float = 48.0) -> Image.Image:
+        """
+        Swap colors and/or rotate the hue of an image.
+
+        Args:
+            image: The image to recolor
+            mappings: (source, target) color pairs; every color within `tolerance`
+                of a source color is moved by the source-to-target offset, which
+                keeps the shading of the recolored area
+            hue_shift: Hue rotation in degrees applied to all colors after the mappings
+            tolerance: Maximum RGB distance from a source color for a color to be remapped
+
+        Returns:
+            The recolored RGBA image
+        """
+        rgba = np.asarray(image.convert("RGBA"))
+        rgb = rgba[..., :3].reshape(-1, 3).astype(np.uint32)
+
+        # Build a lookup table over the distinct colors of the image
+        keys = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        colors = np.stack([(unique_keys >> 16) & 255, (unique_keys >> 8) & 255, unique_keys & 255], axis=1)
+
+        lut = self._map_colors(colors.astype(np.float32), mappings, hue_shift, tolerance)
+
+        recolored = lut[inverse].reshape(rgba.shape[:2] + (3,))
+        return Image.fromarray(np.dstack([recolored, rgba[..., 3]]), "RGBA")
+
+    def _map_colors(self, colors: np.ndarray, mappings: List[Tuple[Color, Color]], hue_shift: float,
+                    tolerance: float) -> np.ndarray:
+        """Map an (N, 3) array of colors and return the result as uint8"""
+        result = colors.copy()
+
+        if mappings:
+            sources = np.array([source for source, _ in mappings], dtype=np.float32)
+            targets = np.array([target for _, target in mappings], dtype=np.float32)
+
+            # Each color follows the closest source color, if it is close enough
+            distances = np.linalg.norm(colors[:, None, :] - sources[None, :, :], axis=2)
+            nearest = distances.argmin(axis=1)
+            within = distances[np.arange(len(colors)), nearest] <= tolerance
+            result[within] += (targets - sources)[nearest[within]]
+
+        result = np.clip(result + 0.5, 0, 255).astype(np.uint8)
+
+        if hue_shift:
+            # PIL's HSV mode stores hue in 0-255, so the rotation is a single 256-entry table
+            offset = round(hue_shift / 360.0 * 256)
+            hue_table = [(h + offset) % 256 for h in range(256)]
+            identity = list(range(256))
+            hsv = Image.fromarray(result.reshape(1, -1, 3), "RGB").convert("HSV")
+            hsv = hsv.point(hue_table + identity + identity)
+            result = np.asarray(hsv.convert("RGB")).reshape(-1, 3)
+
+        return result
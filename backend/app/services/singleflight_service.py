@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import Awaitable, Callable, Dict, Optional
+
+from ..constants import COALESCE_DIR, COALESCE_LEASE_TTL, COALESCE_RESULT_TTL
+from ..utils.metrics import REGISTRY
+from ..utils.stages import count_cache_hit
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds between checks on a flight led by another worker process
+REMOTE_POLL_INTERVAL = 0.5
+
+COALESCED = REGISTRY.counter(
+    "upstream_coalesced_total",
+    "Requests served by an identical in-flight request instead of a new upstream call",
+    ["flight", "scope"]
+)
+
+
+class FlightAbandoned(Exception):
+    """The leader of a flight went away without a result; a follower takes over"""
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls so only one of them does the work.
+
+    Within a process, the first caller for a key leads the flight and every
+    concurrent caller with the same key awaits its result. Across worker
+    processes on the same host, the leader holds a lease file for the key and
+    publishes the result next to it; leaders in other processes wait for that
+    result instead of calling upstream themselves.
+
+    Only calls that overlap in time are coalesced: once a flight lands, the
+    next call for the key starts a new one. Results are strings, so they can be
+    handed between processes as JSON.
+    """
+
+    def __init__(self, name: str, lease_dir: str = COALESCE_DIR, lease_ttl: float = COALESCE_LEASE_TTL,
+                 result_ttl: float = COALESCE_RESULT_TTL):
+        self.name = name
+        self.lease_dir = os.path.join(lease_dir, name)
+        self.lease_ttl = lease_ttl
+        self.result_ttl = result_ttl
+        self._flights: Dict[str, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    async def do(self, key: str, func: Callable[[], Awaitable[str]]) -> str:
+        """
+        Run `func` for `key`, or share the result of an identical call already in flight.
+
+        Args:
+            key: Identifies identical calls; must be safe to use in a file name
+            func: Coroutine function doing the actual work
+
+        Returns:
+            The result of the flight, from this caller or from the one that led it
+        """
+        while True:
+            with self._lock:
+                future = self._flights.get(key)
+                leader = future is None
+                if leader:
+                    # A thread-safe future, as callers may run on different event loops
+                    future = concurrent.futures.Future()
+                    self._flights[key] = future
+
+            if not leader:
+                COALESCED.inc(flight=self.name, scope="process")
+                count_cache_hit("coalesced")
+                try:
+                    # Shielded so a cancelled follower does not cancel the flight for everyone else
+                    return await asyncio.shield(asyncio.wrap_future(future))
+                except FlightAbandoned:
+                    continue
+
+            try:
+                result = await self._lead(key, func)
+            except BaseException as e:
+                with self._lock:
+                    del self._flights[key]
+                if isinstance(e, Exception):
+                    future.set_exception(e)
+                else:
+                    # The leader was cancelled; its followers must not be
+                    future.set_exception(FlightAbandoned(f"Flight {key} was abandoned"))
+                raise
+
+            with self._lock:
+                del self._flights[key]
+            future.set_result(result)
+            return result
+
+    async def _lead(self, key: str, func: Callable[[], Awaitable[str]]) -> str:
+        """Take the cross-process lease for the key, or wait for the worker that holds it"""
+        os.makedirs(self.lease_dir, exist_ok=True)
+        lease_path = os.path.join(self.lease_dir, f"{key}.lease")
+
+        while True:
+            flight_id = self._try_lease(lease_path)
+            if flight_id:
+                break
+
+            found, result = await self._await_remote(key, lease_path)
+            if found:
+                COALESCED.inc(flight=self.name, scope="worker")
+                count_cache_hit("coalesced")
+                return result
+
+        try:
+            result = await func()
+        except Exception as e:
+            self._publish(key, flight_id, {"error": str(e)})
+            raise
+        else:
+            self._publish(key, flight_id, {"result": result})
+            return result
+        finally:
+            self._release_lease(lease_path, flight_id)
+            self._sweep()
+
+    def _try_lease(self, lease_path: str) -> Optional[str]:
+        """Create the lease file atomically, returning the new flight ID or None if it is held"""
+        flight_id = uuid.uuid4().hex
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return None
+        with os.fdopen(fd, "w") as lease_file:
+            lease_file.write(flight_id)
+        return flight_id
+
+    def _release_lease(self, lease_path: str, flight_id: str) -> None:
+        try:
+            with open(lease_path) as lease_file:
+                if lease_file.read().strip() != flight_id:
+                    return
+            os.remove(lease_path)
+        except OSError:
+            pass
+
+    async def _await_remote(self, key: str, lease_path: str):
+        """
+        Wait for the flight of another worker process to land.
+
+        Returns (True, result) when it published a result, or (False, None) when
+        the lease went away without one and the caller should try to lead.
+        """
+        try:
+            with open(lease_path) as lease_file:
+                flight_id = lease_file.read().strip()
+        except OSError:
+            return False, None
+
+        result_path = self._result_path(key, flight_id)
+        while True:
+            if os.path.exists(result_path):
+                with open(result_path) as result_file:
+                    published = json.load(result_file)
+                if "error" in published:
+                    raise Exception(published["error"])
+                return True, published["result"]
+
+            try:
+                lease_age = time.time() - os.path.getmtime(lease_path)
+            except OSError:
+                # Released; the result may have been published just before
+                if os.path.exists(result_path):
+                    continue
+                return False, None
+
+            if lease_age > self.lease_ttl:
+                logger.warning(f"Removing abandoned {self.name} lease for {key}")
+                self._release_lease(lease_path, flight_id)
+                return False, None
+
+            await asyncio.sleep(REMOTE_POLL_INTERVAL)
+
+    def _result_path(self, key: str, flight_id: str) -> str:
+        return os.path.join(self.lease_dir, f"{key}.{flight_id}.json")
+
+    def _publish(self, key: str, flight_id: str, published: Dict[str, str]) -> None:
+        result_path = self._result_path(key, flight_id)
+        temp_path = f"{result_path}.tmp"
+        try:
+            with open(temp_path, "w") as result_file:
+                json.dump(published, result_file)
+            os.replace(temp_path, result_path)
+        except OSError as e:
+            logger.warning(f"Could not publish {self.name} result for {key}: {str(e)}")
+
+    def _sweep(self) -> None:
+        """Remove published results nobody can be waiting for anymore"""
+        cutoff = time.time() - self.result_ttl
+        try:
+            for entry in os.scandir(self.lease_dir):
+                if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+        except OSError:
+            pass
@@ -1,13 +1,30 @@
 import os
+import io
 import uuid
 import base64
+import asyncio
 import openai
 import logging
-from typing import List, Dict, Any
-from sqlalchemy import desc
+from typing import List, Dict, Any, Optional
+import numpy as np
+from PIL import Image
+from sqlalchemy import select
+from sqlalchemy.orm import selectinload
 from ..models.sprite import Sprite
-from ..utils.database import get_db
+from ..models.animation import Animation, Frame
+from ..utils.database import AsyncSessionLocal
+from ..utils.storage import read_image_bytes, resolve_static_path, save_image
 from .prompt_service import PromptService
+from .thumbnail_service import ThumbnailService
+from .job_service import Job, JobCancelled
+from .upstream_service import request_image, UpstreamUnavailable
+from .recolor_service import RecolorService, parse_color, format_color
+from ..utils.tracing import traced
+from ..utils.logs import log_event
+from ..utils.stages import (
+    DOWNLOAD, DECODE, POST_PROCESS, ENCODE, STORAGE_WRITE, DB_COMMIT, stage_timer, count_retry
+)
+from ..constants import IMAGE_MODEL, FINAL_IMAGE_QUALITY, FINAL_IMAGE_SIZE, DRAFT_IMAGE_QUALITY, DRAFT_IMAGE_SIZE
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -20,38 +37,104 @@ if not openai.api_key:
 # Backend URL for external access
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+def restore_alpha(image: Image.Image, original_alpha: np.ndarray, original_size: tuple) -> Image.Image:
+    """
+    Give an edited RGBA image the alpha channel of the original sprite.
+    
+    The image API does not keep transparency reliably, so the original
+    silhouette is reapplied, after resizing the edit to the original size.
+    """
+    if image.size != original_size:
+        log_event(logger, logging.DEBUG, "sprite.edit.resized", from_size=image.size, to_size=original_size)
+        image = image.resize(original_size, Image.LANCZOS)
+    
+    # Get the pixel data as a numpy array and apply the original alpha channel
+    edited_array = np.array(image)
+    edited_array[:, :, 3] = original_alpha
+    return Image.fromarray(edited_array)
+
+
+def remove_black_background(image: Image.Image) -> Image.Image:
+    """Make the black background of an RGBA image transparent, growing inward from the edges"""
+    # Get the pixel data as a numpy array
+    pixel_data = np.array(image)
+    
+    # Identify black or near-black pixels and make them transparent
+    r, g, b, a = pixel_data[:,:,0], pixel_data[:,:,1], pixel_data[:,:,2], pixel_data[:,:,3]
+    
+    # Find dark pixels (threshold can be adjusted)
+    mask = (r < 10) & (g < 10) & (b < 10)
+    
+    # Only consider pixels near the edges as potential background
+    h, w = mask.shape
+    y, x = np.ogrid[:h, :w]
+    edge_dist = np.minimum(np.minimum(x, w-1-x), np.minimum(y, h-1-y))
+    
+    # Only apply to pixels that are near edges
+    edge_mask = edge_dist < 5  # Pixels within 5 pixels of the edge
+    
+    # Start by making edge black pixels transparent
+    initial_transparency = mask & edge_mask
+    pixel_data[initial_transparency, 3] = 0
+    
+    try:
+        # Use flood fill to find connected black regions
+        from scipy import ndimage
+        
+        # Find connected black regions that touch transparent pixels
+        transparent_mask = (pixel_data[:,:,3] == 0)
+        structure = ndimage.generate_binary_structure(2, 2)
+        
+        # Dilate the transparent mask slightly
+        dilated_mask = ndimage.binary_dilation(transparent_mask, structure, iterations=1)
+        
+        # Identify dark pixels connected to transparent areas
+        connected_dark = mask & dilated_mask
+        
+        # Repeat several times to expand inward
+        for _ in range(10):
+            pixel_data[connected_dark, 3] = 0
+            transparent_mask = (pixel_data[:,:,3] == 0)
+            dilated_mask = ndimage.binary_dilation(transparent_mask, structure, iterations=1)
+            connected_dark = mask & dilated_mask
+            if not np.any(connected_dark):
+                break
+                
+    except ImportError:
+        logger.warning("scipy not available, using simple edge-based transparency only")
+    
+    return Image.fromarray(pixel_data)
+
+
 class SpriteService:
     def __init__(self):
         self.prompt_service = PromptService()
+        self.thumbnail_service = ThumbnailService()
+        self.recolor_service = RecolorService()
 
-    async def generate_sprite(self, description: str) -> Sprite:
+    @traced()
+    async def generate_sprite(self, description: str, draft: bool = False) -> Sprite:
         try:
-            logger.info("\n" + "="*80)
-            logger.info("SPRITE GENERATION STARTED")
-            logger.info(f"User description: {description}")
-            logger.info("="*80 + "\n")
+            log_event(logger, logging.INFO, "sprite.generate.started", draft=draft)
+            log_event(logger, logging.DEBUG, "sprite.generate.description", description=description)
             
             # Format the user's prompt
             formatted_prompt = await self.prompt_service.format_sprite_prompt(description)
             
-            logger.info("\n" + "="*80)
-            logger.info("GENERATING IMAGE WITH GPT-IMAGE-1")
-            logger.info(f"Using prompt: {formatted_prompt}")
-            logger.info("="*80 + "\n")
+            log_event(logger, logging.DEBUG, "sprite.generate.prompt", prompt=formatted_prompt)
             
             # Generate the base sprite image using gpt-image-1 with correct parameters
-            response = openai.images.generate(
-                model="gpt-image-1",
+            # (gpt-image-1 always returns base64)
+            image_base64 = await request_image(
+                "generate",
+                model=IMAGE_MODEL,
                 prompt=formatted_prompt,
-                size="1024x1024",
+                size=DRAFT_IMAGE_SIZE if draft else FINAL_IMAGE_SIZE,
                 background="transparent",  # Set transparent background
-                quality="high",  # Use high quality for gpt-image-1
+                quality=DRAFT_IMAGE_QUALITY if draft else FINAL_IMAGE_QUALITY,
                 output_format="png"  # PNG supports transparency
             )
             
-            # Get base64 image data (gpt-image-1 always returns base64)
-            image_base64 = response.data[0].b64_json
-            
             # Save the image to a file in the static directory
             image_filename = f"{uuid.uuid4()}.png"
             static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
@@ -60,62 +143,61 @@ class SpriteService:
             os.makedirs(static_dir, exist_ok=True)
             
             image_path = os.path.join(static_dir, image_filename)
-            with open(image_path, "wb") as f:
-                f.write(base64.b64decode(image_base64))
+            with stage_timer(DECODE, IMAGE_MODEL):
+                image_bytes = base64.b64decode(image_base64)
+            with stage_timer(STORAGE_WRITE, IMAGE_MODEL):
+                with open(image_path, "wb") as f:
+                    f.write(image_bytes)
             
             # Create full URL for the image with domain
             image_url = f"{BACKEND_URL}/static/{image_filename}"
             
-            logger.info("Base image generated successfully")
-            logger.info(f"Image saved to: {image_path}")
-            logger.info(f"Image URL: {image_url}")
+            log_event(logger, logging.DEBUG, "sprite.generate.stored", url=image_url)
             
             # Create sprite record with base image
             sprite = Sprite(
                 id=str(uuid.uuid4()),
                 url=image_url,
                 description=description,
-                is_base_image=True  # Mark this as a base image
+                is_base_image=True,  # Mark this as a base image
+                is_draft=draft
             )
             
             # Save to database
-            logger.info("Saving sprite to database...")
-            db = next(get_db())
-            db.add(sprite)
-            db.commit()
-            db.refresh(sprite)
+            async with AsyncSessionLocal() as db:
+                db.add(sprite)
+                with stage_timer(DB_COMMIT, IMAGE_MODEL):
+                    await db.commit()
+                await db.refresh(sprite)
             
             # Format datetime fields as strings
             if sprite.created_at:
                 sprite.created_at = sprite.created_at.isoformat()
             if sprite.updated_at:
                 sprite.updated_at = sprite.updated_at.isoformat()
+            
+            # Attach URLs of the downscaled derivatives for gallery views
+            sprite.thumbnails = self.thumbnail_service.thumbnail_urls(sprite.url)
                 
-            logger.info(f"Sprite saved with ID: {sprite.id}")
-            logger.info("\n" + "="*80)
-            logger.info("SPRITE GENERATION COMPLETE")
-            logger.info("="*80 + "\n")
+            log_event(logger, logging.INFO, "sprite.generate.completed", sprite_id=sprite.id)
             
             return sprite
+        except UpstreamUnavailable:
+            raise
         except Exception as e:
-            logger.error("\n" + "="*80)
-            logger.error("SPRITE GENERATION FAILED")
-            logger.error(f"Error in generate_sprite: {str(e)}", exc_info=True)
-            logger.error("="*80 + "\n")
+            log_event(logger, logging.ERROR, "sprite.generate.failed", error=str(e), exc_info=True)
             raise Exception(f"Failed to generate sprite: {str(e)}")
 
-    async def edit_sprite_image(self, sprite_id: str, prompt: str, num_variations: int = 5) -> List[Sprite]:
+    @traced()
+    async def edit_sprite_image(self, sprite_id: str, prompt: str, num_variations: int = 5, draft: bool = False,
+                                job: Optional[Job] = None) -> List[Sprite]:
         try:
-            logger.info("\n" + "="*80)
-            logger.info("SPRITE EDIT STARTED")
-            logger.info(f"Sprite ID: {sprite_id}")
-            logger.info(f"Edit prompt: {prompt}")
-            logger.info(f"Number of variations: {num_variations}")
-            logger.info("="*80 + "\n")
+            log_event(logger, logging.INFO, "sprite.edit.started", sprite_id=sprite_id, variations=num_variations, draft=draft)
+            log_event(logger, logging.DEBUG, "sprite.edit.prompt", prompt=prompt)
             
             # Get the original sprite
-            db = next(get_db())
-            original_sprite = db.query(Sprite).filter(Sprite.id == sprite_id).first()
+            async with AsyncSessionLocal() as db:
+                original_sprite = await db.scalar(select(Sprite).where(Sprite.id == sprite_id))
             
             if not original_sprite:
                 raise Exception(f"Sprite with ID {sprite_id} not found")
@@ -124,169 +206,143 @@ class SpriteService:
             edit_instructions = f"EDIT ONLY - DO NOT RECREATE: The reference image shows {original_sprite.description}. MAKE EXACTLY THESE CHANGES: {prompt}. DO NOT ALTER any other elements (proportions, colors, style, background transparency) unless specifically mentioned in the edit request. Preserve the existing art style and character identity exactly as shown in the reference image."
             formatted_prompt = await self.prompt_service.format_edit_prompt(edit_instructions)
             
-            logger.info("\n" + "="*80)
-            logger.info("EDITING IMAGE WITH GPT-IMAGE-1")
-            logger.info(f"Using prompt: {formatted_prompt}")
-            logger.info("="*80 + "\n")
+            log_event(logger, logging.DEBUG, "sprite.edit.formatted_prompt", prompt=formatted_prompt)
             
             # List to store all variations
             variations = []
             
             try:
-                # Download the original image if it's a URL
-                logger.info("Starting image retrieval process...")
-                original_image_path = None
-                if original_sprite.url.startswith("http"):
-                    logger.info(f"Downloading image from URL: {original_sprite.url}")
-                    import requests
-                    import tempfile
-                    import os  # Import os here to ensure it's available in this scope
-                    import time
-                    
-                    # Create a temporary file for the original image
-                    original_image_fd, original_image_path = tempfile.mkstemp(suffix=".png")
-                    logger.info(f"Created temporary file: {original_image_path}")
-                    
-                    # Retry parameters
-                    max_retries = 3
-                    retry_delay = 2
-                    timeout = 30  # Increased timeout to 30 seconds
-                    
-                    # Try to download with retries
-                    for retry in range(max_retries):
-                        try:
-                            logger.info(f"Download attempt {retry + 1}/{max_retries}")
+                with stage_timer(DOWNLOAD, IMAGE_MODEL):
+                    # Download the original image if it's a URL
+                    original_image_path = None
+                    if original_sprite.url.startswith("http"):
+                        log_event(logger, logging.DEBUG, "sprite.edit.download", url=original_sprite.url)
+                        import requests
+                        import tempfile
+                        import os  # Import os here to ensure it's available in this scope
+                    
+                        # Create a temporary file for the original image
+                        original_image_fd, original_image_path = tempfile.mkstemp(suffix=".png")
+                    
+                        # Retry parameters
+                        max_retries = 3
+                        retry_delay = 2
+                        timeout = 30  # Increased timeout to 30 seconds
+                    
+                        # Try to download with retries
+                        for retry in range(max_retries):
+                            try:
+                                log_event(logger, logging.DEBUG, "sprite.edit.download_attempt", attempt=retry + 1, max_attempts=max_retries)
                             
-                            # If we're using localhost URLs, try to convert to a direct file path
-                            if BACKEND_URL and original_sprite.url.startswith(BACKEND_URL) and "localhost" in BACKEND_URL:
-                                logger.info("Detected localhost URL, attempting to use direct file access")
-                                local_path = original_sprite.url.replace(f"{BACKEND_URL}/static/", "")
-                                static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
-                                direct_path = os.path.join(static_dir, local_path)
-                                
-                                if os.path.exists(direct_path):
-                                    logger.info(f"Found local file at {direct_path}, copying directly")
+                                # Images served from our own static directory are copied directly, whatever
+                                # host BACKEND_URL names, instead of downloading them from this server
+                                direct_path = resolve_static_path(original_sprite.url)
+                                if direct_path:
                                     with open(direct_path, 'rb') as src, os.fdopen(original_image_fd, 'wb') as dst:
                                         dst.write(src.read())
-                                    logger.info(f"Successfully copied local file to: {original_image_path}")
+                                    log_event(logger, logging.DEBUG, "sprite.edit.copied_local_file", path=direct_path)
                                     break  # Exit retry loop on success
-                                else:
-                                    logger.warning(f"Local file not found at {direct_path}, falling back to HTTP")
                             
-                            # Download via HTTP if direct access didn't work or wasn't possible
-                            logger.info(f"Downloading via HTTP with {timeout}s timeout")
-                            response = requests.get(original_sprite.url, stream=True, timeout=timeout)
-                            logger.info(f"Download status code: {response.status_code}")
+                                # Download via HTTP if the image is not stored locally, off the event loop
+                                response = await asyncio.to_thread(requests.get, original_sprite.url, timeout=timeout)
+                                log_event(logger, logging.DEBUG, "sprite.edit.download_status", status_code=response.status_code)
                             
-                            if response.status_code == 200:
-                                # Use the file descriptor to write the content
-                                with os.fdopen(original_image_fd, 'wb') as f:
-                                    # Set chunk size and use a counter for logging
-                                    chunk_size = 8192
-                                    chunks_downloaded = 0
-                                    total_size = 0
+                                if response.status_code == 200:
+                                    # Use the file descriptor to write the content
+                                    with os.fdopen(original_image_fd, 'wb') as f:
+                                        # Set chunk size
+                                        chunk_size = 8192
                                     
-                                    for chunk in response.iter_content(chunk_size=chunk_size):
-                                        if chunk:  # filter out keep-alive chunks
-                                            f.write(chunk)
-                                            chunks_downloaded += 1
-                                            total_size += len(chunk)
-                                            # Log every 10 chunks to show progress
-                                            if chunks_downloaded % 10 == 0:
-                                                logger.info(f"Downloaded {chunks_downloaded} chunks ({total_size / 1024:.1f} KB)")
+                                        for chunk in response.iter_content(chunk_size=chunk_size):
+                                            if chunk:  # filter out keep-alive chunks
+                                                f.write(chunk)
                                 
-                                logger.info(f"Downloaded original image to: {original_image_path}")
-                                # Check if file was actually written
-                                if os.path.getsize(original_image_path) > 0:
-                                    logger.info(f"File size: {os.path.getsize(original_image_path)} bytes")
-                                    break  # Exit retry loop on success
+                                    # Check if file was actually written
+                                    if os.path.getsize(original_image_path) > 0:
+                                        log_event(logger, logging.DEBUG, "sprite.edit.downloaded", path=original_image_path)
+                                        break  # Exit retry loop on success
+                                    else:
+                                        log_event(logger, logging.WARNING, "sprite.edit.download_empty", attempt=retry + 1)
+                                        if retry < max_retries - 1:  # Don't recreate file on last attempt
+                                            os.remove(original_image_path)
+                                            original_image_fd, original_image_path = tempfile.mkstemp(suffix=".png")
                                 else:
-                                    logger.error("Downloaded file is empty, will retry")
-                                    if retry < max_retries - 1:  # Don't recreate file on last attempt
-                                        os.remove(original_image_path)
-                                        original_image_fd, original_image_path = tempfile.mkstemp(suffix=".png")
-                                        logger.info(f"Created new temporary file: {original_image_path}")
-                            else:
-                                # Close file descriptor and remove file on error
-                                os.remove(original_image_path)
-                                raise Exception(f"Failed to download original image: HTTP {response.status_code}")
+                                    # Close file descriptor and remove file on error
+                                    os.remove(original_image_path)
+                                    raise Exception(f"Failed to download original image: HTTP {response.status_code}")
                                 
-                        except requests.exceptions.Timeout:
-                            logger.error(f"Request timed out (attempt {retry + 1}/{max_retries})")
-                            if retry < max_retries - 1:
-                                logger.info(f"Waiting {retry_delay}s before retry...")
-                                time.sleep(retry_delay)
-                                retry_delay *= 2  # Exponential backoff
+                            except requests.exceptions.Timeout:
+                                log_event(logger, logging.WARNING, "sprite.edit.download_timeout", attempt=retry + 1, max_attempts=max_retries)
+                                if retry < max_retries - 1:
+                                    count_retry(DOWNLOAD, IMAGE_MODEL)
+                                    await asyncio.sleep(retry_delay)
+                                    retry_delay *= 2  # Exponential backoff
                                 
-                                # Recreate the file for the next attempt
-                                try:
-                                    os.close(original_image_fd)  # Try to close, but it may already be closed
-                                except:
-                                    pass  # Ignore errors if already closed
+                                    # Recreate the file for the next attempt
+                                    try:
+                                        os.close(original_image_fd)  # Try to close, but it may already be closed
+                                    except:
+                                        pass  # Ignore errors if already closed
                                 
-                                try:
-                                    os.remove(original_image_path)
-                                except:
-                                    pass  # Ignore errors if file doesn't exist
+                                    try:
+                                        os.remove(original_image_path)
+                                    except:
+                                        pass  # Ignore errors if file doesn't exist
                                     
-                                original_image_fd, original_image_path = tempfile.mkstemp(suffix=".png")
-                                logger.info(f"Created new temporary file: {original_image_path}")
-                            else:
+                                    original_image_fd, original_image_path = tempfile.mkstemp(suffix=".png")
+                                else:
+                                    try:
+                                        os.close(original_image_fd)  # Try to close, but it may already be closed
+                                    except:
+                                        pass  # Ignore errors if already closed
+                                
+                                    try:
+                                        os.remove(original_image_path)
+                                    except:
+                                        pass  # Ignore errors if file doesn't exist
+                                    
+                                    raise Exception(f"Image download timed out after {max_retries} attempts")
+                                
+                            except (requests.exceptions.RequestException, Exception) as e:
+                                # File descriptor management
                                 try:
                                     os.close(original_image_fd)  # Try to close, but it may already be closed
                                 except:
                                     pass  # Ignore errors if already closed
-                                
+                            
                                 try:
                                     os.remove(original_image_path)
                                 except:
                                     pass  # Ignore errors if file doesn't exist
-                                    
-                                raise Exception(f"Image download timed out after {max_retries} attempts")
-                                
-                        except (requests.exceptions.RequestException, Exception) as e:
-                            # File descriptor management
-                            try:
-                                os.close(original_image_fd)  # Try to close, but it may already be closed
-                            except:
-                                pass  # Ignore errors if already closed
-                            
-                            try:
-                                os.remove(original_image_path)
-                            except:
-                                pass  # Ignore errors if file doesn't exist
                                 
-                            # Log and re-raise
-                            if isinstance(e, requests.exceptions.RequestException):
-                                logger.error(f"Request error: {str(e)}")
-                                raise Exception(f"Failed to download image: {str(e)}")
-                            else:
-                                logger.error(f"Unexpected error during download: {str(e)}")
-                                raise Exception(f"Failed to download image: {str(e)}")
-                else:
-                    # If it's a local path (starts with /static/), get the absolute path
-                    logger.info(f"Processing local image path: {original_sprite.url}")
+                                # Log and re-raise
+                                if isinstance(e, requests.exceptions.RequestException):
+                                    log_event(logger, logging.ERROR, "sprite.edit.download_failed", error=str(e))
+                                    raise Exception(f"Failed to download image: {str(e)}")
+                                else:
+                                    log_event(logger, logging.ERROR, "sprite.edit.download_failed", error=str(e))
+                                    raise Exception(f"Failed to download image: {str(e)}")
+                    else:
+                        # If it's a local path (starts with /static/), get the absolute path
+                        log_event(logger, logging.DEBUG, "sprite.edit.local_image", url=original_sprite.url)
                     
-                    # Check if URL has the backend URL prefix and strip it if needed
-                    image_path = original_sprite.url
-                    if BACKEND_URL and image_path.startswith(BACKEND_URL):
-                        image_path = image_path.replace(f"{BACKEND_URL}", "")
+                        # Check if URL has the backend URL prefix and strip it if needed
+                        image_path = original_sprite.url
+                        if BACKEND_URL and image_path.startswith(BACKEND_URL):
+                            image_path = image_path.replace(f"{BACKEND_URL}", "")
                     
-                    if image_path.startswith("/static/"):
-                        image_path = image_path.replace("/static/", "")
+                        if image_path.startswith("/static/"):
+                            image_path = image_path.replace("/static/", "")
                     
-                    static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
-                    original_image_path = os.path.join(static_dir, image_path)
+                        static_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static")
+                        original_image_path = os.path.join(static_dir, image_path)
                     
-                    logger.info(f"Resolving to absolute path: {original_image_path}")
                     
-                    if not os.path.exists(original_image_path):
-                        logger.error(f"File not found: {original_image_path}")
-                        logger.error(f"Static directory contents: {os.listdir(static_dir)}")
-                        raise Exception(f"Original image file not found: {original_image_path}")
+                        if not os.path.exists(original_image_path):
+                            log_event(logger, logging.ERROR, "sprite.edit.file_missing", path=original_image_path)
+                            raise Exception(f"Original image file not found: {original_image_path}")
                     
-                    logger.info(f"Using original image from: {original_image_path}")
-                    logger.info(f"File size: {os.path.getsize(original_image_path)} bytes")
+                        log_event(logger, logging.DEBUG, "sprite.edit.original_image", path=original_image_path)
                 
                 # First, capture the alpha channel from the original image
                 original_alpha = None
@@ -300,157 +356,82 @@ class SpriteService:
                         orig_img = Image.open(orig_file)
                         if orig_img.mode == 'RGBA':
                             # Store the original alpha channel
-                            logger.info("Capturing alpha channel from original image")
                             orig_img_array = np.array(orig_img)
                             original_alpha = orig_img_array[:, :, 3].copy()
                             original_size = orig_img.size
-                            logger.info(f"Original image size: {original_size}")
-                            logger.info(f"Original alpha channel shape: {original_alpha.shape}")
+                            log_event(logger, logging.DEBUG, "sprite.edit.original_alpha", size=original_size)
                 except Exception as e:
-                    logger.warning(f"Failed to capture original alpha channel: {str(e)}")
+                    log_event(logger, logging.WARNING, "sprite.edit.alpha_capture_failed", error=str(e))
                     original_alpha = None
                 
                 # Generate multiple variations
                 for i in range(num_variations):
-                    logger.info(f"Generating variation {i+1}/{num_variations}")
+                    # Stop before paying for a variation nobody is waiting for; stored ones are kept
+                    if job:
+                        job.raise_if_cancelled()
+                        
+                    log_event(logger, logging.DEBUG, "sprite.edit.variation", variation=i + 1, variations=num_variations)
                     
                     # Use OpenAI's images.edit endpoint with the original image
-                    logger.info("Opening image file...")
                     # Open the file by path (not using file descriptor which may be closed)
                     with open(original_image_path, "rb") as image_file:
                         # Read the image data
                         image_data = image_file.read()
                         
-                        logger.info("Preparing to call OpenAI images.edit API...")
-                        logger.info(f"Image data length: {len(image_data)} bytes")
-                        
-                        # Create the edit API request
-                        logger.info("Calling OpenAI API now...")
-                        
-                        # For gpt-image-1, reopen the file using the path
-                        with open(original_image_path, "rb") as reopened_file:
-                            response = openai.images.edit(
-                                model="gpt-image-1",
-                                image=reopened_file,  # Pass a freshly opened file object
-                                prompt=formatted_prompt,
-                                size="1024x1024"
-                            )
-                        
-                        # Log information about the response
-                        logger.info("OpenAI API call successful")
-                        logger.info(f"Response contains {len(response.data)} images")
-                    
-                    # Log successful completion of the API call
-                    logger.info("Successfully received response from OpenAI images.edit API")
-                    
-                    # Get base64 image data
-                    image_base64 = response.data[0].b64_json
-                    logger.info(f"Received base64 image data with length: {len(image_base64)}")
+                        # Pass the image as bytes so the scheduler can resend it on a retry; the
+                        # request runs in a worker thread so the event loop can notice cancellation meanwhile.
+                        # The variation number keeps the variations of one edit from being coalesced.
+                        image_base64 = await request_image(
+                            "edit",
+                            image=(os.path.basename(original_image_path), image_data, "image/png"),
+                            variant=i,
+                            model=IMAGE_MODEL,
+                            prompt=formatted_prompt,
+                            size=DRAFT_IMAGE_SIZE if draft else FINAL_IMAGE_SIZE,
+                            quality=DRAFT_IMAGE_QUALITY if draft else FINAL_IMAGE_QUALITY
+                        )
                     
                     # Post-process the image to restore original transparency...
-                    logger.info("Post-processing image to restore original transparency...")
                     try:
                         # Import PIL for image processing
                         from PIL import Image
                         import io
                         import numpy as np
                         
-                        # Decode the base64 image
-                        image_data = base64.b64decode(image_base64)
-                        
-                        # Open the image with PIL
-                        edited_img = Image.open(io.BytesIO(image_data))
-                        
-                        # Convert to RGBA if not already
-                        if edited_img.mode != 'RGBA':
-                            edited_img = edited_img.convert('RGBA')
-                        
-                        # If we have the original alpha channel, apply it to the edited image
-                        if original_alpha is not None:
-                            logger.info("Applying original alpha channel to edited image")
-                            
-                            # Resize edited image to match original if needed
-                            if edited_img.size != original_size:
-                                logger.info(f"Resizing edited image from {edited_img.size} to {original_size}")
-                                edited_img = edited_img.resize(original_size, Image.LANCZOS)
-                            
-                            # Get the pixel data as a numpy array
-                            edited_array = np.array(edited_img)
+                        with stage_timer(DECODE, IMAGE_MODEL):
+                            # Decode the base64 image
+                            image_data = base64.b64decode(image_base64)
                             
-                            # Apply the original alpha channel
-                            edited_array[:, :, 3] = original_alpha
+                            # Open the image with PIL
+                            edited_img = Image.open(io.BytesIO(image_data))
+                            edited_img.load()
                             
-                            # Convert back to an image
-                            edited_img = Image.fromarray(edited_array)
-                            logger.info("Successfully restored original transparency")
-                        else:
-                            # Fallback to the black background removal approach
-                            logger.info("No original alpha channel available, using black background removal")
-                            
-                            # Get the pixel data as a numpy array
-                            pixel_data = np.array(edited_img)
-                            
-                            # Identify black or near-black pixels and make them transparent
-                            r, g, b, a = pixel_data[:,:,0], pixel_data[:,:,1], pixel_data[:,:,2], pixel_data[:,:,3]
-                            
-                            # Find dark pixels (threshold can be adjusted)
-                            mask = (r < 10) & (g < 10) & (b < 10)
-                            
-                            # Only consider pixels near the edges as potential background
-                            h, w = mask.shape
-                            y, x = np.ogrid[:h, :w]
-                            edge_dist = np.minimum(np.minimum(x, w-1-x), np.minimum(y, h-1-y))
-                            
-                            # Only apply to pixels that are near edges
-                            edge_mask = edge_dist < 5  # Pixels within 5 pixels of the edge
-                            
-                            # Start by making edge black pixels transparent
-                            initial_transparency = mask & edge_mask
-                            pixel_data[initial_transparency, 3] = 0
-                            
-                            try:
-                                # Use flood fill to find connected black regions
-                                from scipy import ndimage
-                                
-                                # Find connected black regions that touch transparent pixels
-                                transparent_mask = (pixel_data[:,:,3] == 0)
-                                structure = ndimage.generate_binary_structure(2, 2)
-                                
-                                # Dilate the transparent mask slightly
-                                dilated_mask = ndimage.binary_dilation(transparent_mask, structure, iterations=1)
-                                
-                                # Identify dark pixels connected to transparent areas
-                                connected_dark = mask & dilated_mask
-                                
-                                # Repeat several times to expand inward
-                                for _ in range(10):
-                                    pixel_data[connected_dark, 3] = 0
-                                    transparent_mask = (pixel_data[:,:,3] == 0)
-                                    dilated_mask = ndimage.binary_dilation(transparent_mask, structure, iterations=1)
-                                    connected_dark = mask & dilated_mask
-                                    if not np.any(connected_dark):
-                                        break
-                                        
-                                edited_img = Image.fromarray(pixel_data)
-                                logger.info("Successfully applied black background removal")
-                            except ImportError:
-                                logger.warning("scipy not available, using simple edge-based transparency only")
+                            # Convert to RGBA if not already
+                            if edited_img.mode != 'RGBA':
+                                edited_img = edited_img.convert('RGBA')
                         
-                        # Save to a buffer
-                        buffer = io.BytesIO()
-                        edited_img.save(buffer, format="PNG")
-                        buffer.seek(0)
+                        with stage_timer(POST_PROCESS, IMAGE_MODEL):
+                            # If we have the original alpha channel, apply it to the edited image
+                            if original_alpha is not None:
+                                edited_img = restore_alpha(edited_img, original_alpha, original_size)
+                            else:
+                                # Fallback to the black background removal approach
+                                edited_img = remove_black_background(edited_img)
                         
-                        # Convert back to base64
-                        processed_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+                        with stage_timer(ENCODE, IMAGE_MODEL):
+                            # Save to a buffer
+                            buffer = io.BytesIO()
+                            edited_img.save(buffer, format="PNG")
+                            buffer.seek(0)
+                            
+                            # Convert back to base64
+                            processed_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
                         
                         # Use the processed image
                         image_base64 = processed_base64
-                        logger.info("Post-processing complete")
                         
                     except Exception as e:
-                        logger.warning(f"Error in transparency post-processing: {str(e)}")
-                        logger.warning("Using original image without transparency correction")
+                        log_event(logger, logging.WARNING, "sprite.edit.post_process_failed", error=str(e))
                     
                     # Save the image to a file in the static directory
                     image_filename = f"{uuid.uuid4()}.png"
@@ -460,17 +441,15 @@ class SpriteService:
                     os.makedirs(static_dir, exist_ok=True)
                     
                     image_path = os.path.join(static_dir, image_filename)
-                    logger.info(f"Saving edited image to: {image_path}")
                     
-                    with open(image_path, "wb") as f:
-                        f.write(base64.b64decode(image_base64))
+                    with stage_timer(STORAGE_WRITE, IMAGE_MODEL):
+                        with open(image_path, "wb") as f:
+                            f.write(base64.b64decode(image_base64))
                     
                     # Create full URL for the image with domain
                     image_url = f"{BACKEND_URL}/static/{image_filename}"
                     
-                    logger.info("Edited image generated successfully")
-                    logger.info(f"Image saved to: {image_path}")
-                    logger.info(f"Image URL: {image_url}")
+                    log_event(logger, logging.DEBUG, "sprite.edit.stored", url=image_url)
                     
                     # Create sprite record with edited image, including parent relationship
                     variation_sprite = Sprite(
@@ -479,14 +458,16 @@ class SpriteService:
                         description=original_sprite.description,  # Keep original description
                         edit_description=prompt,  # Add the edit description
                         parent_id=original_sprite.id,  # Link to parent sprite
-                        is_base_image=False  # Mark as not a base image initially
+                        is_base_image=False,  # Mark as not a base image initially
+                        is_draft=draft
                     )
                     
                     # Save to database
-                    logger.info(f"Saving edited sprite variation {i+1} to database...")
-                    db.add(variation_sprite)
-                    db.commit()
-                    db.refresh(variation_sprite)
+                    async with AsyncSessionLocal() as db:
+                        db.add(variation_sprite)
+                        with stage_timer(DB_COMMIT, IMAGE_MODEL):
+                            await db.commit()
+                        await db.refresh(variation_sprite)
                     
                     # Format datetime fields as strings
                     if variation_sprite.created_at:
@@ -494,7 +475,7 @@ class SpriteService:
                     if variation_sprite.updated_at:
                         variation_sprite.updated_at = variation_sprite.updated_at.isoformat()
                         
-                    logger.info(f"Edited sprite variation {i+1} saved with ID: {variation_sprite.id}")
+                    log_event(logger, logging.INFO, "sprite.edit.variation_saved", variation=i + 1, sprite_id=variation_sprite.id)
                     
                     # Add to the list of variations
                     variations.append(variation_sprite)
@@ -505,11 +486,8 @@ class SpriteService:
                         os.remove(original_image_path)
                     except:
                         pass  # Ignore errors
-                    logger.info(f"Cleaned up temporary file: {original_image_path}")
                     
-                logger.info("\n" + "="*80)
-                logger.info(f"SPRITE EDIT COMPLETE - Generated {len(variations)} variations")
-                logger.info("="*80 + "\n")
+                log_event(logger, logging.INFO, "sprite.edit.completed", sprite_id=sprite_id, variations=len(variations))
                 
                 # Convert sprites to dictionaries to ensure proper serialization
                 serialized_variations = []
@@ -517,10 +495,12 @@ class SpriteService:
                     serialized_sprite = {
                         "id": sprite.id,
                         "url": sprite.url,
+                        "thumbnails": self.thumbnail_service.thumbnail_urls(sprite.url),
                         "description": sprite.description,
                         "parent_id": sprite.parent_id,
                         "edit_description": sprite.edit_description,
                         "is_base_image": sprite.is_base_image,
+                        "is_draft": bool(sprite.is_draft),
                         "created_at": sprite.created_at if isinstance(sprite.created_at, str) else (sprite.created_at.isoformat() if sprite.created_at else None),
                         "updated_at": sprite.updated_at if isinstance(sprite.updated_at, str) else (sprite.updated_at.isoformat() if sprite.updated_at else None)
                     }
@@ -528,23 +508,25 @@ class SpriteService:
                 
                 return serialized_variations
                 
+            except (JobCancelled, UpstreamUnavailable):
+                raise
             except Exception as e:
-                logger.error("\n" + "="*80)
-                logger.error("SPRITE EDIT FAILED")
-                logger.error(f"Error in edit_sprite_image: {str(e)}", exc_info=True)
-                logger.error("="*80 + "\n")
+                log_event(logger, logging.ERROR, "sprite.edit.failed", error=str(e), exc_info=True)
                 raise Exception(f"Failed to edit sprite: {str(e)}")
+        except JobCancelled:
+            log_event(logger, logging.INFO, "sprite.edit.cancelled", sprite_id=sprite_id)
+            raise
+        except UpstreamUnavailable as e:
+            log_event(logger, logging.ERROR, "sprite.edit.stopped", sprite_id=sprite_id, error=str(e))
+            raise
         except Exception as e:
-            logger.error("\n" + "="*80)
-            logger.error("SPRITE EDIT FAILED")
-            logger.error(f"Error in edit_sprite_image outer block: {str(e)}", exc_info=True)
-            logger.error("="*80 + "\n")
+            log_event(logger, logging.ERROR, "sprite.edit.failed", error=str(e), exc_info=True)
             raise Exception(f"Failed to edit sprite: {str(e)}")
 
     async def get_sprite(self, sprite_id: str) -> Sprite:
         try:
-            db = next(get_db())
-            sprite = db.query(Sprite).filter(Sprite.id == sprite_id).first()
+            async with AsyncSessionLocal() as db:
+                sprite = await db.scalar(select(Sprite).where(Sprite.id == sprite_id))
             
             if sprite:
                 # Convert datetime objects to ISO format strings
@@ -557,6 +539,9 @@ class SpriteService:
                 if sprite.url and sprite.url.startswith("/"):
                     sprite.url = f"{BACKEND_URL}{sprite.url}"
                     
+                # Attach URLs of the downscaled derivatives for gallery views
+                sprite.thumbnails = self.thumbnail_service.thumbnail_urls(sprite.url)
+                    
                 # Ensure NULL values for parent_id and edit_description are converted to None
                 if hasattr(sprite, 'parent_id') and sprite.parent_id is None:
                     sprite.parent_id = None
@@ -571,10 +556,12 @@ class SpriteService:
     async def get_all_sprites(self) -> List[Sprite]:
         try:
             logger.info("Fetching all sprites from database")
-            db = next(get_db())
-            
-            # First, get all sprites
-            all_sprites = db.query(Sprite).filter(Sprite.is_base_image == True).all()
+            async with AsyncSessionLocal() as db:
+                # First, get all sprites
+                all_sprites = (await db.scalars(select(Sprite).where(Sprite.is_base_image == True))).all()
+                
+                # The parent of every sprite, to find the root of each chain without a query per hop
+                parents = dict((await db.execute(select(Sprite.id, Sprite.parent_id))).all())
             logger.info(f"Found {len(all_sprites)} total sprites")
             
             # Create a dictionary to track the latest sprite in each chain
@@ -586,16 +573,13 @@ class SpriteService:
                 # First, find the root sprite (the one with no parent)
                 root_id = sprite.id
                 parent_id = sprite.parent_id
+                visited = {root_id}
                 
                 # Traverse up to find the root
-                while parent_id:
-                    # Look up the parent sprite
-                    parent = db.query(Sprite).filter(Sprite.id == parent_id).first()
-                    if not parent:
-                        break
-                    
-                    root_id = parent.id
-                    parent_id = parent.parent_id
+                while parent_id and parent_id in parents and parent_id not in visited:
+                    root_id = parent_id
+                    visited.add(parent_id)
+                    parent_id = parents[parent_id]
                 
                 # Now we have the root_id, check if we already have a sprite for this chain
                 if root_id in latest_sprites_by_chain:
@@ -627,6 +611,9 @@ class SpriteService:
                 if sprite.url and sprite.url.startswith("/"):
                     sprite.url = f"{BACKEND_URL}{sprite.url}"
                     
+                # Attach URLs of the downscaled derivatives for gallery views
+                sprite.thumbnails = self.thumbnail_service.thumbnail_urls(sprite.url)
+                    
                 # Ensure NULL values for parent_id and edit_description are converted to None
                 if hasattr(sprite, 'parent_id') and sprite.parent_id is None:
                     sprite.parent_id = None
@@ -650,35 +637,44 @@ class SpriteService:
         """
         try:
             logger.info(f"Fetching edit history for sprite: {sprite_id}")
-            db = next(get_db())
-            
-            # Get the current sprite
-            current_sprite = db.query(Sprite).filter(Sprite.id == sprite_id).first()
-            if not current_sprite:
-                raise Exception(f"Sprite with ID {sprite_id} not found")
+            async with AsyncSessionLocal() as db:
+                # Get the current sprite
+                current_sprite = await db.scalar(select(Sprite).where(Sprite.id == sprite_id))
+                if not current_sprite:
+                    raise Exception(f"Sprite with ID {sprite_id} not found")
             
-            # Ensure URL is fully qualified
-            if current_sprite.url.startswith("/"):
-                current_sprite.url = f"{BACKEND_URL}{current_sprite.url}"
+                # Ensure URL is fully qualified
+                if current_sprite.url.startswith("/"):
+                    current_sprite.url = f"{BACKEND_URL}{current_sprite.url}"
+            
+                # Get ancestors (parent chain), all in one recursive query
+                chain = select(Sprite.id, Sprite.parent_id).where(
+                    Sprite.id == current_sprite.parent_id
+                ).cte("ancestors", recursive=True)
+                chain = chain.union(
+                    select(Sprite.id, Sprite.parent_id).join(chain, Sprite.id == chain.c.parent_id)
+                )
+                ancestors_by_id = {
+                    sprite.id: sprite for sprite in await db.scalars(select(Sprite).join(chain, Sprite.id == chain.c.id))
+                }
             
-            # Get ancestors (parent chain)
-            ancestors = []
-            parent_id = current_sprite.parent_id
+                ancestors = []
+                parent_id = current_sprite.parent_id
             
-            while parent_id:
-                parent = db.query(Sprite).filter(Sprite.id == parent_id).first()
-                if not parent:
-                    break
+                while parent_id in ancestors_by_id:
+                    parent = ancestors_by_id.pop(parent_id)
                 
-                # Ensure URL is fully qualified
-                if parent.url.startswith("/"):
-                    parent.url = f"{BACKEND_URL}{parent.url}"
+                    # Ensure URL is fully qualified
+                    if parent.url.startswith("/"):
+                        parent.url = f"{BACKEND_URL}{parent.url}"
                 
-                ancestors.insert(0, parent)  # Insert at the beginning to maintain order
-                parent_id = parent.parent_id
+                    ancestors.insert(0, parent)  # Insert at the beginning to maintain order
+                    parent_id = parent.parent_id
             
-            # Get children (direct edits of this sprite)
-            children = db.query(Sprite).filter(Sprite.parent_id == sprite_id).order_by(Sprite.created_at).all()
+                # Get children (direct edits of this sprite)
+                children = (await db.scalars(
+                    select(Sprite).where(Sprite.parent_id == sprite_id).order_by(Sprite.created_at)
+                )).all()
             
             # Ensure URLs are fully qualified
             for child in children:
@@ -698,10 +694,12 @@ class SpriteService:
                 sprite_dict = {
                     "id": sprite.id,
                     "url": sprite.url,
+                    "thumbnails": self.thumbnail_service.thumbnail_urls(sprite.url),
                     "description": sprite.description,
                     "parent_id": sprite.parent_id,
                     "edit_description": sprite.edit_description,
                     "is_base_image": sprite.is_base_image,
+                    "is_draft": bool(sprite.is_draft),
                     "created_at": sprite.created_at.isoformat() if sprite.created_at else None,
                     "updated_at": sprite.updated_at.isoformat() if sprite.updated_at else None
                 }
@@ -721,4 +719,196 @@ class SpriteService:
             }
         except Exception as e:
             logger.error(f"Error in get_sprite_history: {str(e)}", exc_info=True)
-            raise Exception(f"Failed to get sprite history: {str(e)}") 
\ No newline at end of file
+            raise Exception(f"Failed to get sprite history: {str(e)}")
+
+    async def get_sprite_palette(self, sprite_id: str, max_colors: int = 16) -> List[Dict[str, Any]]:
+        """Get the dominant colors of a sprite, to pick the sources of a recolor"""
+        try:
+            async with AsyncSessionLocal() as db:
+                sprite = await db.scalar(select(Sprite).where(Sprite.id == sprite_id))
+            if not sprite:
+                raise Exception(f"Sprite with ID {sprite_id} not found")
+                
+            def extract_palette() -> List[Dict[str, Any]]:
+                image = Image.open(io.BytesIO(read_image_bytes(sprite.url)))
+                return self.recolor_service.extract_palette(image, max_colors=max_colors)
+                
+            # Reading (or downloading) the image and clustering its colors block, so run them off the event loop
+            return await asyncio.to_thread(extract_palette)
+        except Exception as e:
+            logger.error(f"Error in get_sprite_palette: {str(e)}", exc_info=True)
+            raise Exception(f"Failed to get sprite palette: {str(e)}")
+
+    async def recolor_sprite(self, sprite_id: str, mappings: List[Dict[str, str]], hue_shift: float = 0.0,
+                             tolerance: float = 48.0, apply_to_animations: bool = False) -> Dict[str, Any]:
+        """
+        Recolor a sprite locally, without calling the image API.
+        
+        The result is stored as a child sprite of the original, like an edit. With
+        apply_to_animations, every animation of the original sprite is copied onto
+        the new sprite with the same recolor applied to all of its frames.
+        
+        Args:
+            sprite_id: ID of the sprite to recolor
+            mappings: List of {"source": "#rrggbb", "target": "#rrggbb"} color swaps
+            hue_shift: Hue rotation in degrees applied to all colors
+            tolerance: Maximum RGB distance from a source color for a color to be swapped
+            apply_to_animations: Whether to also recolor the animations of the sprite
+            
+        Returns:
+            The new sprite, plus the IDs of the recolored animations
+        """
+        try:
+            logger.info(f"Recoloring sprite {sprite_id} with {len(mappings)} mappings and hue shift {hue_shift}")
+            
+            color_mappings = [(parse_color(m["source"]), parse_color(m["target"])) for m in mappings]
+            if not color_mappings and not hue_shift:
+                raise Exception("Recolor needs at least one color mapping or a hue shift")
+                
+            async with AsyncSessionLocal() as db:
+                original_sprite = await db.scalar(select(Sprite).where(Sprite.id == sprite_id))
+                if not original_sprite:
+                    raise Exception(f"Sprite with ID {sprite_id} not found")
+                animations = []
+                if apply_to_animations:
+                    animations = (await db.scalars(
+                        select(Animation).options(selectinload(Animation.frames)).where(Animation.base_sprite_id == sprite_id)
+                    )).all()
+                
+            def recolor_url(url: str) -> str:
+                image = Image.open(io.BytesIO(read_image_bytes(url)))
+                recolored = self.recolor_service.recolor(image, color_mappings, hue_shift=hue_shift, tolerance=tolerance)
+                return save_image(recolored)
+                
+            # Describe the recolor the same way an edit prompt is recorded
+            changes = [f"{format_color(source)} -> {format_color(target)}" for source, target in color_mappings]
+            if hue_shift:
+                changes.append(f"hue {hue_shift:+g} degrees")
+            edit_description = f"Recolor: {', '.join(changes)}"
+            
+            recolored_sprite = Sprite(
+                id=str(uuid.uuid4()),
+                url=await asyncio.to_thread(recolor_url, original_sprite.url),
+                description=original_sprite.description,  # Keep original description
+                edit_description=edit_description,
+                parent_id=original_sprite.id,  # Link to parent sprite
+                is_base_image=False,
+                is_draft=original_sprite.is_draft
+            )
+            async with AsyncSessionLocal() as db:
+                db.add(recolored_sprite)
+                await db.commit()
+                await db.refresh(recolored_sprite)
+            
+            animation_ids = []
+            if apply_to_animations:
+                recolored_records = []
+                for animation in animations:
+                    recolored_animation = Animation(
+                        id=str(uuid.uuid4()),
+                        name=f"{animation.name} (recolored)",
+                        base_sprite_id=recolored_sprite.id,
+                        animation_type=animation.animation_type,
+                        fps=animation.fps
+                    )
+                    recolored_records.append(recolored_animation)
+                    
+                    for frame in animation.frames:
+                        recolored_records.append(Frame(
+                            id=str(uuid.uuid4()),
+                            animation_id=recolored_animation.id,
+                            url=await asyncio.to_thread(recolor_url, frame.url),
+                            prompt=frame.prompt,
+                            order=frame.order,
+                            is_interpolated=frame.is_interpolated,
+                            is_draft=frame.is_draft
+                        ))
+                    animation_ids.append(recolored_animation.id)
+                    
+                # Commit all recolored animations and frames together
+                async with AsyncSessionLocal() as db:
+                    db.add_all(recolored_records)
+                    await db.commit()
+                logger.info(f"Recolored {len(animation_ids)} animations of sprite {sprite_id}")
+                
+            logger.info(f"Recolored sprite saved with ID: {recolored_sprite.id}")
+            
+            return {
+                "id": recolored_sprite.id,
+                "url": recolored_sprite.url,
+                "thumbnails": self.thumbnail_service.thumbnail_urls(recolored_sprite.url),
+                "description": recolored_sprite.description,
+                "parent_id": recolored_sprite.parent_id,
+                "edit_description": recolored_sprite.edit_description,
+                "is_base_image": recolored_sprite.is_base_image,
+                "is_draft": bool(recolored_sprite.is_draft),
+                "created_at": recolored_sprite.created_at.isoformat() if recolored_sprite.created_at else None,
+                "updated_at": recolored_sprite.updated_at.isoformat() if recolored_sprite.updated_at else None,
+                "animation_ids": animation_ids
+            }
+        except Exception as e:
+            logger.error(f"Error in recolor_sprite: {str(e)}", exc_info=True)
+            raise Exception(f"Failed to recolor sprite: {str(e)}")
+
+    @traced()
+    async def render_final(self, image_url: str, description: str) -> str:
+        """
+        Re-render a draft image at final quality, keeping its content.
+        
+        The draft is sent to the image edit API as the reference, so the chosen
+        candidate keeps its pose and composition instead of being regenerated.
+        
+        Args:
+            image_url: URL of the draft image
+            description: Description of what the image shows
+            
+        Returns:
+            URL of the final-quality image
+        """
+        prompt = f"RE-RENDER ONLY - DO NOT CHANGE: The reference image shows {description}. Reproduce it exactly at full quality, with the same pose, proportions, colors, framing and transparent background. Only refine details and remove artifacts."
+        
+        with stage_timer(DOWNLOAD, IMAGE_MODEL):
+            image_data = await asyncio.to_thread(read_image_bytes, image_url)
+        logger.info(f"Re-rendering draft {image_url} at {FINAL_IMAGE_QUALITY} quality")
+        image_base64 = await request_image(
+            "edit",
+            image=("draft.png", image_data, "image/png"),
+            model=IMAGE_MODEL,
+            prompt=prompt,
+            size=FINAL_IMAGE_SIZE,
+            quality=FINAL_IMAGE_QUALITY,
+            background="transparent"
+        )
+        
+        with stage_timer(DECODE, IMAGE_MODEL):
+            image = Image.open(io.BytesIO(base64.b64decode(image_base64)))
+            image.load()
+        with stage_timer(STORAGE_WRITE, IMAGE_MODEL):
+            return save_image(image)
+
+    @traced()
+    async def promote_sprite(self, sprite_id: str) -> Sprite:
+        """Re-render a draft sprite at final quality and mark it as final"""
+        try:
+            async with AsyncSessionLocal() as db:
+                sprite = await db.scalar(select(Sprite).where(Sprite.id == sprite_id))
+            if not sprite:
+                raise Exception(f"Sprite with ID {sprite_id} not found")
+            if not sprite.is_draft:
+                raise Exception(f"Sprite with ID {sprite_id} is not a draft")
+                
+            # Keep the sprite ID so lineage and animations stay attached. The session is
+            # reopened after the render, so no connection is held while the image API works.
+            sprite.url = await self.render_final(sprite.url, sprite.description)
+            sprite.is_draft = False
+            async with AsyncSessionLocal() as db:
+                db.add(sprite)
+                await db.commit()
+            
+            logger.info(f"Promoted sprite {sprite_id} to final quality")
+            return await self.get_sprite(sprite_id)
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            logger.error(f"Error in promote_sprite: {str(e)}", exc_info=True)
+            raise Exception(f"Failed to promote sprite: {str(e)}")
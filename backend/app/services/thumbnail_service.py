@@ -0,0 +1,90 @@
+import os
+import uuid
+import logging
+from typing import Dict, Optional
+from PIL import Image
+
+from ..constants import BACKEND_URL, STATIC_DIR, THUMBNAIL_SIZES
+from ..utils.storage import static_filename
+from ..utils.stages import count_cache_hit
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Derivatives live next to the originals so they are also reachable under /static
+THUMBNAIL_DIR = os.path.join(STATIC_DIR, "thumbnails")
+
+
+class ThumbnailService:
+    """
+    Creates and caches downscaled copies of the images in the static directory.
+
+    Derivatives are rendered lazily on first request and written to
+    ``static/thumbnails/<size>/<filename>``. Image file names are random UUIDs
+    that are never overwritten, so a cached derivative never goes stale.
+    """
+
+    def thumbnail_urls(self, url: str) -> Optional[Dict[str, str]]:
+        """
+        Build the derivative URLs for an image URL, keyed by edge length.
+
+        Returns None if the image is not served from the static directory.
+        """
+        filename = static_filename(url)
+        if not filename:
+            return None
+
+        return {
+            str(size): f"{BACKEND_URL}/api/images/{filename}?size={size}"
+            for size in THUMBNAIL_SIZES
+        }
+
+    def get_image_path(self, filename: str, size: Optional[int] = None) -> str:
+        """
+        Get the local path of an image, or of its derivative at the given size.
+
+        Args:
+            filename: Name of the original image in the static directory
+            size: Optional edge length; must be one of THUMBNAIL_SIZES
+
+        Returns:
+            Path to the original image or the cached derivative
+        """
+        if os.path.basename(filename) != filename:
+            raise ValueError(f"Invalid image name: {filename}")
+
+        original_path = os.path.join(STATIC_DIR, filename)
+        if not os.path.isfile(original_path):
+            raise FileNotFoundError(f"Image not found: {filename}")
+
+        if size is None:
+            return original_path
+
+        if size not in THUMBNAIL_SIZES:
+            raise ValueError(f"Unsupported size {size}, expected one of {THUMBNAIL_SIZES}")
+
+        thumbnail_path = os.path.join(THUMBNAIL_DIR, str(size), filename)
+        if os.path.exists(thumbnail_path):
+            count_cache_hit("thumbnail")
+        else:
+            self._render_thumbnail(original_path, thumbnail_path, size)
+
+        return thumbnail_path
+
+    def _render_thumbnail(self, original_path: str, thumbnail_path: str, size: int) -> None:
+        """Downscale an image to fit in a size x size box and save it as PNG"""
+        logger.info(f"Rendering {size}px thumbnail for {os.path.basename(original_path)}")
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+
+        with Image.open(original_path) as img:
+            img = img.convert("RGBA")
+            img.thumbnail((size, size), Image.LANCZOS)
+
+            # Write to a temporary name first so concurrent readers never see a partial file
+            temp_path = f"{thumbnail_path}.{uuid.uuid4().hex}.tmp"
+            try:
+                img.save(temp_path, format="PNG", optimize=True)
+                os.replace(temp_path, thumbnail_path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
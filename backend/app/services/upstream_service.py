@@ -0,0 +1,601 @@
+import math
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextlib
+import contextvars
+import json
+import hashlib
+from collections import deque, OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, TypeVar
+import openai
+from fastapi import Request
+
+from ..constants import (
+    UPSTREAM_IMAGE_RPM, UPSTREAM_IMAGE_CONCURRENCY, UPSTREAM_CHAT_RPM, UPSTREAM_CHAT_CONCURRENCY,
+    UPSTREAM_MAX_RETRIES, UPSTREAM_BACKOFF_BASE, UPSTREAM_BACKOFF_MAX, UPSTREAM_LANE_WEIGHTS,
+    UPSTREAM_IMAGE_TIMEOUT, UPSTREAM_CHAT_TIMEOUT, UPSTREAM_BREAKER_THRESHOLD, UPSTREAM_BREAKER_COOLDOWN
+)
+from ..utils.clients import get_client_id
+from ..utils.metrics import REGISTRY
+from ..utils.tracing import span
+from ..utils.stages import PROMPT, UPSTREAM, stage_timer, count_retry
+from .singleflight_service import SingleFlight
+from .image_provider_service import ImageProviderError, get_image_provider
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Retries are handled by the scheduler; retries inside the SDK would bypass its budgets
+openai.max_retries = 0
+
+T = TypeVar("T")
+
+# Priority lanes: single frames and sprites a user is waiting on, and bulk generation
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# Lane, client and deadline (a time.monotonic() value) of the upstream calls made while
+# handling the current request
+_current_lane = contextvars.ContextVar("upstream_lane", default=INTERACTIVE)
+_current_client = contextvars.ContextVar("upstream_client", default="anonymous")
+_current_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("upstream_deadline", default=None)
+
+# Circuit breaker states, reported by the upstream_breaker_state gauge as 0, 1 and 2
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+_BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Failed attempts that say the upstream itself is unhealthy and count towards opening the breaker
+_BREAKER_OUTCOMES = ("server_error", "connection_error", "timeout")
+
+QUEUE_DEPTH = REGISTRY.gauge("upstream_queue_depth", "Upstream calls waiting for a slot", ["upstream", "lane"])
+IN_FLIGHT = REGISTRY.gauge("upstream_in_flight", "Upstream calls currently running", ["upstream"])
+REQUESTS = REGISTRY.counter("upstream_requests_total", "Upstream call attempts by outcome", ["upstream", "outcome"])
+RETRIES = REGISTRY.counter("upstream_retries_total", "Upstream call attempts that were retried", ["upstream"])
+FAILURES = REGISTRY.counter("upstream_failures_total", "Upstream calls that failed for good", ["upstream"])
+BREAKER_STATE = REGISTRY.gauge(
+    "upstream_breaker_state", "Circuit breaker state: 0 closed, 1 half-open, 2 open", ["upstream"]
+)
+BREAKER_REJECTED = REGISTRY.counter(
+    "upstream_breaker_rejected_total", "Upstream calls failed fast by an open circuit breaker", ["upstream"]
+)
+DEADLINE_EXCEEDED = REGISTRY.counter(
+    "upstream_deadline_exceeded_total", "Upstream calls given up because the request deadline passed", ["upstream"]
+)
+
+
+class UpstreamUnavailable(Exception):
+    """The upstream cannot serve a call now, with the HTTP status and Retry-After to answer"""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> Optional[Dict[str, str]]:
+        if self.retry_after is None:
+            return None
+        return {"Retry-After": str(max(1, int(math.ceil(self.retry_after))))}
+
+
+class CircuitOpen(UpstreamUnavailable):
+    """Raised instead of calling an upstream whose circuit breaker is open"""
+
+
+class UpstreamDeadlineExceeded(UpstreamUnavailable):
+    """Raised when the deadline of the current request passes before its upstream work is done"""
+
+    status_code = 504
+
+
+async def set_upstream_client(request: Request) -> None:
+    """
+    Dependency that attributes the upstream calls of a request to its client.
+
+    The value lives in the request's context, so it also covers work done
+    after the endpoint returns, such as a streaming response.
+    """
+    _current_client.set(get_client_id(request))
+
+
+@contextlib.contextmanager
+def upstream_deadline(seconds: float) -> Iterator[None]:
+    """
+    Give the upstream calls made inside the block a shared deadline.
+
+    Queueing, attempts and retry delays all count against it, so a slow or
+    failing upstream cannot hold a request (or a preset run) for longer than
+    `seconds`. A nested block can only shorten the deadline, never extend it.
+    """
+    deadline = time.monotonic() + seconds
+    current = _current_deadline.get()
+    token = _current_deadline.set(deadline if current is None else min(current, deadline))
+    try:
+        yield
+    finally:
+        _current_deadline.reset(token)
+
+
+def deadline_remaining() -> Optional[float]:
+    """Seconds left until the deadline of the current request, or None without a deadline"""
+    deadline = _current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_deadline() -> None:
+    """Raise UpstreamDeadlineExceeded once the deadline of the current request has passed"""
+    remaining = deadline_remaining()
+    if remaining is not None and remaining <= 0:
+        raise UpstreamDeadlineExceeded("The request deadline passed before its generation work was done")
+
+
+@contextlib.contextmanager
+def upstream_lane(lane: str) -> Iterator[None]:
+    """Queue the upstream calls made inside the block in the given priority lane"""
+    if lane not in UPSTREAM_LANE_WEIGHTS:
+        raise ValueError(f"Unknown upstream lane: {lane}, expected one of {tuple(UPSTREAM_LANE_WEIGHTS)}")
+    token = _current_lane.set(lane)
+    try:
+        yield
+    finally:
+        _current_lane.reset(token)
+
+
+def _classify_error(error: Exception) -> str:
+    """Get the outcome label of a failed call; everything but "error" is worth retrying"""
+    if isinstance(error, (openai.APITimeoutError, asyncio.TimeoutError)):
+        return "timeout"
+    if isinstance(error, ImageProviderError):
+        return "server_error" if error.transient else "error"
+    if isinstance(error, openai.RateLimitError):
+        return "rate_limited"
+    if isinstance(error, openai.APIStatusError):
+        return "server_error" if error.status_code >= 500 or error.status_code == 408 else "error"
+    if isinstance(error, openai.APIConnectionError):
+        return "connection_error"
+    return "error"
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Read the delay the server asked for from the Retry-After headers, in seconds"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            # Retry-After may also be an HTTP date
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Stops calling an upstream that keeps failing, so requests fail fast instead of hanging.
+
+    The breaker opens after `failure_threshold` consecutive failed attempts and
+    rejects calls for `cooldown` seconds. It then lets a single probe call
+    through (half-open): a success closes it, another failure opens it again.
+    Rate limiting and client errors say nothing about the upstream's health
+    and are left to the scheduler.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = UPSTREAM_BREAKER_THRESHOLD,
+                 cooldown: float = UPSTREAM_BREAKER_COOLDOWN):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(_BREAKER_STATE_VALUES[self.state], upstream=self.name)
+
+    def before_call(self) -> None:
+        """Let a call through, or raise CircuitOpen while the upstream is considered unhealthy"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self._opened_at + self.cooldown - time.monotonic()
+                if remaining > 0:
+                    BREAKER_REJECTED.inc(upstream=self.name)
+                    raise CircuitOpen(f"The {self.name} API is failing; calls are paused for {remaining:.0f}s", remaining)
+                self._set_state(HALF_OPEN)
+
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    BREAKER_REJECTED.inc(upstream=self.name)
+                    raise CircuitOpen(f"The {self.name} API is failing; waiting for a probe call to succeed", self.cooldown)
+                self._probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                logger.info(f"{self.name} circuit breaker closed")
+                self._set_state(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                logger.warning(f"{self.name} circuit breaker opened after {self._failures} failed attempts")
+                self._opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def abandon(self) -> None:
+        """Forget a call that ended without telling anything about the upstream's health"""
+        with self._lock:
+            self._probing = False
+
+    def _set_state(self, state: str) -> None:
+        # Called with the lock held
+        self.state = state
+        BREAKER_STATE.set(_BREAKER_STATE_VALUES[state], upstream=self.name)
+
+
+class UpstreamScheduler:
+    """
+    Admits calls to one upstream API within a requests-per-minute and a concurrency budget.
+
+    The request rate is enforced with a token bucket that refills at
+    requests_per_minute / 60 tokens per second. Waiting callers are admitted by
+    two-level fair queuing: the priority lanes share the admissions by their
+    weights (stride scheduling, so an idle lane's share goes to the others),
+    and inside a lane the waiting clients take turns, so one client's batch
+    cannot starve everyone else.
+
+    Rate-limited (429), server error (5xx), connection failures and attempts
+    over `call_timeout` are retried with jittered exponential backoff; a
+    Retry-After header from a 429 pauses every caller of this upstream, not
+    just the one that hit it. Calls give up once the deadline of the current
+    request (see upstream_deadline) has passed, and a circuit breaker fails
+    them fast while the upstream keeps failing.
+
+    The state is guarded by a thread lock and waiters are woken through their own
+    event loop, so a scheduler can be shared by every request of the process.
+    """
+
+    def __init__(self, name: str, requests_per_minute: int, max_concurrency: int,
+                 max_retries: int = UPSTREAM_MAX_RETRIES, backoff_base: float = UPSTREAM_BACKOFF_BASE,
+                 backoff_max: float = UPSTREAM_BACKOFF_MAX, lane_weights: Optional[Dict[str, float]] = None,
+                 call_timeout: float = UPSTREAM_IMAGE_TIMEOUT, breaker: Optional[CircuitBreaker] = None,
+                 stage: str = UPSTREAM):
+        self.name = name
+        # Pipeline stage the retries of this upstream are counted under
+        self.stage = stage
+        self.requests_per_minute = max(1, requests_per_minute)
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.call_timeout = call_timeout
+        self.breaker = breaker or CircuitBreaker(name)
+
+        # Allow short bursts up to the concurrency budget, never more than a minute's worth
+        self._capacity = float(min(self.max_concurrency, self.requests_per_minute))
+        self._tokens = self._capacity
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+
+        # Waiters per lane, then per client in turn order
+        # Every lane needs a positive weight, lanes left out keep the configured one
+        self.lane_weights = {**UPSTREAM_LANE_WEIGHTS, **(lane_weights or {})}
+        if any(weight <= 0 for weight in self.lane_weights.values()):
+            raise ValueError(f"Lane weights must be above 0, got {self.lane_weights}")
+        self._lanes = {lane: OrderedDict() for lane in self.lane_weights}
+        self._lane_pass = {lane: 0.0 for lane in self.lane_weights}
+        self._virtual_time = 0.0
+        self._queued = 0
+
+        self._in_flight = 0
+        self._wakeup: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._update_gauges()
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queued
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def call(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """
+        Run a blocking upstream call in a worker thread once the budgets allow it.
+
+        The call is retried on transient failures, so `func` must be safe to call
+        again: open request files inside it rather than passing an open file.
+
+        Raises:
+            CircuitOpen: while the upstream is considered unhealthy
+            UpstreamDeadlineExceeded: once the deadline of the current request has passed
+        """
+        attempt = 0
+        while True:
+            remaining = deadline_remaining()
+            if remaining is not None and remaining <= 0:
+                DEADLINE_EXCEEDED.inc(upstream=self.name)
+                raise UpstreamDeadlineExceeded(f"The request deadline passed before the {self.name} API call was made")
+            self.breaker.before_call()
+
+            try:
+                with span(f"{self.name}.queue", lane=_current_lane.get()):
+                    await asyncio.wait_for(self._acquire(), remaining)
+            except asyncio.TimeoutError:
+                self.breaker.abandon()
+                DEADLINE_EXCEEDED.inc(upstream=self.name)
+                raise UpstreamDeadlineExceeded(f"The request deadline passed while waiting for the {self.name} API")
+            except BaseException:
+                self.breaker.abandon()
+                raise
+
+            # An attempt may not outlive the request deadline
+            remaining = deadline_remaining()
+            timeout = self.call_timeout if remaining is None else max(0.0, min(self.call_timeout, remaining))
+            try:
+                with span(f"{self.name}.attempt", attempt=attempt + 1, model=kwargs.get("model", "")):
+                    result = await asyncio.wait_for(asyncio.to_thread(func, *args, **kwargs), timeout)
+            except asyncio.CancelledError:
+                self.breaker.abandon()
+                raise
+            except Exception as e:
+                outcome = _classify_error(e)
+                REQUESTS.inc(upstream=self.name, outcome=outcome)
+                if outcome == "timeout" and timeout < self.call_timeout:
+                    # Cut short by the request deadline, not by a slow upstream
+                    self.breaker.abandon()
+                    DEADLINE_EXCEEDED.inc(upstream=self.name)
+                    raise UpstreamDeadlineExceeded(f"The request deadline passed during the {self.name} API call") from e
+
+                if outcome in _BREAKER_OUTCOMES:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.abandon()
+                if outcome == "error" or attempt >= self.max_retries:
+                    FAILURES.inc(upstream=self.name)
+                    if outcome == "timeout":
+                        raise UpstreamUnavailable(f"The {self.name} API did not respond within {timeout:g}s") from e
+                    raise
+
+                delay = self._backoff(attempt)
+                retry_after = _retry_after(e)
+                if retry_after is not None:
+                    delay = max(delay, retry_after)
+                if outcome == "rate_limited":
+                    self._pause(delay)
+
+                remaining = deadline_remaining()
+                if remaining is not None and remaining <= delay:
+                    FAILURES.inc(upstream=self.name)
+                    DEADLINE_EXCEEDED.inc(upstream=self.name)
+                    raise UpstreamDeadlineExceeded(
+                        f"The request deadline leaves no time to retry the {self.name} API call ({outcome}): {str(e)}"
+                    ) from e
+
+                attempt += 1
+                RETRIES.inc(upstream=self.name)
+                count_retry(self.stage, kwargs.get("model", ""))
+                logger.warning(f"{self.name} upstream call failed ({outcome}), retry {attempt}/{self.max_retries} in {delay:.1f}s: {str(e)}")
+            else:
+                self.breaker.record_success()
+                REQUESTS.inc(upstream=self.name, outcome="ok")
+                return result
+            finally:
+                self._release()
+
+            await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int) -> float:
+        # Equal jitter: half the exponential delay is kept, the other half is random
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _pause(self, seconds: float) -> None:
+        """Stop admitting calls for a while, after the upstream said we are over the limit"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._refilled_at = time.monotonic()
+
+    async def _acquire(self) -> None:
+        lane = _current_lane.get()
+        client = _current_client.get()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        with self._lock:
+            self._enqueue(lane, client, waiter)
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                if self._remove(lane, client, waiter):
+                    granted = False
+                else:
+                    # Already admitted; _grant gives the slot back if it had not resolved the future yet
+                    granted = future.done() and not future.cancelled()
+            if granted:
+                self._release()
+            self._update_gauges()
+            raise
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+        self._dispatch()
+
+    def _grant(self, future: asyncio.Future) -> None:
+        """Resolve an admitted waiter's future on its own event loop"""
+        if future.done():
+            # The waiter was cancelled after being admitted
+            self._release()
+        else:
+            future.set_result(None)
+
+    def _dispatch(self) -> None:
+        """Admit waiting callers while both the concurrency and the rate budget allow it"""
+        with self._lock:
+            while self._queued and self._in_flight < self.max_concurrency:
+                wait = self._take_token()
+                if wait > 0:
+                    self._schedule_wakeup(wait)
+                    break
+
+                loop, future = self._dequeue()
+                self._in_flight += 1
+                try:
+                    loop.call_soon_threadsafe(self._grant, future)
+                except RuntimeError:
+                    # The waiter's event loop is gone
+                    self._in_flight -= 1
+        self._update_gauges()
+
+    def _enqueue(self, lane: str, client: str, waiter: tuple) -> None:
+        clients = self._lanes[lane]
+        if not clients:
+            # A lane that was idle joins at the current virtual time instead of
+            # cashing in the turns it did not use
+            self._lane_pass[lane] = max(self._lane_pass[lane], self._virtual_time)
+        clients.setdefault(client, deque()).append(waiter)
+        self._queued += 1
+
+    def _remove(self, lane: str, client: str, waiter: tuple) -> bool:
+        queue = self._lanes[lane].get(client)
+        if not queue or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        if not queue:
+            del self._lanes[lane][client]
+        self._queued -= 1
+        return True
+
+    def _dequeue(self) -> tuple:
+        """Pop the next waiter: the lane with the lowest pass, then that lane's next client"""
+        active = [lane for lane, clients in self._lanes.items() if clients]
+        lane = min(active, key=lambda lane: (self._lane_pass[lane], -self.lane_weights[lane]))
+        self._virtual_time = self._lane_pass[lane]
+        self._lane_pass[lane] += 1.0 / self.lane_weights[lane]
+
+        clients = self._lanes[lane]
+        client, queue = next(iter(clients.items()))
+        waiter = queue.popleft()
+        if queue:
+            clients.move_to_end(client)
+        else:
+            del clients[client]
+        self._queued -= 1
+        return waiter
+
+    def _take_token(self) -> float:
+        """Take a token from the bucket, or return how many seconds until one is available"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+
+        rate = self.requests_per_minute / 60.0
+        self._tokens = min(self._capacity, self._tokens + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return 0.0
+        return (1.0 - self._tokens) / rate
+
+    def _schedule_wakeup(self, wait: float) -> None:
+        if self._wakeup is not None:
+            return
+        self._wakeup = threading.Timer(wait, self._on_wakeup)
+        self._wakeup.daemon = True
+        self._wakeup.start()
+
+    def _on_wakeup(self) -> None:
+        with self._lock:
+            self._wakeup = None
+        self._dispatch()
+
+    def _update_gauges(self) -> None:
+        for lane, clients in self._lanes.items():
+            QUEUE_DEPTH.set(sum(len(queue) for queue in clients.values()), upstream=self.name, lane=lane)
+        IN_FLIGHT.set(self._in_flight, upstream=self.name)
+
+
+# Shared by every request of the process, so the budgets hold across concurrent requests
+image_scheduler = UpstreamScheduler("image", UPSTREAM_IMAGE_RPM, UPSTREAM_IMAGE_CONCURRENCY, call_timeout=UPSTREAM_IMAGE_TIMEOUT)
+chat_scheduler = UpstreamScheduler("chat", UPSTREAM_CHAT_RPM, UPSTREAM_CHAT_CONCURRENCY, call_timeout=UPSTREAM_CHAT_TIMEOUT,
+                                  stage=PROMPT)
+
+# Identical image requests in flight at the same time share one upstream call
+image_flights = SingleFlight("image")
+
+
+def generation_key(operation: str, image: Optional[bytes] = None, **params: Any) -> str:
+    """Hash an upstream request into a key that is equal for identical requests"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([operation, params], sort_keys=True, default=str).encode("utf-8"))
+    if image is not None:
+        digest.update(hashlib.sha256(image).digest())
+    return digest.hexdigest()
+
+
+async def request_image(operation: str, image: Optional[Tuple[str, bytes, str]] = None, variant: int = 0,
+                        **params: Any) -> str:
+    """
+    Request an image from the configured image provider through the scheduler.
+
+    Identical requests in flight at the same time, in this or another worker
+    process, are coalesced into one upstream call and all get its result.
+    Waiting for a coalesced call also ends at the deadline of the current request.
+
+    Args:
+        operation: "generate" or "edit"
+        image: The reference image for an edit, as (filename, bytes, content type)
+        variant: Tells apart identical requests that are meant to give different
+            results, such as the variations of one edit
+        params: Parameters of the images API call (model, prompt, size, quality, ...)
+
+    Returns:
+        The image as base64-encoded data
+    """
+    if operation not in ("generate", "edit"):
+        raise ValueError(f"Unsupported image operation: {operation}")
+
+    provider = get_image_provider()
+    key = generation_key(operation, image[1] if image else None, provider=provider.name, variant=variant, **params)
+
+    async def send() -> str:
+        # The provider timeout closes the socket of an abandoned attempt; the scheduler enforces it too
+        if operation == "edit":
+            return await image_scheduler.call(provider.edit, image, timeout=image_scheduler.call_timeout, **params)
+        return await image_scheduler.call(provider.generate, timeout=image_scheduler.call_timeout, **params)
+
+    check_deadline()
+    try:
+        with stage_timer(UPSTREAM, params.get("model", "")):
+            return await asyncio.wait_for(image_flights.do(key, send), deadline_remaining())
+    except asyncio.TimeoutError:
+        DEADLINE_EXCEEDED.inc(upstream=image_scheduler.name)
+        raise UpstreamDeadlineExceeded("The request deadline passed while waiting for the image API")
+
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from typing import Any, List, Optional, Tuple
+
+from ..constants import WRITE_BATCH_WINDOW, WRITE_BATCH_MAX
+from ..utils.database import AsyncSessionLocal, DB_TYPE
+from ..utils.logs import log_event
+from ..utils.metrics import REGISTRY
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = REGISTRY.histogram(
+    "db_write_batch_size",
+    "Objects committed together in one transaction by a write queue",
+    ["queue"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+WRITE_BATCH_FAILURES = REGISTRY.counter(
+    "db_write_batch_failures_total",
+    "Batches whose commit failed and were retried one object at a time",
+    ["queue"]
+)
+
+
+class WriteQueue:
+    """
+    Serializes inserts through a single writer that commits them in batches.
+
+    SQLite allows one writer at a time, so concurrent commits from many
+    requests wait on each other's locks (or fail with "database is locked").
+    Instead, callers hand their new objects to the queue and a single drain
+    task commits everything that arrives within a short window in one
+    transaction, then resolves each caller. The drain task only runs while
+    there is something to write.
+
+    When disabled (any backend other than SQLite), each object is committed
+    directly in its own session.
+    """
+
+    def __init__(self, name: str, enabled: bool = DB_TYPE == "sqlite", window: float = WRITE_BATCH_WINDOW,
+                 max_batch: int = WRITE_BATCH_MAX):
+        self.name = name
+        self.enabled = enabled
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[Any, concurrent.futures.Future]] = []
+        self._lock = threading.Lock()
+        self._drain: Optional[asyncio.Task] = None
+
+    async def add(self, obj: Any) -> Any:
+        """
+        Insert an ORM object and wait until it is committed.
+
+        Args:
+            obj: A new ORM object; it stays readable after the commit
+
+        Returns:
+            The committed object
+        """
+        if not self.enabled:
+            async with AsyncSessionLocal() as db:
+                db.add(obj)
+                await db.commit()
+            return obj
+
+        # A thread-safe future, as callers may run on different event loops
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        with self._lock:
+            self._pending.append((obj, future))
+            if self._drain is None:
+                self._drain = asyncio.get_running_loop().create_task(self._run())
+
+        # Shielded so a cancelled caller does not cancel the commit of the whole batch
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    async def _run(self) -> None:
+        batch: List[Tuple[Any, concurrent.futures.Future]] = []
+        try:
+            while True:
+                # Let concurrent inserts join the batch
+                await asyncio.sleep(self.window)
+                with self._lock:
+                    batch = self._pending[:self.max_batch]
+                    del self._pending[:self.max_batch]
+
+                errors = await self._commit([obj for obj, _ in batch])
+
+                with self._lock:
+                    done = not self._pending
+                    if done:
+                        self._drain = None
+                # Nothing is awaited from here on, so the task is finished by the time
+                # its callers resume (and their event loop may close)
+                for (obj, future), error in zip(batch, errors):
+                    if error is None:
+                        future.set_result(obj)
+                    else:
+                        future.set_exception(error)
+                batch = []
+                if done:
+                    return
+        except BaseException:
+            # Cancelled with its event loop: fail what is left rather than leave callers waiting
+            with self._lock:
+                batch, self._pending = batch + self._pending, []
+                self._drain = None
+            for obj, future in batch:
+                if not future.done():
+                    future.set_exception(Exception(f"Write queue {self.name} stopped before committing"))
+            raise
+
+    async def _commit(self, objs: List[Any]) -> List[Optional[Exception]]:
+        """Commit the objects in one transaction, and return the error of each (None if committed)"""
+        WRITE_BATCH_SIZE.observe(len(objs), queue=self.name)
+        try:
+            async with AsyncSessionLocal() as db:
+                db.add_all(objs)
+                await db.commit()
+            return [None] * len(objs)
+        except Exception as e:
+            # Retry one by one, so a bad object fails only its own caller
+            WRITE_BATCH_FAILURES.inc(queue=self.name)
+            log_event(logger, logging.WARNING, "db.write_batch.failed", queue=self.name, size=len(objs), error=str(e))
+
+        errors: List[Optional[Exception]] = []
+        for obj in objs:
+            try:
+                async with AsyncSessionLocal() as db:
+                    db.add(obj)
+                    await db.commit()
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+
+# Frame inserts from concurrent generations and interpolations
+frame_writes = WriteQueue("frames")
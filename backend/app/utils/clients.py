@@ -0,0 +1,12 @@
+from fastapi import Request
+
+# Request header a client can set to identify itself, e.g. a per-user or per-tab ID
+CLIENT_ID_HEADER = "X-Client-Id"
+
+
+def get_client_id(request: Request) -> str:
+    """Identify the client of a request for fair sharing, by header or else by address"""
+    client_id = request.headers.get(CLIENT_ID_HEADER)
+    if client_id:
+        return client_id.strip()[:128]
+    return request.client.host if request.client else "anonymous"
@@ -1,10 +1,17 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 from dotenv import load_dotenv
 import logging
 
+from ..constants import (
+    SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_MMAP_SIZE, SQLITE_CACHE_SIZE_KB
+)
+
 # Configure logging
 logger = logging.getLogger(__name__)
 
@@ -27,7 +34,40 @@ else:
 
 logger.info(f"Using database URL: {SQLALCHEMY_DATABASE_URL}")
 
-# Create engine
+# asyncio driver of each database backend, used by the services
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+def async_database_url(url: str) -> URL:
+    """The same database URL with the asyncio driver of its backend"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver configured for database backend {backend}")
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+
+def configure_sqlite_connection(dbapi_connection, connection_record) -> None:
+    """
+    Apply the SQLite pragmas to a new connection.
+
+    WAL lets readers run alongside a writer, and the busy timeout makes a
+    connection wait for a lock instead of failing with "database is locked".
+    The cache size is negative, so it is in KiB rather than pages.
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    finally:
+        cursor.close()
+
+# Create engine (synchronous, for the scripts and schema management)
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL,
     connect_args={"check_same_thread": False} if DB_TYPE == "sqlite" else {},
@@ -36,6 +76,24 @@ engine = create_engine(
 )
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Create async engine for the services, so queries and commits do not block the event loop
+# SQLite connections are pooled too (aiosqlite defaults to a new connection per session), so
+# they keep their page cache and memory map between sessions
+async_engine = create_async_engine(
+    async_database_url(SQLALCHEMY_DATABASE_URL),
+    poolclass=AsyncAdaptedQueuePool if DB_TYPE == "sqlite" else None,
+    pool_pre_ping=True,
+    pool_recycle=3600
+)
+
+if DB_TYPE == "sqlite":
+    event.listen(engine, "connect", configure_sqlite_connection)
+    event.listen(async_engine.sync_engine, "connect", configure_sqlite_connection)
+
+# Objects stay readable after commit and after their session is closed, as there are no
+# implicit lazy loads with asyncio: relationships must be loaded with the query (selectinload)
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
 def get_db():
@@ -45,5 +103,9 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def init_db():
     Base.metadata.create_all(bind=engine) 
\ No newline at end of file
@@ -0,0 +1,183 @@
+import json
+import queue
+import atexit
+import logging
+import secrets
+import zlib
+import contextvars
+import logging.handlers
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from ..constants import LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE, LOG_QUEUE_SIZE
+
+# Request header with the caller's request ID; echoed on the response, and generated if absent
+REQUEST_ID_HEADER = "X-Request-Id"
+
+# ID of the request being handled, attached to every log record made while handling it
+_current_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+
+def current_request_id() -> Optional[str]:
+    return _current_request_id.get()
+
+
+class Event:
+    """
+    A structured log message: an event name with key=value fields.
+
+    Rendered only when a handler formats the record, so a filtered or
+    sampled-out event costs no string formatting.
+    """
+
+    __slots__ = ("name", "fields")
+
+    def __init__(self, name: str, fields: Dict[str, Any]):
+        self.name = name
+        self.fields = fields
+
+    def __str__(self) -> str:
+        if not self.fields:
+            return self.name
+        return self.name + " " + " ".join(f"{key}={value!r}" if isinstance(value, str) else f"{key}={value}"
+                                          for key, value in self.fields.items())
+
+
+def log_event(logger: logging.Logger, level: int, event: str, exc_info: Any = None, **fields: Any) -> None:
+    """
+    Log a structured event, such as log_event(logger, logging.INFO, "sprite.generated", sprite_id=...).
+
+    Nothing is built unless the logger is enabled for the level. Use
+    DEBUG for bulky details such as full prompts.
+    """
+    if logger.isEnabledFor(level):
+        logger.log(level, Event(event, fields), exc_info=exc_info, stacklevel=2)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attaches the current request ID to records, and drops the INFO and DEBUG records of unsampled requests"""
+
+    def __init__(self, sample_rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = _current_request_id.get()
+        record.request_id = request_id or "-"
+        if self.sample_rate >= 1 or record.levelno >= logging.WARNING or request_id is None:
+            return True
+        # Sample whole requests, so the records of a kept request are complete
+        return (zlib.crc32(request_id.encode("utf-8")) % 10000) < self.sample_rate * 10000
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line, with the fields of structured events"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        if isinstance(record.msg, Event):
+            entry["event"] = record.msg.name
+            entry.update(record.msg.fields)
+        else:
+            entry["message"] = record.getMessage()
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RequestIdMiddleware:
+    """ASGI middleware that gives each HTTP request an ID for its log records"""
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope.get("headers") or []).get(REQUEST_ID_HEADER.lower().encode())
+        request_id = incoming.decode("latin-1").strip()[:64] if incoming else secrets.token_hex(8)
+        token = _current_request_id.set(request_id)
+
+        async def send_with_request_id(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(REQUEST_ID_HEADER.encode(), request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            _current_request_id.reset(token)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A queue handler that drops records instead of blocking the caller when the queue is full"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler, leave the message unformatted: the writer thread formats it, and
+        # keeps the fields of structured events. Only the traceback is rendered here, while it exists.
+        record.exc_text = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> None:
+    """
+    Configure the root logger for the application.
+
+    Records are put on a bounded queue and written by a background thread, so
+    logging never blocks the event loop on I/O; when the queue is full, records
+    are dropped rather than slowing requests down. LOG_FORMAT selects text or
+    JSON lines, and LOG_SAMPLE_RATE keeps the INFO and DEBUG records of only a
+    share of the requests.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    # Filters run in the calling thread, where the request context is available
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+
+    _listener = logging.handlers.QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Write out the queued records and stop the background writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,109 @@
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from typing import Optional
+
+from ..constants import LOOP_MONITOR_INTERVAL, LOOP_STALL_THRESHOLD
+from .metrics import REGISTRY
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds",
+    "Delay of the event loop monitor's heartbeat past its scheduled time",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+LOOP_LAG_MAX = REGISTRY.gauge("event_loop_lag_max_seconds", "Longest event loop lag seen since the process started")
+LOOP_STALLS = REGISTRY.counter(
+    "event_loop_stalls_total", "Times a callback blocked the event loop for longer than the stall threshold"
+)
+
+
+class LoopMonitor:
+    """
+    Watches an event loop for callbacks that block it.
+
+    A heartbeat coroutine on the loop wakes every `interval` seconds and
+    records how late it woke as the event loop lag. A watchdog thread checks
+    the heartbeat; once it is more than `threshold` seconds overdue, the loop
+    is stalled and the watchdog logs the stack the loop thread is running at
+    that moment, which is the blocking call. Each stall is logged once, with
+    its total duration when the loop recovers.
+    """
+
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, threshold: float = LOOP_STALL_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        # time.monotonic() of the last heartbeat; read by the watchdog thread
+        self._last_beat = 0.0
+        self._stalled_since: Optional[float] = None
+        self._max_lag = 0.0
+
+    def start(self) -> None:
+        """Start watching the running event loop"""
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = self._loop.create_task(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Watching the event loop for stalls over {self.threshold * 1000:.0f}ms")
+
+    async def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=self.interval * 2)
+            self._watchdog = None
+
+    async def _heartbeat(self) -> None:
+        while True:
+            scheduled = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - scheduled)
+            self._last_beat = now
+            LOOP_LAG.observe(lag)
+            if lag > self._max_lag:
+                self._max_lag = lag
+                LOOP_LAG_MAX.set(lag)
+
+            stalled_since = self._stalled_since
+            if stalled_since is not None:
+                self._stalled_since = None
+                logger.warning(f"Event loop recovered after being blocked for {now - stalled_since:.2f}s")
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.interval):
+            overdue = time.monotonic() - self._last_beat - self.interval
+            if overdue <= self.threshold or self._stalled_since is not None:
+                continue
+            self._stalled_since = self._last_beat + self.interval
+            LOOP_STALLS.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "(stack unavailable)\n"
+            logger.warning(
+                f"Event loop blocked for over {overdue * 1000:.0f}ms; the loop thread is running:\n{stack.rstrip()}"
+            )
+
+
+# Monitor of the application's event loop, started with the app when LOOP_MONITOR_INTERVAL > 0
+loop_monitor = LoopMonitor()
@@ -0,0 +1,214 @@
+import os
+import re
+import sys
+import time
+import uuid
+import pstats
+import secrets
+import cProfile
+import logging
+import threading
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+from fastapi import Header, HTTPException
+from fastapi.responses import JSONResponse
+
+from ..constants import PROFILE_ADMIN_TOKEN, PROFILE_DIR, PROFILE_SAMPLE_INTERVAL
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Request header (or `profile` query parameter) that asks for a profile: "1" or "sample" for
+# the sampling profiler, "cprofile" for the deterministic one
+PROFILE_HEADER = "X-Profile"
+PROFILE_QUERY_PARAM = "profile"
+# Request header with the admin token that allows profiling and reading profiles
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+# Response header naming the stored profile of a profiled request
+PROFILE_ID_HEADER = "X-Profile-Id"
+
+# Profile modes and the extension of the file each one writes
+PROFILE_MODES = {"sample": "folded", "cprofile": "prof"}
+
+_PROFILE_NAME = re.compile(r"^[A-Za-z0-9_.-]+\.(folded|prof)$")
+
+
+def profiling_enabled() -> bool:
+    return bool(PROFILE_ADMIN_TOKEN)
+
+
+def is_admin_token(token: Optional[str]) -> bool:
+    return bool(PROFILE_ADMIN_TOKEN) and token is not None and secrets.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Dependency for the profile endpoints: they do not exist while profiling is off"""
+    if not profiling_enabled():
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail=f"A valid {ADMIN_TOKEN_HEADER} header is required")
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread at a fixed interval into collapsed stacks.
+
+    The output has one "frame;frame;frame count" line per distinct stack, the
+    format read by flamegraph.pl, inferno and speedscope. The sampled thread is
+    the event loop, so work of other requests running concurrently on it
+    appears too, and time the request spends in worker threads shows up as
+    the loop waiting.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class ProfilerBusy(Exception):
+    """Another request is already being profiled with cProfile"""
+
+
+# cProfile installs one profile hook for the whole process: a second profiler would replace
+# the first one's hook and be switched off by it, truncating both profiles
+_cprofile_lock = threading.Lock()
+
+
+class DeterministicProfiler:
+    """
+    Profiles every call on the event loop thread with cProfile; the file loads with pstats or snakeviz.
+
+    Only one can run at a time in the process; start() raises ProfilerBusy
+    while another is running.
+    """
+
+    def __init__(self):
+        self._profile = cProfile.Profile()
+
+    def start(self) -> None:
+        if not _cprofile_lock.acquire(blocking=False):
+            raise ProfilerBusy("Another request is being profiled with cprofile; retry later or use X-Profile: sample")
+        self._profile.enable()
+
+    def stop(self) -> None:
+        self._profile.disable()
+        _cprofile_lock.release()
+
+    def write(self, path: str) -> None:
+        pstats.Stats(self._profile).dump_stats(path)
+
+
+def _requested_mode(scope: Dict[str, Any]) -> Optional[str]:
+    headers = dict(scope.get("headers") or [])
+    value = headers.get(PROFILE_HEADER.lower().encode(), b"").decode("latin-1")
+    if not value and scope.get("query_string"):
+        value = parse_qs(scope["query_string"].decode("latin-1")).get(PROFILE_QUERY_PARAM, [""])[0]
+    value = value.strip().lower()
+    if not value or value in ("0", "false"):
+        return None
+    return "sample" if value in ("1", "true") else value
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware that profiles the requests an admin asks it to.
+
+    A request with the X-Profile header (or the `profile` query parameter) and
+    a valid X-Admin-Token runs under the requested profiler; the profile is
+    stored in PROFILE_DIR and named in the X-Profile-Id response header. Only
+    added to the app when PROFILE_ADMIN_TOKEN is set.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        mode = _requested_mode(scope)
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        token = dict(scope.get("headers") or []).get(ADMIN_TOKEN_HEADER.lower().encode())
+        if not is_admin_token(token.decode("latin-1") if token else None) or mode not in PROFILE_MODES:
+            # Served normally: profiling is never a way to probe for the token
+            await self.app(scope, receive, send)
+            return
+
+        name = self._profile_name(scope, mode)
+        profiler = SamplingProfiler(threading.get_ident()) if mode == "sample" else DeterministicProfiler()
+
+        async def send_with_profile_id(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(PROFILE_ID_HEADER.encode(), name.encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            profiler.start()
+        except ProfilerBusy as e:
+            await JSONResponse({"detail": str(e)}, status_code=409)(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.stop()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.write(os.path.join(PROFILE_DIR, name))
+            logger.info(f"Stored {mode} profile {name} of {scope['method']} {scope['path']} "
+                        f"({time.perf_counter() - started:.2f}s)")
+
+    @staticmethod
+    def _profile_name(scope: Dict[str, Any], mode: str) -> str:
+        path = re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_")[:80]
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        return f"{stamp}-{scope['method'].lower()}-{path}-{uuid.uuid4().hex[:8]}.{PROFILE_MODES[mode]}"
+
+
+def list_profiles() -> List[Dict[str, Any]]:
+    """The stored profiles, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    profiles = []
+    for name in os.listdir(PROFILE_DIR):
+        if _PROFILE_NAME.match(name):
+            stat = os.stat(os.path.join(PROFILE_DIR, name))
+            profiles.append({"id": name, "size": stat.st_size, "created_at": stat.st_mtime})
+    return sorted(profiles, key=lambda profile: profile["created_at"], reverse=True)
+
+
+def get_profile_path(name: str) -> str:
+    """Local path of a stored profile; raises FileNotFoundError for unknown or invalid names"""
+    path = os.path.join(PROFILE_DIR, name)
+    if not _PROFILE_NAME.match(name) or not os.path.isfile(path):
+        raise FileNotFoundError(f"Profile not found: {name}")
+    return path
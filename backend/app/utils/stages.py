@@ -0,0 +1,99 @@
+import time
+import contextlib
+import contextvars
+from typing import Iterator
+from fastapi import Request
+
+from .metrics import REGISTRY
+from .tracing import span
+
+# Stages of the generation pipeline, timed by generation_stage_seconds
+PROMPT = "prompt_enhancement"
+UPSTREAM = "upstream_image"
+DOWNLOAD = "download"
+DECODE = "decode"
+POST_PROCESS = "post_process"
+ENCODE = "encode"
+STORAGE_WRITE = "storage_write"
+DB_COMMIT = "db_commit"
+
+# Preset frames are retried as a whole, counted under this stage by generation_stage_retries_total
+FRAME = "frame"
+
+# Route of the request being handled, e.g. "POST /api/sprites/generate"; work started
+# outside a request, such as a script, is reported as "none"
+_current_endpoint = contextvars.ContextVar("metrics_endpoint", default="none")
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "generation_stage_seconds",
+    "Time spent in each stage of the generation pipeline",
+    ["endpoint", "stage", "model"]
+)
+STAGE_FAILURES = REGISTRY.counter(
+    "generation_stage_failures_total",
+    "Generation pipeline stages that raised an error",
+    ["endpoint", "stage", "model"]
+)
+STAGE_RETRIES = REGISTRY.counter(
+    "generation_stage_retries_total",
+    "Generation pipeline stages that were retried after a failed attempt",
+    ["endpoint", "stage", "model"]
+)
+CACHE_HITS = REGISTRY.counter(
+    "generation_cache_hits_total",
+    "Work served from a cache or shared with an identical request instead of being done again",
+    ["endpoint", "cache"]
+)
+
+
+async def set_metrics_endpoint(request: Request) -> None:
+    """
+    Dependency that labels the pipeline metrics of a request with its route.
+
+    The route template is used rather than the URL, so that IDs in the path
+    do not create a new series per resource.
+    """
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or request.url.path
+    _current_endpoint.set(f"{request.method} {path}")
+
+
+def current_endpoint() -> str:
+    return _current_endpoint.get()
+
+
+def record_stage(stage: str, seconds: float, model: str = "") -> None:
+    """Record the duration of a stage that was timed by the caller"""
+    STAGE_SECONDS.observe(seconds, endpoint=_current_endpoint.get(), stage=stage, model=model)
+
+
+@contextlib.contextmanager
+def stage_timer(stage: str, model: str = "") -> Iterator[None]:
+    """
+    Time the block as one stage of the generation pipeline.
+
+    The duration is recorded whether or not the block raises; a block that
+    raises also counts as a failure of the stage. Inside a sampled trace the
+    block is also recorded as a span named after the stage.
+
+    Args:
+        stage: One of the stage names above
+        model: The model the work is for, or "" for stages not tied to one
+    """
+    started = time.perf_counter()
+    try:
+        with span(stage, model=model):
+            yield
+    except Exception:
+        STAGE_FAILURES.inc(endpoint=_current_endpoint.get(), stage=stage, model=model)
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - started, model)
+
+
+def count_retry(stage: str, model: str = "") -> None:
+    STAGE_RETRIES.inc(endpoint=_current_endpoint.get(), stage=stage, model=model)
+
+
+def count_cache_hit(cache: str) -> None:
+    CACHE_HITS.inc(endpoint=_current_endpoint.get(), cache=cache)
@@ -0,0 +1,76 @@
+import os
+import uuid
+import logging
+import requests
+from typing import Optional
+from PIL import Image
+
+from ..constants import BACKEND_URL, STATIC_DIR
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def static_filename(url: str) -> Optional[str]:
+    """
+    Extract the file name of an image served from the static directory.
+
+    Accepts both fully qualified URLs (``{BACKEND_URL}/static/<name>``) and
+    relative ``/static/<name>`` paths. Returns None for URLs that do not point
+    at the static directory.
+    """
+    if not url:
+        return None
+
+    path = url
+    if BACKEND_URL and path.startswith(BACKEND_URL):
+        path = path[len(BACKEND_URL):]
+
+    if not path.startswith("/static/"):
+        return None
+
+    filename = path[len("/static/"):]
+    # Never allow a URL to escape the static directory
+    if not filename or os.path.basename(filename) != filename:
+        return None
+    return filename
+
+
+def resolve_static_path(url: str) -> Optional[str]:
+    """Return the local path of a static image URL, or None if it is not stored locally"""
+    filename = static_filename(url)
+    if not filename:
+        return None
+
+    path = os.path.join(STATIC_DIR, filename)
+    if not os.path.exists(path):
+        logger.warning(f"Static file for URL not found: {path}")
+        return None
+    return path
+
+
+def read_image_bytes(url: str) -> bytes:
+    """Read an image from the static directory, or download it if it is not stored locally"""
+    local_path = resolve_static_path(url)
+    if local_path:
+        with open(local_path, "rb") as f:
+            return f.read()
+
+    if not url.startswith("http"):
+        raise Exception(f"Unsupported image URL format: {url}")
+
+    try:
+        response = requests.get(url, timeout=60)
+    except requests.exceptions.RequestException as e:
+        raise Exception(f"Failed to download image {url}: {str(e)}")
+    if response.status_code != 200:
+        raise Exception(f"Failed to download image: HTTP {response.status_code} for {url}")
+    return response.content
+
+
+def save_image(image: Image.Image) -> str:
+    """Save an image as PNG under a new random name in the static directory and return its URL"""
+    image_filename = f"{uuid.uuid4()}.png"
+    os.makedirs(STATIC_DIR, exist_ok=True)
+    image.save(os.path.join(STATIC_DIR, image_filename), format="PNG")
+    return f"{BACKEND_URL}/static/{image_filename}"
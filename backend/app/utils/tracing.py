@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import random
+import secrets
+import asyncio
+import logging
+import inspect
+import functools
+import threading
+import contextlib
+import contextvars
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from ..constants import TRACE_FILE, TRACE_SAMPLE_RATE, TRACE_MAX_STATEMENT_LENGTH
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# W3C trace context header, accepted on requests so a trace can continue one started by the caller
+TRACEPARENT_HEADER = "traceparent"
+# Response header carrying the trace ID of a sampled request, to find its spans in the export
+TRACE_ID_HEADER = "X-Trace-Id"
+
+# Span of the work currently running; None outside a sampled trace, which makes span() a no-op
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    """One timed operation of a trace, such as a request, a service call, an upstream call or a query"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_time", "duration",
+                 "status", "error", "_started")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self.duration: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self._started = time.perf_counter()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self) -> None:
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._started
+            _exporter.export(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class SpanExporter:
+    """Receives every finished span of a sampled trace"""
+
+    def export(self, span: Span) -> None:
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+class JsonLinesExporter(SpanExporter):
+    """
+    Appends finished spans to a file as JSON lines, one object per span.
+
+    Spans are written as they finish, so children come before their parent;
+    group them by trace_id and link them by parent_id to rebuild a trace.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class InMemoryExporter(SpanExporter):
+    """Keeps finished spans in a list, for scripts that inspect a trace directly"""
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+
+_exporter: SpanExporter = SpanExporter()
+_enabled = False
+_sample_rate = TRACE_SAMPLE_RATE
+
+
+def configure_tracing(exporter: Optional[SpanExporter], sample_rate: float = TRACE_SAMPLE_RATE) -> None:
+    """
+    Start exporting the spans of a share of the requests, or stop with exporter None.
+
+    Args:
+        exporter: Where finished spans go
+        sample_rate: Share of the requests (0 to 1) that are traced
+    """
+    global _exporter, _enabled, _sample_rate
+    _exporter.shutdown()
+    _exporter = exporter or SpanExporter()
+    _enabled = exporter is not None
+    _sample_rate = sample_rate
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Time the block as a child of the current span.
+
+    Outside a sampled trace this does nothing and yields None, so it can be
+    left in hot paths. Works in coroutines and in worker threads started with
+    asyncio.to_thread, which inherit the context of their caller.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, parent.trace_id, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator that runs each call of a function, coroutine function or async generator in its own span"""
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__qualname__
+
+        if inspect.isasyncgenfunction(func):
+            @functools.wraps(func)
+            async def async_gen_wrapper(*args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+                # The span lasts for the whole iteration, but is only current while the generator
+                # runs: each item is handed over with the caller's span current again
+                caller_span = _current_span.get()
+                with span(span_name):
+                    async with contextlib.aclosing(func(*args, **kwargs)) as items:
+                        async for item in items:
+                            token = _current_span.set(caller_span)
+                            try:
+                                yield item
+                            finally:
+                                _current_span.reset(token)
+            return async_gen_wrapper
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def _parse_traceparent(value: str) -> Optional[tuple]:
+    """Get (trace ID, parent span ID, sampled) from a traceparent header, or None if malformed"""
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that starts a trace, or continues the caller's, for each HTTP request.
+
+    The root span is named after the matched route, so requests for different
+    resources of one endpoint share a name. Sampled requests get their trace ID
+    in the X-Trace-Id response header.
+    """
+
+    def __init__(self, app: Callable):
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not _enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        incoming = headers.get(TRACEPARENT_HEADER.encode())
+        parsed = _parse_traceparent(incoming.decode("latin-1")) if incoming else None
+        if parsed:
+            trace_id, parent_id, sampled = parsed
+        else:
+            trace_id, parent_id, sampled = secrets.token_hex(16), None, random.random() < _sample_rate
+        if not sampled:
+            await self.app(scope, receive, send)
+            return
+
+        root = Span(f"{scope['method']} {scope['path']}", trace_id, parent_id,
+                    {"http.method": scope["method"], "http.path": scope["path"]})
+        token = _current_span.set(root)
+
+        async def send_with_trace_id(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                root.set_attribute("http.status_code", message["status"])
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(TRACE_ID_HEADER.encode(), trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_id)
+        except BaseException as e:
+            root.record_error(e)
+            raise
+        finally:
+            # Routing has matched by now; name the span after the route template
+            route = scope.get("route")
+            if getattr(route, "path", None):
+                root.name = f"{scope['method']} {route.path}"
+            if root.attributes.get("http.status_code", 200) >= 500:
+                root.status = "error"
+            _current_span.reset(token)
+            root.end()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Record a span for every statement the engine executes inside a sampled trace"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = _current_span.get()
+        if parent is None:
+            return
+        query = Span("db.query", parent.trace_id, parent.span_id, {
+            "db.statement": statement[:TRACE_MAX_STATEMENT_LENGTH],
+            "db.executemany": executemany,
+        })
+        conn.info.setdefault("trace_spans", []).append(query)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if spans:
+            query = spans.pop()
+            if cursor.rowcount is not None and cursor.rowcount >= 0:
+                query.set_attribute("db.rowcount", cursor.rowcount)
+            query.end()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        spans = context.connection.info.get("trace_spans") if context.connection is not None else None
+        if spans:
+            query = spans.pop()
+            query.record_error(context.original_exception)
+            query.end()
+
+    @event.listens_for(engine, "commit")
+    def commit(conn):
+        parent = _current_span.get()
+        if parent is not None:
+            # Called before the commit is sent; the enclosing span holds its duration
+            parent.attributes["db.commits"] = parent.attributes.get("db.commits", 0) + 1
+
+
+def setup_tracing(engine: Engine) -> None:
+    """Export spans to TRACE_FILE if it is set, including the statements of `engine`"""
+    if not TRACE_FILE:
+        return
+    configure_tracing(JsonLinesExporter(TRACE_FILE))
+    instrument_engine(engine)
+    logger.info(f"Tracing {TRACE_SAMPLE_RATE:.0%} of requests to {TRACE_FILE}")
@@ -0,0 +1,35 @@
+import sys
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from sqlalchemy import inspect
+from app.utils.database import engine
+from app.models.sprite import Sprite
+from app.models.animation import Animation
+from app.models.idempotency import IdempotencyKey
+
+def add_idempotency_keys_table():
+    print("Adding idempotency_keys table...")
+    
+    try:
+        inspector = inspect(engine)
+        existing_tables = inspector.get_table_names()
+        
+        for table in (IdempotencyKey.__table__,):
+            if table.name in existing_tables:
+                print(f"Table '{table.name}' already exists.")
+                continue
+            
+            table.create(bind=engine)
+            print(f"Created '{table.name}' table.")
+        
+        return True
+        
+    except Exception as e:
+        print(f"Error updating database: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    add_idempotency_keys_table()
@@ -0,0 +1,39 @@
+import sys
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from sqlalchemy import text, inspect
+from app.utils.database import engine
+
+def add_is_draft_columns():
+    print("Adding 'is_draft' columns to sprites and frames tables...")
+    
+    try:
+        inspector = inspect(engine)
+        
+        with engine.connect() as connection:
+            with connection.begin():
+                for table in ("sprites", "frames"):
+                    # Check if the column already exists
+                    columns = [column["name"] for column in inspector.get_columns(table)]
+                    
+                    if "is_draft" in columns:
+                        print(f"Column 'is_draft' already exists in {table} table.")
+                        continue
+                    
+                    connection.execute(text(f"""
+                    ALTER TABLE {table} 
+                    ADD COLUMN is_draft BOOLEAN DEFAULT FALSE;
+                    """))
+                    print(f"Added 'is_draft' column to {table} table.")
+        
+        return True
+        
+    except Exception as e:
+        print(f"Error updating database: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    add_is_draft_columns()
@@ -0,0 +1,36 @@
+import sys
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from sqlalchemy import text, inspect
+from app.utils.database import engine
+
+def add_is_interpolated_column():
+    print("Adding 'is_interpolated' column to frames table...")
+    
+    try:
+        # Check if the column already exists
+        columns = [column["name"] for column in inspect(engine).get_columns("frames")]
+        
+        if "is_interpolated" in columns:
+            print("Column 'is_interpolated' already exists in frames table.")
+            return True
+        
+        with engine.connect() as connection:
+            with connection.begin():
+                connection.execute(text("""
+                ALTER TABLE frames 
+                ADD COLUMN is_interpolated BOOLEAN DEFAULT FALSE;
+                """))
+        
+        print("Added 'is_interpolated' column to frames table.")
+        return True
+        
+    except Exception as e:
+        print(f"Error updating database: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    add_is_interpolated_column()
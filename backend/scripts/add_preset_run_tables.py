@@ -0,0 +1,34 @@
+import sys
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+from sqlalchemy import inspect
+from app.utils.database import engine
+from app.models.sprite import Sprite
+from app.models.animation import Animation, PresetRun, PresetRunFrame
+
+def add_preset_run_tables():
+    print("Adding preset_runs and preset_run_frames tables...")
+    
+    try:
+        inspector = inspect(engine)
+        existing_tables = inspector.get_table_names()
+        
+        for table in (PresetRun.__table__, PresetRunFrame.__table__):
+            if table.name in existing_tables:
+                print(f"Table '{table.name}' already exists.")
+                continue
+            
+            table.create(bind=engine)
+            print(f"Created '{table.name}' table.")
+        
+        return True
+        
+    except Exception as e:
+        print(f"Error updating database: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    add_preset_run_tables()
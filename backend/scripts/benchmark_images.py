@@ -0,0 +1,207 @@
+"""
+Micro-benchmarks of the image processing hot paths.
+
+Times each stage on generated fixture images at 256, 512, 1024 and 2048 px:
+
+- alpha_restore: reapplying the original alpha channel to an edited sprite
+- black_background_removal: making the black background of an edit transparent
+- lanczos_resize: LANCZOS downscaling to half size
+- png_encode: encoding an RGBA image as PNG
+- spritesheet: compositing 4 frames into a spritesheet
+
+Results are written as JSON and compared to a stored baseline; a stage whose
+median time grew by more than the threshold is reported as a regression and
+makes the script exit with status 1. Timings depend on the machine, so record
+the baseline on the machine that runs the comparison (--update-baseline).
+
+Usage (from the backend directory):
+    python scripts/benchmark_images.py
+    python scripts/benchmark_images.py --sizes 256,512 --repeat 10 --output results.json
+    python scripts/benchmark_images.py --update-baseline
+"""
+import io
+import sys
+import json
+import time
+import platform
+import argparse
+import logging
+import statistics
+from pathlib import Path
+
+# Add the parent directory to the Python path
+sys.path.append(str(Path(__file__).parent.parent))
+
+import numpy as np
+import PIL
+from PIL import Image, ImageDraw
+
+from app.services.sprite_service import restore_alpha, remove_black_background
+from app.services.animation_service import compose_spritesheet
+
+DEFAULT_SIZES = "256,512,1024,2048"
+DEFAULT_BASELINE = Path(__file__).parent / "benchmark_images_baseline.json"
+SPRITESHEET_FRAMES = 4
+
+
+def make_sprite(size, seed=0):
+    """A figure with some texture on a transparent background, like a generated sprite"""
+    rng = np.random.default_rng(seed)
+    image = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    unit = size / 10
+    draw.ellipse([4 * unit, 1.5 * unit, 6 * unit, 3.5 * unit], fill=(230, 190, 150, 255))
+    draw.rectangle([3.8 * unit, 3.5 * unit, 6.2 * unit, 6.8 * unit], fill=(60, 90, 200, 255))
+    draw.line([(4.5 * unit, 6.8 * unit), (4 * unit, 9 * unit)], fill=(80, 60, 40, 255), width=max(1, int(unit / 2)))
+    draw.line([(5.5 * unit, 6.8 * unit), (6 * unit, 9 * unit)], fill=(80, 60, 40, 255), width=max(1, int(unit / 2)))
+
+    # Shading noise inside the figure, so PNG encoding does not get an unrealistically easy image
+    pixels = np.array(image)
+    noise = rng.integers(-12, 13, size=pixels.shape[:2] + (3,))
+    opaque = pixels[:, :, 3] > 0
+    pixels[:, :, :3][opaque] = np.clip(pixels[:, :, :3][opaque].astype(int) + noise[opaque], 0, 255)
+    return Image.fromarray(pixels)
+
+
+def make_edit_on_black(sprite):
+    """The sprite on an opaque black background, as the image API may return an edit"""
+    background = Image.new("RGBA", sprite.size, (0, 0, 0, 255))
+    background.alpha_composite(sprite)
+    return background
+
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def stages(size):
+    """The benchmarked stages at one size, as name -> zero-argument callable"""
+    sprite = make_sprite(size)
+    edit = make_edit_on_black(sprite)
+    original_alpha = np.array(sprite)[:, :, 3].copy()
+    frames = [make_sprite(size, seed) for seed in range(SPRITESHEET_FRAMES)]
+    return {
+        "alpha_restore": lambda: restore_alpha(edit, original_alpha, sprite.size),
+        "black_background_removal": lambda: remove_black_background(edit),
+        "lanczos_resize": lambda: sprite.resize((size // 2, size // 2), Image.LANCZOS),
+        "png_encode": lambda: encode_png(sprite),
+        "spritesheet": lambda: compose_spritesheet(frames),
+    }
+
+
+def time_stage(func, repeat, warmup):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return {
+        "median_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "max_ms": max(timings),
+        "repeat": repeat,
+    }
+
+
+def run(sizes, repeat, warmup):
+    results = {}
+    for size in sizes:
+        for stage, func in stages(size).items():
+            results.setdefault(stage, {})[str(size)] = time_stage(func, repeat, warmup)
+            print(f"{stage:<26}{size:>6} px {results[stage][str(size)]['median_ms']:>10.2f} ms")
+    return results
+
+
+def environment():
+    try:
+        import scipy
+        scipy_version = scipy.__version__
+    except ImportError:
+        scipy_version = None
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "pillow": PIL.__version__,
+        "numpy": np.__version__,
+        # Black background removal takes a different path without scipy
+        "scipy": scipy_version,
+    }
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Find the stages that got slower than the baseline by more than the threshold"""
+    regressions = []
+    print(f"\n{'stage':<26}{'size':>6}{'baseline ms':>13}{'now ms':>10}{'change':>9}")
+    for stage, by_size in results.items():
+        for size, timing in by_size.items():
+            reference = baseline.get("results", {}).get(stage, {}).get(size)
+            if not reference:
+                continue
+            before, now = reference["median_ms"], timing["median_ms"]
+            change = (now - before) / before if before else 0.0
+            regressed = change > threshold and now - before > min_delta_ms
+            marker = "  REGRESSION" if regressed else ""
+            print(f"{stage:<26}{size:>6}{before:>13.2f}{now:>10.2f}{change:>+9.0%}{marker}")
+            if regressed:
+                regressions.append({"stage": stage, "size": int(size), "baseline_ms": before, "median_ms": now,
+                                    "change": change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image processing hot paths")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated edge lengths (default {DEFAULT_SIZES})")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage and size")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs before the timed ones")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline JSON file to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Relative slowdown of the median that counts as a regression (default 0.25)")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0,
+                        help="Ignore slowdowns smaller than this many milliseconds, which are mostly noise")
+    args = parser.parse_args()
+
+    # The services log every processing step; keep the output to the timings
+    logging.disable(logging.WARNING)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "results": run(sizes, args.repeat, args.warmup),
+    }
+
+    baseline_path = Path(args.baseline)
+    regressions = []
+    if args.update_baseline:
+        with open(baseline_path, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"\nStored baseline in {baseline_path}")
+    elif baseline_path.exists():
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("environment") != report["environment"]:
+            print("\nNote: the baseline was recorded in a different environment; differences may not be regressions")
+        regressions = compare(report["results"], baseline, args.threshold, args.min_delta_ms)
+        report["regressions"] = regressions
+    else:
+        print(f"\nNo baseline at {baseline_path}; run with --update-baseline to store one")
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Wrote {args.output}")
+
+    if regressions:
+        print(f"\n{len(regressions)} stage(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
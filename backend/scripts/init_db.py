@@ -8,6 +8,7 @@ sys.path.append(str(Path(__file__).parent.parent))
 from app.utils.database import init_db, Base, engine
 from app.models.sprite import Sprite
 from app.models.animation import Animation
+from app.models.idempotency import IdempotencyKey
 
 def main():
     print("Initializing database...")
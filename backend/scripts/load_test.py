@@ -0,0 +1,460 @@
+"""
+End-to-end load test of the generation endpoints against a fake upstream.
+
+Starts a fake OpenAI server (images and chat, with configurable latency and
+error rate) and the FastAPI app under uvicorn, each in its own process, on a
+throwaway SQLite database. Virtual users then drive a weighted mix of
+/api/sprites/generate, /api/sprites/edit, /api/animations/generate and
+/api/animations/spritesheet/{id} for a fixed duration.
+
+Reports per endpoint: request count, status codes, throughput and p50/p95/p99
+latency, plus the DB connections each request checked out. For the app process:
+event-loop lag and DB pool usage. Needs no network access or API key.
+
+Usage (from the backend directory):
+    python scripts/load_test.py --concurrency 16 --duration 60 --upstream-latency 1.5
+    python scripts/load_test.py --mix sprites.generate=1,spritesheet=4 --json results.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import tempfile
+import threading
+import contextvars
+import multiprocessing
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Add the parent directory to the Python path (resolved, as the test runs from a scratch directory)
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import requests
+
+# Endpoints of the workload, as (method, path template)
+OPERATIONS = {
+    "sprites.generate": ("POST", "/api/sprites/generate"),
+    "sprites.edit": ("POST", "/api/sprites/edit"),
+    "animations.generate": ("POST", "/api/animations/generate"),
+    "spritesheet": ("POST", "/api/animations/spritesheet/{animation_id}"),
+}
+DEFAULT_MIX = "sprites.generate=2,sprites.edit=2,animations.generate=1,spritesheet=3"
+
+# How often the app process samples event-loop lag and DB pool usage, in seconds
+SAMPLE_INTERVAL = 0.05
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing is listening on port {port} after {timeout}s")
+
+
+# ---------------------------------------------------------------------------
+# Fake upstream
+# ---------------------------------------------------------------------------
+
+def run_fake_upstream(port, latency, jitter, error_rate, chat_latency, seed):
+    """Serve the OpenAI images and chat endpoints with canned, locally drawn responses"""
+    from app.services.image_provider_service import LocalImageProvider
+
+    # A few images per size are drawn once and handed out in turn, so the fake
+    # server spends its time sleeping like the real API rather than encoding PNGs
+    drawer = LocalImageProvider()
+    images = {}
+    images_lock = threading.Lock()
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    def image_for(size, counter=[0]):
+        with images_lock:
+            if size not in images:
+                images[size] = [
+                    drawer.generate(prompt=f"load test {variant}", size=size, background="transparent")
+                    for variant in range(4)
+                ]
+            counter[0] += 1
+            return images[size][counter[0] % len(images[size])]
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with rng_lock:
+                delay = (chat_latency if "chat" in self.path else latency) + rng.uniform(0, jitter)
+                fail = rng.random() < error_rate
+            time.sleep(delay)
+
+            if fail:
+                return self._json(500, {"error": {"message": "Simulated upstream failure", "type": "server_error"}})
+
+            if self.path.endswith("/images/generations"):
+                size = json.loads(body or b"{}").get("size") or "1024x1024"
+            elif self.path.endswith("/images/edits"):
+                match = re.search(rb'name="size"\r\n\r\n([^\r]+)', body)
+                size = match.group(1).decode() if match else "1024x1024"
+            elif self.path.endswith("/chat/completions"):
+                return self._json(200, {
+                    "id": "chatcmpl-load-test", "object": "chat.completion", "created": int(time.time()),
+                    "model": "load-test",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "A small knight with a red cape."}}],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+                })
+            else:
+                return self._json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+            self._json(200, {"created": int(time.time()), "data": [{"b64_json": image_for(size)}]})
+
+        def _json(self, status, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+# ---------------------------------------------------------------------------
+# App under test
+# ---------------------------------------------------------------------------
+
+def run_app(port, stats_path):
+    """Run the app under uvicorn, sampling event-loop lag and DB pool usage until it is stopped"""
+    import asyncio
+    import uvicorn
+    from sqlalchemy import event
+    from app.main import app
+    from app.utils.database import engine, async_engine, Base
+
+    Base.metadata.create_all(bind=engine)
+    # The services query through the async engine; its pool is the one to watch
+    app_engine = async_engine.sync_engine
+
+    # DB connection checkouts, attributed to the endpoint whose request made them
+    current_operation = contextvars.ContextVar("load_test_operation", default="other")
+    checkouts = defaultdict(int)
+    requests_seen = defaultdict(int)
+    patterns = [
+        (operation, re.compile("^" + re.sub(r"\{[^}]+\}", "[^/]+", path) + "$"))
+        for operation, (_, path) in OPERATIONS.items()
+    ]
+
+    @event.listens_for(app_engine, "checkout")
+    def count_checkout(*args):
+        checkouts[current_operation.get()] += 1
+
+    async def probed_app(scope, receive, send):
+        if scope["type"] != "http":
+            return await app(scope, receive, send)
+        operation = next((name for name, pattern in patterns if pattern.match(scope["path"])), "other")
+        requests_seen[operation] += 1
+        token = current_operation.set(operation)
+        try:
+            await app(scope, receive, send)
+        finally:
+            current_operation.reset(token)
+
+    lags = []
+    pool_samples = []
+
+    async def sample():
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(SAMPLE_INTERVAL)
+            lags.append(max(0.0, loop.time() - started - SAMPLE_INTERVAL))
+            pool_samples.append(app_engine.pool.checkedout())
+
+    async def serve():
+        server = uvicorn.Server(uvicorn.Config(probed_app, host="127.0.0.1", port=port, log_level="warning"))
+        sampler = asyncio.create_task(sample())
+        try:
+            await server.serve()
+        finally:
+            sampler.cancel()
+
+    asyncio.run(serve())
+
+    with open(stats_path, "w") as stats_file:
+        json.dump({
+            "event_loop_lag": lags,
+            "pool_checked_out": pool_samples,
+            "pool_size": app_engine.pool.size() if hasattr(app_engine.pool, "size") else None,
+            "checkouts": dict(checkouts),
+            "requests": dict(requests_seen),
+        }, stats_file)
+
+
+# ---------------------------------------------------------------------------
+# Load driver
+# ---------------------------------------------------------------------------
+
+class Workload:
+    """Builds the requests of the mix, against the sprites and animations created during setup"""
+
+    def __init__(self, base_url, mix, edit_variations, frames):
+        self.base_url = base_url
+        self.operations = list(mix)
+        self.weights = [mix[operation] for operation in self.operations]
+        self.edit_variations = edit_variations
+        self.frames = frames
+        self.sprite_ids = []
+        self.animation_ids = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def setup(self, session, sprites, animations):
+        print(f"Creating {sprites} sprites and {animations} animations to work on...")
+        for i in range(sprites):
+            response = session.post(f"{self.base_url}/api/sprites/generate",
+                                    json={"description": f"seed character {i}", "draft": True}, timeout=600)
+            response.raise_for_status()
+            self.sprite_ids.append(response.json()["id"])
+        for i in range(animations):
+            response = session.post(f"{self.base_url}/api/animations/generate", json={
+                "base_sprite_id": self.sprite_ids[i % len(self.sprite_ids)],
+                "animation_type": "walk", "num_frames": self.frames, "draft": True
+            }, timeout=600)
+            response.raise_for_status()
+            self.animation_ids.append(response.json()["id"])
+
+    def next_request(self, rng):
+        with self._lock:
+            self._counter += 1
+            n = self._counter
+        operation = rng.choices(self.operations, weights=self.weights)[0]
+        method, path = OPERATIONS[operation]
+        body = None
+        if operation == "sprites.generate":
+            body = {"description": f"load test character {n}", "draft": True}
+        elif operation == "sprites.edit":
+            body = {"spriteId": rng.choice(self.sprite_ids), "prompt": f"add detail {n}",
+                    "num_variations": self.edit_variations, "draft": True}
+        elif operation == "animations.generate":
+            body = {"base_sprite_id": rng.choice(self.sprite_ids), "animation_type": rng.choice(["walk", "idle"]),
+                    "num_frames": self.frames, "draft": True}
+        else:
+            path = path.format(animation_id=rng.choice(self.animation_ids))
+        return operation, method, f"{self.base_url}{path}", body
+
+
+def drive(workload, concurrency, duration, seed):
+    """Run `concurrency` virtual users for `duration` seconds, returning (operation, status, latency) results"""
+    results = []
+    results_lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def user(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        # One client per virtual user, so admission control and fair queuing see them apart
+        session.headers["X-Client-Id"] = f"load-test-user-{index}"
+        while time.monotonic() < stop_at:
+            operation, method, url, body = workload.next_request(rng)
+            started = time.perf_counter()
+            try:
+                status = session.request(method, url, json=body, timeout=600).status_code
+            except requests.RequestException:
+                status = 0
+            with results_lock:
+                results.append((operation, status, time.perf_counter() - started))
+
+    threads = [threading.Thread(target=user, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def summarize(results, elapsed, app_stats):
+    by_operation = defaultdict(list)
+    for operation, status, latency in results:
+        by_operation[operation].append((status, latency))
+
+    endpoints = {}
+    for operation in sorted(by_operation):
+        samples = by_operation[operation]
+        ok = [latency for status, latency in samples if 200 <= status < 300]
+        statuses = defaultdict(int)
+        for status, _ in samples:
+            statuses[str(status)] += 1
+        requests_seen = app_stats["requests"].get(operation, 0)
+        endpoints[operation] = {
+            "requests": len(samples),
+            "ok": len(ok),
+            "statuses": dict(statuses),
+            "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+            "p50_s": percentile(ok, 0.50),
+            "p95_s": percentile(ok, 0.95),
+            "p99_s": percentile(ok, 0.99),
+            "db_checkouts_per_request": app_stats["checkouts"].get(operation, 0) / requests_seen if requests_seen else None,
+        }
+
+    lags = app_stats["event_loop_lag"]
+    pool = app_stats["pool_checked_out"]
+    return {
+        "elapsed_s": elapsed,
+        "requests": len(results),
+        "throughput_rps": sum(endpoint["ok"] for endpoint in endpoints.values()) / elapsed if elapsed else 0.0,
+        "endpoints": endpoints,
+        "event_loop_lag_s": {
+            "p50": percentile(lags, 0.50), "p99": percentile(lags, 0.99), "max": max(lags) if lags else None
+        },
+        "db_pool": {
+            "size": app_stats["pool_size"],
+            "checked_out_mean": sum(pool) / len(pool) if pool else None,
+            "checked_out_max": max(pool) if pool else None,
+        },
+    }
+
+
+def print_report(report):
+    def ms(value):
+        return "-" if value is None else f"{value * 1000:.0f}"
+
+    print(f"\n{report['requests']} requests in {report['elapsed_s']:.1f}s, {report['throughput_rps']:.2f} successful req/s\n")
+    print(f"{'endpoint':<22}{'reqs':>7}{'ok':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'db/req':>8}  statuses")
+    for operation, endpoint in report["endpoints"].items():
+        checkouts = endpoint["db_checkouts_per_request"]
+        print(f"{operation:<22}{endpoint['requests']:>7}{endpoint['ok']:>7}{endpoint['throughput_rps']:>9.2f}"
+              f"{ms(endpoint['p50_s']):>9}{ms(endpoint['p95_s']):>9}{ms(endpoint['p99_s']):>9}"
+              f"{'-' if checkouts is None else f'{checkouts:.1f}':>8}  {endpoint['statuses']}")
+
+    lag = report["event_loop_lag_s"]
+    pool = report["db_pool"]
+    print(f"\nEvent-loop lag: p50 {ms(lag['p50'])} ms, p99 {ms(lag['p99'])} ms, max {ms(lag['max'])} ms")
+    mean = "-" if pool["checked_out_mean"] is None else f"{pool['checked_out_mean']:.2f}"
+    print(f"DB connections checked out: mean {mean}, max {pool['checked_out_max']} (pool size {pool['size']})")
+
+
+def parse_mix(value):
+    mix = {}
+    for item in value.split(","):
+        operation, _, weight = item.partition("=")
+        operation = operation.strip()
+        if operation not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {operation}, expected one of {', '.join(OPERATIONS)}")
+        mix[operation] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the generation endpoints against a fake upstream")
+    parser.add_argument("--concurrency", type=int, default=8, help="Virtual users sending requests back to back")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds to apply load for")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Relative weights of the operations (default {DEFAULT_MIX})")
+    parser.add_argument("--upstream-latency", type=float, default=0.5, help="Seconds the fake image API takes per image")
+    parser.add_argument("--upstream-jitter", type=float, default=0.2, help="Extra random image latency, up to this many seconds")
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0, help="Fraction of fake upstream calls failing with 500")
+    parser.add_argument("--chat-latency", type=float, default=0.2, help="Seconds the fake chat API takes per completion")
+    parser.add_argument("--edit-variations", type=int, default=1, help="num_variations of the sprite edits")
+    parser.add_argument("--frames", type=int, default=4, help="num_frames of the generated animations")
+    parser.add_argument("--seed-sprites", type=int, default=3, help="Sprites created before the load starts")
+    parser.add_argument("--seed-animations", type=int, default=2, help="Animations created before the load starts")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the workload and the fake upstream")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    parser.add_argument("--keep-static", action="store_true", help="Keep the images written to app/static")
+    args = parser.parse_args()
+    # Relative to the caller's directory, not the scratch directory the test runs in
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    # The database and coalescing leases live in a scratch directory; the SQLite URL is relative
+    workdir = tempfile.mkdtemp(prefix="load-test-")
+    os.chdir(workdir)
+    upstream_port, app_port = free_port(), free_port()
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    # Inherited by both child processes, before any app module reads its settings
+    os.environ.update({
+        "DB_TYPE": "sqlite",
+        "DB_NAME": "load_test.db",
+        "BACKEND_URL": base_url,
+        "OPENAI_API_KEY": "load-test",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{upstream_port}/v1",
+        "IMAGE_PROVIDER": "openai",
+        "COALESCE_DIR": os.path.join(workdir, "flights"),
+    })
+
+    from app.constants import STATIC_DIR
+    static_before = set(os.listdir(STATIC_DIR)) if os.path.isdir(STATIC_DIR) else set()
+    stats_path = os.path.join(workdir, "app_stats.json")
+
+    upstream = multiprocessing.Process(target=run_fake_upstream, daemon=True, args=(
+        upstream_port, args.upstream_latency, args.upstream_jitter, args.upstream_error_rate, args.chat_latency, args.seed
+    ))
+    server = multiprocessing.Process(target=run_app, args=(app_port, stats_path))
+    upstream.start()
+    server.start()
+
+    try:
+        wait_for_port(upstream_port)
+        wait_for_port(app_port)
+
+        workload = Workload(base_url, args.mix, args.edit_variations, args.frames)
+        workload.setup(requests.Session(), max(1, args.seed_sprites), max(1, args.seed_animations))
+
+        print(f"Running {args.concurrency} virtual users for {args.duration:g}s...")
+        started = time.monotonic()
+        results = drive(workload, args.concurrency, args.duration, args.seed)
+        elapsed = time.monotonic() - started
+    finally:
+        # uvicorn shuts down gracefully on SIGTERM and the app process then writes its stats
+        server.terminate()
+        server.join(timeout=60)
+        upstream.terminate()
+        if not args.keep_static and os.path.isdir(STATIC_DIR):
+            for filename in set(os.listdir(STATIC_DIR)) - static_before:
+                os.remove(os.path.join(STATIC_DIR, filename))
+
+    with open(stats_path) as stats_file:
+        app_stats = json.load(stats_file)
+
+    report = summarize(results, elapsed, app_stats)
+    report["config"] = {key: value for key, value in vars(args).items() if key != "json"}
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent=2)
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
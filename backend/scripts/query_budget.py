@@ -0,0 +1,300 @@
+"""
+Query-count and DB time regression guard for the API endpoints.
+
+Seeds a throwaway SQLite database at each dataset size and calls every
+endpoint that reads or writes the database without the image API, counting
+the SQL statements each request executes and the time they take. With a
+dataset of size N, the sprite under test has N ancestors and N children
+(next to N short chains of other sprites), N animations of N frames each,
+and its first animation has N preset runs of N planned frames.
+
+Fails (exit status 1) when an endpoint:
+
+- runs more queries at a larger size than at the smallest one, the sign of a
+  query per row (N+1) or per hop of a parent chain, or
+- runs more queries than its declared budget in ENDPOINTS.
+
+DB time and request time are reported, and with a baseline the DB time at
+the largest size is compared like in benchmark_images.py. Timings depend on
+the machine, so record the baseline on the machine that runs the comparison
+(--update-baseline). The generation endpoints are not covered; their time
+is spent in the image API and is measured by load_test.py.
+
+Usage (from the backend directory):
+    python scripts/query_budget.py
+    python scripts/query_budget.py --sizes 5,50 --repeat 5 --output results.json
+    python scripts/query_budget.py --update-baseline
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import logging
+import tempfile
+import statistics
+from collections import Counter
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add the parent directory to the Python path (resolved, as the guard runs from a scratch directory)
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+DEFAULT_SIZES = "5,20,80"
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "query_budget_baseline.json"
+
+# Endpoints under test, as name -> (method, path template, query budget, JSON body builder).
+# Path templates are filled from the IDs of the seeded dataset. Requests run in this
+# order, so the ones that delete rows come last.
+ENDPOINTS = {
+    "sprites.list": ("GET", "/api/sprites", 2, None),
+    "sprites.get": ("GET", "/api/sprites/{sprite_id}", 1, None),
+    "sprites.history": ("GET", "/api/sprites/history/{sprite_id}", 3, None),
+    "animations.by_sprite": ("GET", "/api/animations/sprite/{sprite_id}", 1, None),
+    "animations.get": ("GET", "/api/animations/{animation_id}", 2, None),
+    "animations.preset_runs": ("GET", "/api/animations/{animation_id}/preset-runs", 2, None),
+    "animations.preset_run": ("GET", "/api/animations/presets/runs/{run_id}", 2, None),
+    "animations.create": ("POST", "/api/animations/create", 3,
+                          lambda ids: {"name": "budget", "base_sprite_id": ids["sprite_id"], "fps": 12}),
+    "animations.update": ("PUT", "/api/animations/{animation_id}", 5, lambda ids: {"fps": 8}),
+    "animations.reorder": ("POST", "/api/animations/frames/reorder", 5,
+                           lambda ids: {"animation_id": ids["animation_id"],
+                                        "frame_order": list(reversed(ids["frame_ids"]))}),
+    "frames.delete": ("DELETE", "/api/animations/frames/{frame_id}", 3, None),
+    "animations.delete": ("DELETE", "/api/animations/{animation_id}", 8, None),
+}
+
+
+class StatementRecorder:
+    """Counts the statements an engine executes, and the time spent in them"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_budget_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info["query_budget_started"].pop()
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+            self.statements.append(" ".join(statement.split())[:120])
+
+    def reset(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = []
+
+
+def seed(db, size):
+    """Insert the dataset of one size; returns the IDs the endpoint paths are filled from"""
+    from app.models.sprite import Sprite
+    from app.models.animation import Animation, Frame, PresetRun, PresetRunFrame
+
+    started = datetime(2024, 1, 1)
+    clock = iter(started + timedelta(seconds=second) for second in range(10 ** 7))
+
+    def sprite(parent_id=None):
+        sprite_id = str(uuid.uuid4())
+        db.add(Sprite(id=sprite_id, url=f"/static/{sprite_id}.png", description="seeded sprite",
+                      is_base_image=True, parent_id=parent_id,
+                      edit_description="seeded edit" if parent_id else None, created_at=next(clock)))
+        return sprite_id
+
+    # Other sprites, each a root with two edits
+    for _ in range(size):
+        sprite(sprite(sprite()))
+
+    # The sprite under test, at the end of a chain of `size` ancestors, with `size` edits of its own
+    parent_id = None
+    for _ in range(size):
+        parent_id = sprite(parent_id)
+    sprite_id = sprite(parent_id)
+    for _ in range(size):
+        sprite(sprite_id)
+
+    animation_ids, frame_ids = [], []
+    for _ in range(size):
+        animation_id = str(uuid.uuid4())
+        animation_ids.append(animation_id)
+        db.add(Animation(id=animation_id, name="seeded", base_sprite_id=sprite_id, animation_type="walk",
+                         fps=12, created_at=next(clock)))
+        for order in range(size):
+            frame_id = str(uuid.uuid4())
+            frame_ids.append(frame_id)
+            db.add(Frame(id=frame_id, animation_id=animation_id, url=f"/static/{frame_id}.png",
+                         prompt="seeded frame", order=order, created_at=next(clock)))
+
+    run_id = None
+    for _ in range(size):
+        run_id = str(uuid.uuid4())
+        db.add(PresetRun(id=run_id, animation_id=animation_ids[0], preset_type="walk", status="completed",
+                         created_at=next(clock)))
+        for order in range(size):
+            db.add(PresetRunFrame(run_id=run_id, order=order, description="seeded frame", status="completed",
+                                  frame_id=frame_ids[order]))
+    db.commit()
+
+    return {
+        "sprite_id": sprite_id,
+        "animation_id": animation_ids[0],
+        "frame_ids": frame_ids[:size],
+        "frame_id": frame_ids[0],
+        "run_id": run_id,
+    }
+
+
+def measure(client, recorder, ids, repeat):
+    """Call each endpoint; reads are repeated and report their median times"""
+    results = {}
+    for name, (method, template, budget, body) in ENDPOINTS.items():
+        path = template.format(**ids)
+        runs = repeat if method == "GET" else 1
+        counts, db_times, request_times = [], [], []
+        for _ in range(runs):
+            recorder.reset()
+            started = time.perf_counter()
+            response = client.request(method, path, json=body(ids) if body else None)
+            request_times.append((time.perf_counter() - started) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: {method} {path} returned {response.status_code}: {response.text[:200]}")
+            counts.append(recorder.count)
+            db_times.append(recorder.seconds * 1000)
+        results[name] = {
+            "queries": max(counts),
+            "statements": recorder.statements,
+            "db_ms": statistics.median(db_times),
+            "request_ms": statistics.median(request_times),
+        }
+    return results
+
+
+def run(sizes, repeat):
+    from fastapi.testclient import TestClient
+    from app.main import app
+    from app.utils.database import engine, async_engine, Base, SessionLocal
+
+    # The app queries through the async engine; the dataset is seeded through the sync one
+    recorder = StatementRecorder(async_engine.sync_engine)
+    client = TestClient(app)
+    results = {}
+    for size in sizes:
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        db = SessionLocal()
+        try:
+            ids = seed(db, size)
+        finally:
+            db.close()
+        for name, result in measure(client, recorder, ids, repeat).items():
+            results.setdefault(name, {})[str(size)] = result
+            print(f"{name:<24}{size:>6} {result['queries']:>8} {result['db_ms']:>10.2f} {result['request_ms']:>12.2f}")
+    return results
+
+
+def check_budgets(results):
+    """Find the endpoints whose query count grows with the data or exceeds their budget"""
+    failures = []
+    for name, by_size in results.items():
+        budget = ENDPOINTS[name][2]
+        sizes = sorted(by_size, key=int)
+        smallest = by_size[sizes[0]]["queries"]
+        for size in sizes:
+            result = by_size[size]
+            if result["queries"] > smallest:
+                failures.append(f"{name}: {result['queries']} queries at size {size}, "
+                                f"{smallest} at size {sizes[0]}; the count grows with the data")
+            if result["queries"] > budget:
+                failures.append(f"{name}: {result['queries']} queries at size {size}, over its budget of {budget}")
+    return failures
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Find the endpoints whose DB time at the largest size grew by more than the threshold"""
+    regressions = []
+    print(f"\n{'endpoint':<24}{'size':>6}{'baseline ms':>13}{'now ms':>10}{'change':>9}")
+    for name, by_size in results.items():
+        size = max(by_size, key=int)
+        reference = baseline.get("results", {}).get(name, {}).get(size)
+        if not reference:
+            continue
+        before, now = reference["db_ms"], by_size[size]["db_ms"]
+        change = (now - before) / before if before else 0.0
+        regressed = change > threshold and now - before > min_delta_ms
+        marker = "  REGRESSION" if regressed else ""
+        print(f"{name:<24}{size:>6}{before:>13.2f}{now:>10.2f}{change:>+9.0%}{marker}")
+        if regressed:
+            regressions.append(f"{name}: DB time at size {size} went from {before:.2f}ms to {now:.2f}ms ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the query counts and DB time of the API endpoints")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated dataset sizes (default {DEFAULT_SIZES})")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs of each read endpoint per size")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE), help="Baseline JSON file to compare with")
+    parser.add_argument("--update-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.5,
+                        help="Relative growth of the DB time that counts as a regression (default 0.5)")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0,
+                        help="Ignore DB time growth smaller than this many milliseconds, which is mostly noise")
+    parser.add_argument("--show-statements", action="store_true",
+                        help="Print the statements of the endpoints that fail at the largest size")
+    args = parser.parse_args()
+
+    # The database lives in a scratch directory; the SQLite URL is relative
+    baseline_path = Path(args.baseline).resolve()
+    output_path = Path(args.output).resolve() if args.output else None
+    os.chdir(tempfile.mkdtemp(prefix="query-budget-"))
+    os.environ.update({"DB_TYPE": "sqlite", "DB_NAME": "query_budget.db"})
+
+    # The services log every request; keep the output to the measurements
+    logging.disable(logging.WARNING)
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    print(f"{'endpoint':<24}{'size':>6}{'queries':>9}{'db ms':>11}{'request ms':>13}")
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sizes": sizes,
+        "results": run(sizes, args.repeat),
+    }
+
+    failures = check_budgets(report["results"])
+    if args.update_baseline:
+        with open(baseline_path, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"\nStored baseline in {baseline_path}")
+    elif baseline_path.exists():
+        with open(baseline_path) as baseline_file:
+            failures += compare(report["results"], json.load(baseline_file), args.threshold, args.min_delta_ms)
+    else:
+        print(f"\nNo baseline at {baseline_path}; run with --update-baseline to store one")
+    report["failures"] = failures
+
+    if output_path:
+        with open(output_path, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+        print(f"Wrote {output_path}")
+
+    if failures:
+        print(f"\n{len(failures)} check(s) failed:")
+        for failure in failures:
+            print(f"  {failure}")
+            name = failure.split(":", 1)[0]
+            if args.show_statements and name in report["results"]:
+                by_size = report["results"][name]
+                for statement, count in Counter(by_size[max(by_size, key=int)]["statements"]).most_common():
+                    print(f"      {count:>5} x {statement}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ import { getAllSprites } from '../services/api';
 interface Sprite {
   id: string;
   url: string;
+  thumbnails?: Record<string, string>;
   description: string;
 }
 
@@ -84,7 +85,7 @@ const SpriteLibrary: React.FC = () => {
                   onClick={() => handleSpriteClick(sprite.id)}
                 >
                   <div className="sprite-image-wrapper">
-                    <img src={sprite.url} alt={sprite.description} className="sprite-image" />
+                    <img src={sprite.thumbnails?.['256'] ?? sprite.url} alt={sprite.description} className="sprite-image" />
                   </div>
                   <div className="sprite-details">
                     <p className="sprite-description">{sprite.description}</p>
@@ -5,6 +5,7 @@ const API_BASE_URL = 'http://localhost:8000'; // Update this with your backend U
 interface SpriteResponse {
   id: string;
   url: string;
+  thumbnails?: Record<string, string>;
   description: string;
   parent_id?: string;
   edit_description?: string;